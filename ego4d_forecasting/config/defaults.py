@@ -185,6 +185,11 @@ _C.MODEL.TTC_LOSS_FUNC = "smooth_l1"
 # STA loss weights.
 _C.MODEL.STA_LOSS_WEIGHTS = [1, 1, 1]  # VERB, NOUN, TTI
 
+# Number of clips whose backbone features are kept by the STA models at inference,
+# so that examples sharing their clip (same video and frame) in nearby batches
+# run the backbone once. Clips shared within a batch are always deduplicated.
+_C.MODEL.STA_FEATURE_CACHE_SIZE = 0
+
 # Model architectures that has one single pathway.
 _C.MODEL.SINGLE_PATHWAY_ARCH = ["c2d", "i3d", "slow"]
 
@@ -272,6 +277,11 @@ _C.SLOWFAST.FUSION_CONV_CHANNEL_RATIO = 2
 # pathway.
 _C.SLOWFAST.FUSION_KERNEL_SZ = 5
 
+# If True, the datasets return only the Fast pathway and the Slow pathway is
+# sampled from it by the model, on the device of the inputs. This avoids
+# copying and collating the frames of the Slow pathway on the host.
+_C.SLOWFAST.SAMPLE_SLOW_PATHWAY_IN_MODEL = False
+
 # -----------------------------------------------------------------------------
 # MViT options
 # -----------------------------------------------------------------------------
@@ -797,9 +807,21 @@ _C.EGO4D_STA.ANNOTATION_DIR = ""
 # Pre-extracted frames
 _C.EGO4D_STA.RGB_LMDB_DIR = ""
 
+# Context windows packed into a single record per annotation (lmdb_clips backend,
+# see dump_clips_to_lmdb_files.py)
+_C.EGO4D_STA.CLIP_LMDB_DIR = ""
+
+# Decoded context windows in a memory-mapped file (npy_mmap backend, see
+# dump_frames_to_npy_mmap.py)
+_C.EGO4D_STA.NPY_MMAP_DIR = ""
+
 # Frame key template
 _C.EGO4D_STA.FRAME_KEY_TEMPLATE = "{video_id:s}_{frame_number:07d}"
 
+# If not empty, annotations and object detections are read from the columnar
+# index in this directory (see build_sta_index.py) instead of the json files.
+_C.EGO4D_STA.ANNOTATION_INDEX_DIR = ""
+
 # Object detections
 _C.EGO4D_STA.OBJ_DETECTIONS = "object_detections.json"
 # TODO: LTA: _C.EGO4D_STA.OBJ_DETECTIONS = ""
@@ -849,9 +871,103 @@ _C.EGO4D_STA.TEST_FORCE_FLIP = False
 # IOU threshold to deem if a detection is a next active object or not
 _C.EGO4D_STA.NAO_IOU_THRESH = 0.5
 
-_C.EGO4D_STA.VIDEO_LOAD_BACKEND = "lmdb" #lmdb, pytorchvideo, decord, pyav
+_C.EGO4D_STA.VIDEO_LOAD_BACKEND = "lmdb" #lmdb, lmdb_clips, npy_mmap, pytorchvideo, decord, pyav
 # TODO: STA: _C.EGO4D_STA.VIDEO_LOAD_BACKEND = "pytorchvideo" #lmdb, pytorchvideo, decord
 
+# Maximum number of LMDB environments kept open by each data loading process
+# (LRU eviction). If 0, environments are opened and closed at every read.
+_C.EGO4D_STA.LMDB_MAX_OPEN_ENVS = 16
+
+# Maximum number of video containers kept open by each data loading process with
+# the pyav and pytorchvideo backends (LRU eviction). If 0, videos are opened and
+# closed at every read.
+_C.EGO4D_STA.PYAV_MAX_OPEN_CONTAINERS = 8
+
+# If True, the pyav backend resizes the frames with libswscale while converting
+# them to BGR, instead of converting them at full resolution and resizing them
+# with OpenCV. Outputs differ slightly due to the different scaler.
+_C.EGO4D_STA.PYAV_DECODE_RESIZE = False
+
+# Maximum number of decord video readers kept open by each data loading process
+# (LRU eviction). If 0, a reader is created at every read.
+_C.EGO4D_STA.DECORD_MAX_OPEN_READERS = 8
+
+# Threading of the video decoder of the pyav backend: "SLICE", "FRAME", "AUTO",
+# or "" for the FFmpeg default.
+_C.EGO4D_STA.VIDEO_DECODER_THREAD_TYPE = ""
+
+# Number of threads of the video decoder of the pyav and decord backends. If 0,
+# the library default is used.
+_C.EGO4D_STA.VIDEO_DECODER_THREADS = 0
+
+# Directory of the keyframe indexes of the videos (see build_keyframe_index.py).
+# If not empty, the pyav backend seeks to the keyframe preceding each clip.
+_C.EGO4D_STA.PYAV_KEYFRAME_INDEX_DIR = ""
+
+# If True, batches of the pyav backend group examples by video (see
+# STAVideoBatchSampler) and the overlapping or nearby clips of each video are
+# decoded together.
+_C.EGO4D_STA.PYAV_BATCH_DECODE = False
+
+# Maximum number of frames between clips of a video decoded together.
+_C.EGO4D_STA.PYAV_BATCH_DECODE_MAX_GAP = 32
+
+# If True, the frames of a clip read from LMDB are decoded into a single
+# preallocated `T x H x W x 3` uint8 array rather than a list of arrays.
+_C.EGO4D_STA.LMDB_DECODE_TO_ARRAY = False
+
+# Number of threads used by each data loading process to decode the frames of a
+# sample in parallel. If 0, frames are decoded serially.
+_C.EGO4D_STA.DECODE_THREADS = 0
+
+# If True, frames read from LMDB are downscaled by the JPEG decoder (by a factor
+# of 2, 4 or 8) whenever they remain at least as large as needed by the spatial
+# preprocessing (TRAIN_JITTER_SCALES[1] for training, TEST_CROP_SIZE otherwise).
+_C.EGO4D_STA.LMDB_REDUCED_DECODE = False
+
+# Height of the frames stored in the LMDBs (see dump_frames_to_lmdb_files.py).
+_C.EGO4D_STA.LMDB_FRAME_HEIGHT = 320
+
+# If not empty, the spatially transformed frames and boxes of val/test examples
+# are cached in this directory, so that later epochs skip decoding and resizing.
+_C.EGO4D_STA.SAMPLE_CACHE_DIR = ""
+
+# If True, training examples are returned as raw uint8 clips and augmented on
+# the training device by STADeviceTransform rather than by the data loaders.
+_C.EGO4D_STA.DEVICE_AUGMENTATION = False
+
+# If True, batches are collated by packed_sta_collate, which is cheaper to send from
+# the data loader workers to the main process: clips are stacked in shared memory as
+# fp16 (or uint8 with DEVICE_AUGMENTATION), boxes and targets are packed in single
+# tensors and the extra data in columns. Batches are converted back to float32
+# clips and per example lists by unpack_sta_batch, on the training device.
+_C.EGO4D_STA.PACKED_COLLATE = False
+
+# If True, val/test annotations sharing their video and frame are loaded together:
+# their clip is decoded and preprocessed once and the backbone runs once for all
+# their boxes. Batches then hold TEST.BATCH_SIZE frames rather than annotations.
+_C.EGO4D_STA.GROUP_BY_FRAME = False
+
+# If True, the random scale jittering and crop of the training examples (OpenCV
+# preprocessing) are fused in a single cv2.warpAffine per frame, interpolating only
+# the pixels of the crop. Pixel values may differ from the unfused transforms by the
+# rounding of the interpolation. This pays off when the frames are much larger than
+# the crop (e.g. full resolution frames); on frames about as large as the jitter
+# scales, cv2.resize is faster per pixel.
+_C.EGO4D_STA.FUSED_SCALE_CROP = False
+
+# If > 0, training examples are shuffled in blocks of this many annotations of the
+# same video (see STAVideoBlockSampler), so that consecutive examples loaded by a
+# worker reuse its open LMDB environments and video containers.
+_C.EGO4D_STA.SAMPLER_BLOCK_SIZE = 0
+
+# If > 0, each data loading process logs the hit rates of its LMDB environment and
+# video reader caches every this many examples.
+_C.EGO4D_STA.CACHE_STATS_PERIOD = 0
+
+# Stride, in frames, between the query frames of scripts/run_sta_streaming.py.
+_C.EGO4D_STA.STREAMING_STRIDE = 1
+
 def _assert_and_infer_cfg(cfg):
     # BN assertions.
     if cfg.BN.USE_PRECISE_STATS:
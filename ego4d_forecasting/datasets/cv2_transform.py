@@ -67,6 +67,87 @@ def random_short_side_scale_jitter_list(images, min_size, max_size, boxes=None):
     )
 
 
+def _stack_clip(images, out=None):
+    """
+    Stack the frames of a clip into a single array, without copying a clip that
+    is already one, unless an output array is given.
+    Args:
+        images (list or array): frames with dimension of
+            `height` x `width` x `channel`.
+        out (array): optional preallocated output array.
+    Returns:
+        (array): the clip with dimension of
+            `num frames` x `height` x `width` x `channel`.
+    """
+    if out is not None:
+        for idx, image in enumerate(images):
+            out[idx] = image
+        return out
+    return images if isinstance(images, np.ndarray) else np.stack(images)
+
+
+def _resize_clip(images, new_width, new_height, out=None):
+    """
+    Resize the frames of a clip into a single array, keeping their dtype.
+    Args:
+        images (list or array): frames with dimension of
+            `height` x `width` x `channel`.
+        new_width (int): the width of the resized frames.
+        new_height (int): the height of the resized frames.
+        out (array): optional preallocated output array.
+    Returns:
+        (array): the clip with dimension of
+            `num frames` x `new height` x `new width` x `channel`.
+    """
+    if out is None:
+        out = np.empty(
+            (len(images), new_height, new_width) + images[0].shape[2:],
+            dtype=images[0].dtype,
+        )
+    for idx, image in enumerate(images):
+        cv2.resize(
+            image, (new_width, new_height), dst=out[idx], interpolation=cv2.INTER_LINEAR
+        )
+    return out
+
+
+def random_short_side_scale_jitter_clip(images, min_size, max_size, boxes=None, out=None):
+    """
+    Clip-level random_short_side_scale_jitter_list: the frames are resized into
+    a single array. Frames keep their dtype (random_short_side_scale_jitter_list
+    casts them to float32), their values are the same.
+    Args:
+        images (list or array): frames to perform scale jitter. Dimension is
+            `height` x `width` x `channel`.
+        min_size (int): the minimal size to scale the frames.
+        max_size (int): the maximal size to scale the frames.
+        boxes (list): optional. Corresponding boxes to images. Dimension is
+            `num boxes` x 4.
+        out (array): optional preallocated output array.
+    Returns:
+        (array): the scaled clip with dimension of
+            `num frames` x `new height` x `new width` x `channel`.
+        (list or None): the scaled boxes with dimension of `num boxes` x 4.
+    """
+    size = int(round(1.0 / np.random.uniform(1.0 / max_size, 1.0 / min_size)))
+
+    height = images[0].shape[0]
+    width = images[0].shape[1]
+    if (width <= height and width == size) or (height <= width and height == size):
+        return _stack_clip(images, out=out), boxes
+    new_width = size
+    new_height = size
+    if width < height:
+        new_height = int(math.floor((float(height) / width) * size))
+        if boxes is not None:
+            boxes = [proposal * float(new_height) / height for proposal in boxes]
+    else:
+        new_width = int(math.floor((float(width) / height) * size))
+        if boxes is not None:
+            boxes = [proposal * float(new_width) / width for proposal in boxes]
+    return _resize_clip(images, new_width, new_height, out=out), boxes
+
+
 def scale(size, image):
     """
     Scale the short side of the image to size.
@@ -92,6 +173,33 @@ def scale(size, image):
     return img.astype(np.float32)
 
 
+def scale_clip(size, images, out=None):
+    """
+    Clip-level scale: the short side of the frames is scaled to size, and the
+    frames are resized into a single array. Frames keep their dtype (scale casts
+    them to float32), their values are the same.
+    Args:
+        size (int): size to scale the frames.
+        images (list or array): frames to perform short side scale. Dimension
+            is `height` x `width` x `channel`.
+        out (array): optional preallocated output array.
+    Returns:
+        (array): the scaled clip with dimension of
+            `num frames` x `height` x `width` x `channel`.
+    """
+    height = images[0].shape[0]
+    width = images[0].shape[1]
+    if (width <= height and width == size) or (height <= width and height == size):
+        return _stack_clip(images, out=out)
+    new_width = size
+    new_height = size
+    if width < height:
+        new_height = int(math.floor((float(height) / width) * size))
+    else:
+        new_width = int(math.floor((float(width) / height) * size))
+    return _resize_clip(images, new_width, new_height, out=out)
+
+
 def scale_boxes(size, boxes, height, width):
     """
     Scale the short side of the box to size.
@@ -150,6 +258,30 @@ def horizontal_flip_list(prob, images, order="CHW", boxes=None):
     return images, boxes
 
 
+def horizontal_flip_clip(prob, clip, boxes=None):
+    """
+    Clip-level horizontal_flip_list (HWC order). The clip is flipped through a
+    negative-stride view, materialized once by the next copy (e.g.
+    images_to_clip).
+    Args:
+        prob (float): probability to flip.
+        clip (array): clip to flip. Dimension is
+            `num frames` x `height` x `width` x `channel`.
+        boxes (list): optional. Corresponding boxes to images.
+            Dimension is `num boxes` x 4.
+    Returns:
+        (array): the flipped clip.
+        (list): optional. Corresponding boxes to images. Dimension is
+            `num boxes` x 4.
+    """
+    width = clip.shape[2]
+    if np.random.uniform() < prob:
+        if boxes is not None:
+            boxes = [flip_boxes(proposal, width) for proposal in boxes]
+        return clip[:, :, ::-1], boxes
+    return clip, boxes
+
+
 def spatial_shift_crop_list(size, images, spatial_shift_pos, boxes=None):
     """
     Perform left, center, or right crop of the given list of images.
@@ -200,6 +332,51 @@ def spatial_shift_crop_list(size, images, spatial_shift_pos, boxes=None):
     return cropped, boxes
 
 
+def spatial_shift_crop_clip(size, clip, spatial_shift_pos, boxes=None):
+    """
+    Clip-level spatial_shift_crop_list, returning a view of the clip.
+    Args:
+        size (int): size to crop.
+        clip (array): clip to crop. Dimension is
+            `num frames` x `height` x `width` x `channel`.
+        spatial_shift_pos (int): option includes 0 (left), 1 (middle), and
+            2 (right) crop.
+        boxes (list): optional. Corresponding boxes to images.
+            Dimension is `num boxes` x 4.
+    Returns:
+        cropped (array): the cropped clip.
+        boxes (list): optional. Corresponding boxes to images. Dimension is
+            `num boxes` x 4.
+    """
+    assert spatial_shift_pos in [0, 1, 2]
+
+    height = clip.shape[1]
+    width = clip.shape[2]
+    y_offset = int(math.ceil((height - size) / 2))
+    x_offset = int(math.ceil((width - size) / 2))
+
+    if height > width:
+        if spatial_shift_pos == 0:
+            y_offset = 0
+        elif spatial_shift_pos == 2:
+            y_offset = height - size
+    else:
+        if spatial_shift_pos == 0:
+            x_offset = 0
+        elif spatial_shift_pos == 2:
+            x_offset = width - size
+
+    cropped = clip[:, y_offset : y_offset + size, x_offset : x_offset + size, :]
+    assert cropped.shape[1] == size, "Image height not cropped properly"
+    assert cropped.shape[2] == size, "Image width not cropped properly"
+
+    if boxes is not None:
+        for i in range(len(boxes)):
+            boxes[i][:, [0, 2]] -= x_offset
+            boxes[i][:, [1, 3]] -= y_offset
+    return cropped, boxes
+
+
 def CHW2HWC(image):
     """
     Transpose the dimension from `channel` x `height` x `width` to
@@ -224,6 +401,36 @@ def HWC2CHW(image):
     return image.transpose([2, 0, 1])
 
 
+def images_to_clip(images, bgr_to_rgb=False, out=None):
+    """
+    Convert a list of images with values in [0, 255] to a single float32 clip
+    with values in [0, 1]. The images are stacked once into a uint8 array, which
+    is then transposed, scaled and cast in a single pass.
+    Args:
+        images (list or array): images with integer values in [0, 255].
+            Dimension is `height` x `width` x `channel`.
+        bgr_to_rgb (bool): whether to reverse the order of the channels.
+        out (array): optional preallocated float32 output array.
+    Returns:
+        (array): the clip with dimension of
+            `channel` x `num frames` x `height` x `width`.
+    """
+    if isinstance(images, np.ndarray) and images.dtype == np.uint8:
+        clip = images
+    else:
+        clip = np.empty((len(images),) + images[0].shape, dtype=np.uint8)
+        for idx, image in enumerate(images):
+            clip[idx] = image
+    clip = clip.transpose([3, 0, 1, 2])
+    if bgr_to_rgb:
+        clip = clip[::-1]
+    if out is None:
+        out = np.empty(clip.shape, dtype=np.float32)
+    # Divide in float64 as `image / 255.0` does, then cast.
+    np.divide(clip, 255.0, out=out, dtype=np.float64, casting="unsafe")
+    return out
+
+
 def color_jitter_list(images, img_brightness=0, img_contrast=0, img_saturation=0):
     """
     Perform color jitter on the list of images.
@@ -283,6 +490,64 @@ def lighting_list(imgs, alphastd, eigval, eigvec, alpha=None):
     return out_images
 
 
+def color_jitter_clip(clip, img_brightness=0, img_contrast=0, img_saturation=0):
+    """
+    Clip-level color_jitter_list, performed in place.
+    Args:
+        clip (array): float clip to perform color jitter. Dimension is
+            `channel` x `num frames` x `height` x `width`, BGR.
+        img_brightness (float): jitter ratio for brightness.
+        img_contrast (float): jitter ratio for contrast.
+        img_saturation (float): jitter ratio for saturation.
+    Returns:
+        clip (array): the jittered clip.
+    """
+    jitter = []
+    if img_brightness != 0:
+        jitter.append("brightness")
+    if img_contrast != 0:
+        jitter.append("contrast")
+    if img_saturation != 0:
+        jitter.append("saturation")
+
+    if len(jitter) > 0:
+        order = np.random.permutation(np.arange(len(jitter)))
+        for idx in range(0, len(jitter)):
+            if jitter[order[idx]] == "brightness":
+                clip = brightness_clip(img_brightness, clip)
+            elif jitter[order[idx]] == "contrast":
+                clip = contrast_clip(img_contrast, clip)
+            elif jitter[order[idx]] == "saturation":
+                clip = saturation_clip(img_saturation, clip)
+    return clip
+
+
+def lighting_clip(clip, alphastd, eigval, eigvec):
+    """
+    Clip-level lighting_list, performed in place.
+    Args:
+        clip (array): float clip to perform lighting jitter. Dimension is
+            `channel` x `num frames` x `height` x `width`, BGR.
+        alphastd (float): jitter ratio for PCA jitter.
+        eigval (list): eigenvalues for PCA jitter.
+        eigvec (list[list]): eigenvectors for PCA jitter.
+    Returns:
+        clip (array): the jittered clip.
+    """
+    if alphastd == 0:
+        return clip
+    # generate alpha1, alpha2, alpha3
+    alpha = np.random.normal(0, alphastd, size=(1, 3))
+    eig_vec = np.array(eigvec)
+    eig_val = np.reshape(eigval, (1, 3))
+    rgb = np.sum(
+        eig_vec * np.repeat(alpha, 3, axis=0) * np.repeat(eig_val, 3, axis=0), axis=1
+    )
+    for idx in range(clip.shape[0]):
+        np.add(clip[idx], rgb[2 - idx], out=clip[idx])
+    return clip
+
+
 def color_normalization(image, mean, stddev):
     """
     Perform color normalization on the image with the given mean and stddev.
@@ -295,8 +560,8 @@ def color_normalization(image, mean, stddev):
     assert len(mean) == image.shape[0], "channel mean not computed properly"
     assert len(stddev) == image.shape[0], "channel stddev not computed properly"
     for idx in range(image.shape[0]):
-        image[idx] = image[idx] - mean[idx]
-        image[idx] = image[idx] / stddev[idx]
+        np.subtract(image[idx], mean[idx], out=image[idx])
+        np.divide(image[idx], stddev[idx], out=image[idx])
     return image
 
 
@@ -375,6 +640,117 @@ def crop_boxes(boxes, x_offset, y_offset):
     return boxes
 
 
+def random_crop_clip(clip, size, boxes=None):
+    """
+    Clip-level random_crop_list (HWC order, no padding), returning a view of the
+    clip.
+    Args:
+        clip (array): clip to crop. Dimension is
+            `num frames` x `height` x `width` x `channel`.
+        size (int): size to crop.
+        boxes (list): optional. Corresponding boxes to images.
+            Dimension is `num boxes` x 4.
+    Returns:
+        cropped (array): the cropped clip.
+        boxes (list): optional. Corresponding boxes to images. Dimension is
+            `num boxes` x 4.
+    """
+    if clip.shape[1] == size and clip.shape[2] == size:
+        return clip, boxes
+    height = clip.shape[1]
+    width = clip.shape[2]
+    y_offset = 0
+    if height > size:
+        y_offset = int(np.random.randint(0, height - size))
+    x_offset = 0
+    if width > size:
+        x_offset = int(np.random.randint(0, width - size))
+    cropped = clip[:, y_offset : y_offset + size, x_offset : x_offset + size, :]
+    assert cropped.shape[1] == size, "Image not cropped properly"
+    assert cropped.shape[2] == size, "Image not cropped properly"
+
+    if boxes is not None:
+        boxes = [crop_boxes(proposal, x_offset, y_offset) for proposal in boxes]
+    return cropped, boxes
+
+
+def random_short_side_scale_jitter_crop_clip(images, min_size, max_size, size, boxes=None, out=None):
+    """
+    Fused random_short_side_scale_jitter_clip and random_crop_clip: each output
+    frame is interpolated from the input frame with a single cv2.warpAffine of
+    the combined scale and crop, so that only the pixels of the crop are
+    computed. The random draws, hence the scale, the crop and the boxes, are
+    those of the two transforms. Pixel values may differ from theirs by the
+    rounding of the interpolation.
+    Args:
+        images (list or array): frames to scale and crop. Dimension is
+            `height` x `width` x `channel`.
+        min_size (int): the minimal size to scale the frames.
+        max_size (int): the maximal size to scale the frames.
+        size (int): size to crop.
+        boxes (list): optional. Corresponding boxes to images. Dimension is
+            `num boxes` x 4.
+        out (array): optional preallocated output array.
+    Returns:
+        (array): the cropped clip with dimension of
+            `num frames` x `size` x `size` x `channel`.
+        (list or None): the transformed boxes with dimension of `num boxes` x 4.
+    """
+    scale_size = int(round(1.0 / np.random.uniform(1.0 / max_size, 1.0 / min_size)))
+
+    height = images[0].shape[0]
+    width = images[0].shape[1]
+    if (width <= height and width == scale_size) or (height <= width and height == scale_size):
+        clip, boxes = random_crop_clip(_stack_clip(images), size, boxes=boxes)
+        return _stack_clip(clip, out=out), boxes
+    new_width = scale_size
+    new_height = scale_size
+    if width < height:
+        new_height = int(math.floor((float(height) / width) * scale_size))
+        if boxes is not None:
+            boxes = [proposal * float(new_height) / height for proposal in boxes]
+    else:
+        new_width = int(math.floor((float(width) / height) * scale_size))
+        if boxes is not None:
+            boxes = [proposal * float(new_width) / width for proposal in boxes]
+
+    if new_height == size and new_width == size:
+        return _resize_clip(images, new_width, new_height, out=out), boxes
+    y_offset = 0
+    if new_height > size:
+        y_offset = int(np.random.randint(0, new_height - size))
+    x_offset = 0
+    if new_width > size:
+        x_offset = int(np.random.randint(0, new_width - size))
+    assert new_height >= size and new_width >= size, "Image not cropped properly"
+
+    # maps the pixels of the crop to the input frame, with the pixel centers
+    # convention of cv2.resize
+    scale_x = float(width) / new_width
+    scale_y = float(height) / new_height
+    affine = np.array(
+        [
+            [scale_x, 0.0, (x_offset + 0.5) * scale_x - 0.5],
+            [0.0, scale_y, (y_offset + 0.5) * scale_y - 0.5],
+        ]
+    )
+    if out is None:
+        out = np.empty((len(images), size, size) + images[0].shape[2:], dtype=images[0].dtype)
+    for idx, image in enumerate(images):
+        cv2.warpAffine(
+            image,
+            affine,
+            (size, size),
+            dst=out[idx],
+            flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+            borderMode=cv2.BORDER_REPLICATE,
+        )
+
+    if boxes is not None:
+        boxes = [crop_boxes(proposal, x_offset, y_offset) for proposal in boxes]
+    return out, boxes
+
+
 def random_crop_list(images, size, pad_size=0, order="CHW", boxes=None):
     """
     Perform random crop on a list of images.
@@ -721,6 +1097,80 @@ def contrast_list(var, images):
     return out_images
 
 
+def grayscale_clip(clip):
+    """
+    Compute the gray scale of the frames of a clip, as grayscale.
+    Args:
+        clip (array): float clip. Dimension is
+            `channel` x `num frames` x `height` x `width`, BGR.
+    Returns:
+        (array): the gray scale with dimension of
+            `num frames` x `height` x `width`.
+    """
+    # R -> 0.299, G -> 0.587, B -> 0.114.
+    gray = np.multiply(clip[2], 0.299)
+    tmp = np.multiply(clip[1], 0.587)
+    gray += tmp
+    np.multiply(clip[0], 0.114, out=tmp)
+    gray += tmp
+    return gray
+
+
+def saturation_clip(var, clip):
+    """
+    Clip-level saturation_list, performed in place.
+    Args:
+        var (float): variance.
+        clip (array): float clip to perform color saturation. Dimension is
+            `channel` x `num frames` x `height` x `width`, BGR.
+    Returns:
+        (array): the clip.
+    """
+    alpha = 1.0 + np.random.uniform(-var, var)
+
+    gray = grayscale_clip(clip)
+    np.multiply(gray, 1 - alpha, out=gray)
+    np.multiply(clip, alpha, out=clip)
+    clip += gray[None]
+    return clip
+
+
+def brightness_clip(var, clip):
+    """
+    Clip-level brightness_list, performed in place.
+    Args:
+        var (float): variance.
+        clip (array): float clip to perform color brightness. Dimension is
+            `channel` x `num frames` x `height` x `width`.
+    Returns:
+        (array): the clip.
+    """
+    alpha = 1.0 + np.random.uniform(-var, var)
+
+    np.multiply(clip, alpha, out=clip)
+    return clip
+
+
+def contrast_clip(var, clip):
+    """
+    Clip-level contrast_list, performed in place.
+    Args:
+        var (float): variance.
+        clip (array): float clip to perform color contrast. Dimension is
+            `channel` x `num frames` x `height` x `width`, BGR.
+    Returns:
+        (array): the clip.
+    """
+    alpha = 1.0 + np.random.uniform(-var, var)
+
+    # mean gray level of each frame
+    gray = grayscale_clip(clip)
+    means = np.array([np.mean(frame) for frame in gray], dtype=clip.dtype)
+    np.multiply(clip, alpha, out=clip)
+    clip += (means * (1 - alpha))[None, :, None, None]
+    return clip
+
+
 def color_jitter(image, img_brightness=0, img_contrast=0, img_saturation=0):
     """
     Perform color jitter on the given image.
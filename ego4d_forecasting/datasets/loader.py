@@ -93,7 +93,7 @@ def construct_loader(cfg, split):
         if key == "detection":
             return detection_collate
         elif key == "short_term_anticipation":
-            return sta_collate
+            return packed_sta_collate if cfg.EGO4D_STA.PACKED_COLLATE else sta_collate
         else:
             return None
 
@@ -101,10 +101,23 @@ def construct_loader(cfg, split):
     dataset = build_dataset(dataset_name, cfg, split)
     # Create a sampler for multi-process training
 
+    if hasattr(dataset, "build_batch_sampler"):
+        batch_sampler = dataset.build_batch_sampler(batch_size, shuffle, drop_last)
+        if batch_sampler is not None:
+            # the dataset loads whole batches from the lists of indices of the sampler
+            return torch.utils.data.DataLoader(
+                dataset,
+                batch_size=None,
+                sampler=batch_sampler,
+                num_workers=cfg.DATA_LOADER.NUM_WORKERS,
+                pin_memory=cfg.DATA_LOADER.PIN_MEMORY,
+                collate_fn=get_collate(cfg.DATA.TASK),
+            )
+
     sampler = None
     if not cfg.FBLEARNER:
         # Create a sampler for multi-process training
-        if hasattr(dataset, "sampler"):
+        if getattr(dataset, "sampler", None) is not None:
             sampler = dataset.sampler
         elif cfg.SOLVER.ACCELERATOR != "dp" and cfg.NUM_GPUS > 1:
             sampler = DistributedSampler(dataset)
@@ -122,6 +135,32 @@ def construct_loader(cfg, split):
     return loader
 
 
+def pad_clips(clips, out=None):
+    """
+    Stack clips of different spatial size, zero-padding them at the bottom and right.
+    Args:
+        clips (list): clips with dimension `num frames` x `height` x `width` x `channel`.
+        out (tensor or None): optional. Tensor to stack the clips into, which is
+            zero-filled first (see padded_clips_shape).
+    Returns:
+        (tensor): the stacked clips.
+    """
+    if out is None:
+        out = clips[0].new_zeros(padded_clips_shape(clips))
+    else:
+        out.zero_()
+    for i, clip in enumerate(clips):
+        out[i, :, : clip.shape[1], : clip.shape[2]] = clip
+    return out
+
+
+def padded_clips_shape(clips):
+    """Shape of the clips stacked by pad_clips"""
+    height = max(clip.shape[1] for clip in clips)
+    width = max(clip.shape[2] for clip in clips)
+    return (len(clips), clips[0].shape[0], height, width, clips[0].shape[3])
+
+
 def sta_collate(batch):
     """
     Collate function for the short term anticipation task.
@@ -130,21 +169,173 @@ def sta_collate(batch):
     Returns:
         (tuple): collated detection data batch.
     """
+    grouped = isinstance(batch[0], list)
+    if grouped:
+        # groups of examples sharing their frame (see EGO4D_STA.GROUP_BY_FRAME)
+        batch = list(itertools.chain(*batch))
     eids, inputs, pred_boxes, verb_labels, ttc_targets, _extra_data = zip(
         *batch
     )
 
+    extra_data = defaultdict(list)
+
+    for ed in _extra_data:
+        for k, v in ed.items():
+            extra_data[k].append(v)
+
+    if grouped:
+        # stack the clips shared by the examples of a group once, clip_index gives
+        # the clip of each example
+        clip_keys = list(dict.fromkeys(extra_data["clip_key"]))
+        extra_data["clip_index"] = [clip_keys.index(k) for k in extra_data["clip_key"]]
+        inputs = [inputs[extra_data["clip_index"].index(i)] for i in range(len(clip_keys))]
+
     eids = default_collate(eids)
-    inputs = default_collate(inputs)
+    if inputs[0][0].dtype == torch.uint8:
+        # raw clips to be augmented on the device, possibly of different sizes
+        inputs = [pad_clips([x[0] for x in inputs])]
+    else:
+        inputs = default_collate(inputs)
 
     pred_boxes = [torch.from_numpy(b.astype(float)) for b in pred_boxes]
     verb_labels = [torch.from_numpy(x).long() for x in verb_labels]
     ttc_targets = [torch.from_numpy(x.reshape(-1, 1)).float() for x in ttc_targets]
 
-    extra_data = defaultdict(list)
+    return eids, inputs, pred_boxes, verb_labels, ttc_targets, extra_data
 
-    for ed in _extra_data:
-        for k, v in ed.items():
-            extra_data[k].append(v)
+
+def _new_batch_tensor(shape, dtype):
+    """
+    Allocates an uninitialized batch tensor. In data loader workers, it is allocated
+    in shared memory (as done by default_collate), so that it is not copied again
+    when sent to the main process.
+    """
+    elem = torch.empty(0, dtype=dtype)
+    if torch.utils.data.get_worker_info() is None:
+        return elem.new_empty(shape)
+    storage = getattr(elem, "_typed_storage", elem.storage)()._new_shared(int(np.prod(shape)))
+    return elem.new(storage).resize_(shape)
+
+
+def _pack_column(values):
+    """
+    Packs the values of a key of the extra data of the examples in a column: arrays
+    are concatenated along with their lengths, dictionaries are packed by key and
+    other values (scalars, tuples, strings) are stacked in an array.
+    """
+    if isinstance(values[0], dict):
+        return {k: _pack_column([v[k] for v in values]) for k in values[0]}
+    if isinstance(values[0], np.ndarray):
+        lengths = np.array([len(v) for v in values])
+        # empty arrays may lack the dtype or shape of the others
+        non_empty = [v for v in values if v.size > 0]
+        return np.concatenate(non_empty if len(non_empty) > 0 else values[:1]), lengths
+    return np.array(values)
+
+
+def _unpack_column(column):
+    """Splits a column built by _pack_column into the values of each example"""
+    if isinstance(column, dict):
+        columns = {k: _unpack_column(v) for k, v in column.items()}
+        return [dict(zip(columns, values)) for values in zip(*columns.values())]
+    if isinstance(column, tuple):
+        data, lengths = column
+        return np.split(data, np.cumsum(lengths)[:-1])
+    return column.tolist()
+
+
+def packed_sta_collate(batch):
+    """
+    Collate function for the short term anticipation task, returning a batch that is
+    cheaper to send from the data loader workers to the main process than the one of
+    sta_collate (see EGO4D_STA.PACKED_COLLATE):
+    - float clips are converted to fp16 and uint8 clips are kept as they are, written
+      directly into a single tensor per pathway, allocated in shared memory.
+    - the boxes of all the examples are packed in a float64 `num boxes` x 5 tensor,
+      whose first column is the index of their clip, and their verb labels and ttc
+      targets in a single tensor each.
+    - the extra data are packed in columns (see _pack_column) rather than lists of
+      objects per example.
+    The batch is converted back to the format of sta_collate by unpack_sta_batch.
+    Args:
+        batch (tuple or list): data batch to collate.
+    Returns:
+        (tuple): collated detection data batch.
+    """
+    grouped = isinstance(batch[0], list)
+    if grouped:
+        # groups of examples sharing their frame (see EGO4D_STA.GROUP_BY_FRAME)
+        batch = list(itertools.chain(*batch))
+    eids, inputs, pred_boxes, verb_labels, ttc_targets, _extra_data = zip(
+        *batch
+    )
+
+    clip_index = np.arange(len(batch))
+    if grouped:
+        # stack the clips shared by the examples of a group once
+        clip_keys = list(dict.fromkeys(ed["clip_key"] for ed in _extra_data))
+        clip_index = np.array([clip_keys.index(ed["clip_key"]) for ed in _extra_data])
+        inputs = [inputs[list(clip_index).index(i)] for i in range(len(clip_keys))]
+
+    if inputs[0][0].dtype == torch.uint8:
+        # raw clips to be augmented on the device, possibly of different sizes
+        clips = [x[0] for x in inputs]
+        inputs = [pad_clips(clips, out=_new_batch_tensor(padded_clips_shape(clips), torch.uint8))]
+    else:
+        packed_inputs = []
+        for pathway in zip(*inputs):
+            out = _new_batch_tensor((len(pathway),) + tuple(pathway[0].shape), torch.float16)
+            for i, clip in enumerate(pathway):
+                out[i] = clip
+            packed_inputs.append(out)
+        inputs = packed_inputs
+
+    num_boxes = np.array([len(b) for b in pred_boxes])
+    packed_boxes = _new_batch_tensor((int(num_boxes.sum()), 5), torch.float64)
+    packed_boxes[:, 0] = torch.from_numpy(np.repeat(clip_index, num_boxes))
+    if len(packed_boxes) > 0:
+        packed_boxes[:, 1:] = torch.from_numpy(np.concatenate(pred_boxes))
+
+    # targets are empty for the test split
+    verb_labels, num_targets = _pack_column(list(verb_labels))
+    ttc_targets, _ = _pack_column(list(ttc_targets))
+
+    extra_data = {k: _pack_column([ed[k] for ed in _extra_data]) for k in _extra_data[0]}
+    extra_data["num_boxes"] = num_boxes
+    extra_data["num_targets"] = num_targets
+    if grouped:
+        extra_data["clip_index"] = clip_index
+
+    return (
+        list(eids),
+        inputs,
+        packed_boxes,
+        torch.from_numpy(verb_labels).long(),
+        torch.from_numpy(ttc_targets.reshape(-1, 1)).float(),
+        extra_data,
+    )
+
+
+def unpack_sta_batch(batch):
+    """
+    Converts a batch of packed_sta_collate, possibly moved to the training device, to
+    the format of sta_collate. Clips are converted back to float32 on their device.
+    """
+    eids, inputs, packed_boxes, verb_labels, ttc_targets, extra_data = batch
+    extra_data = dict(extra_data)
+
+    if inputs[0].dtype == torch.float16:
+        inputs = [x.float() for x in inputs]
+
+    num_boxes = extra_data.pop("num_boxes").tolist()
+    num_targets = extra_data.pop("num_targets").tolist()
+    pred_boxes = list(packed_boxes[:, 1:].split(num_boxes))
+    verb_labels = list(verb_labels.split(num_targets))
+    ttc_targets = list(ttc_targets.split(num_targets))
+
+    clip_index = extra_data.pop("clip_index", None)
+    extra_data = {k: _unpack_column(v) for k, v in extra_data.items()}
+    if clip_index is not None:
+        extra_data["clip_index"] = clip_index.tolist()
 
     return eids, inputs, pred_boxes, verb_labels, ttc_targets, extra_data
@@ -1,5 +1,5 @@
-import io
 import os
+import math
 import cv2
 import time
 from os.path import join
@@ -9,6 +9,7 @@ import decord
 import lmdb
 import imutils
 import json
+import hashlib
 from pathlib import Path
 from ego4d_forecasting.evaluation.sta_metrics import compute_iou
 
@@ -26,6 +27,8 @@ from ..utils import logging as logging
 from ..utils import datasets_utils as utils
 from ..utils import transform as transform
 from . import cv2_transform
+from .sta_index import STAAnnotationIndex, STADetectionIndex
+from .sta_device_transform import sample_spatial_transform
 from .build import DATASET_REGISTRY
 
 logger = logging.get_logger(__name__)
@@ -34,7 +37,11 @@ decord.bridge.set_bridge("torch")
 
 # trim module
 from fractions import Fraction
-from typing import Iterable, List
+from typing import Callable, Iterable, Iterator, List, Optional, Union
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from concurrent.futures import ThreadPoolExecutor
 import av
 import numpy as np
 
@@ -73,6 +80,8 @@ def _get_frames_pts(
     container: av.container.Container,
     include_audio: bool,
     include_additional_audio_pts: int,
+    seek_pts: Optional[int] = None,
+    stats: Optional[dict] = None,
     # pyre-fixme[11]: Annotation `Frame` is not defined as a type.
 ) -> Iterable[av.frame.Frame]:
     """
@@ -89,6 +98,12 @@ def _get_frames_pts(
             Additional amount of time to include for audio frames.
 
             pts must be relative to video base
+        seek_pts
+            pts to seek to before decoding, e.g. the keyframe preceding the first
+            frame. If None, seeks slightly before the first frame.
+        stats
+            if given, the number of decoded and returned video frames is added to
+            its "frames_decoded" and "frames_returned" entries
     """
     assert len(container.streams.video) == 1
 
@@ -124,7 +139,8 @@ def _get_frames_pts(
 
     # seek to the point we need in the video
     # with some buffer room, just in-case the seek is not precise
-    seek_pts = max(0, min_pts - 2 * video_pt_diff)
+    if seek_pts is None:
+        seek_pts = max(0, min_pts - 2 * video_pt_diff)
     container.seek(seek_pts, stream=video_stream)
     if "audio" in streams_to_decode:
         assert len(container.streams.audio) == 1
@@ -140,6 +156,7 @@ def _get_frames_pts(
     previous_audio_pts = None
 
     yielded_frames = 0
+    decoded_frames = 0
     for frame in container.decode(**streams_to_decode):
 
         if isinstance(frame, av.AudioFrame):
@@ -158,6 +175,7 @@ def _get_frames_pts(
                 break
 
         elif isinstance(frame, av.VideoFrame):
+            decoded_frames += 1
             video_time_sec = pts_to_time_seconds(frame.pts, video_base)
             if video_time_sec >= clip_end_sec:
                 break
@@ -177,6 +195,10 @@ def _get_frames_pts(
                 yield frame
                 yielded_frames += 1
 
+    if stats is not None:
+        stats["frames_decoded"] = stats.get("frames_decoded", 0) + decoded_frames
+        stats["frames_returned"] = stats.get("frames_returned", 0) + yielded_frames
+
     if yielded_frames<len(video_pts_set):
         for _ in range(len(video_pts_set)-yielded_frames):
             yield None
@@ -187,6 +209,8 @@ def _get_frames(
     container: av.container.Container,
     include_audio: bool,
     audio_buffer_frames: int = 0,
+    keyframe_pts: Optional[np.ndarray] = None,
+    stats: Optional[dict] = None,
 ) -> Iterable[av.frame.Frame]:
     assert len(container.streams.video) == 1
 
@@ -205,18 +229,178 @@ def _get_frames(
     time_pts_set = [
         frame_index_to_pts(f, video_start, video_pt_diff) for f in video_frames
     ]
-    frames = list(_get_frames_pts(time_pts_set, container, include_audio, audio_buffer_pts))
+    seek_pts = None
+    if keyframe_pts is not None:
+        seek_pts = _preceding_keyframe_pts(keyframe_pts, min(time_pts_set))
+    frames = list(_get_frames_pts(time_pts_set, container, include_audio, audio_buffer_pts, seek_pts=seek_pts, stats=stats))
     assert len(frames) == len(video_frames)
     return frames
 
+def _preceding_keyframe_pts(keyframe_pts: np.ndarray, pts: int) -> int:
+    """pts of the last keyframe at or before `pts` (the first keyframe if none)"""
+    idx = int(np.searchsorted(keyframe_pts, pts, side="right")) - 1
+    return int(keyframe_pts[max(idx, 0)])
+
+
+def build_keyframe_index(path_to_video, path_to_index) -> None:
+    """
+    Writes the keyframe index of a video, read by PyAVVideoReader to seek to the
+    keyframe preceding the requested frames. Packets are demuxed but not decoded.
+
+    Args:
+        path_to_video (str): the video file.
+        path_to_index (str): the `.npz` sidecar file, storing the pts and byte
+            offsets of the keyframes along with the start time and the pts
+            difference between consecutive frames of the video stream.
+    """
+    with av.open(str(path_to_video)) as container:
+        video_stream = container.streams.video[0]
+        pts, pos = [], []
+        for packet in container.demux(video_stream):
+            if packet.is_keyframe and packet.pts is not None:
+                pts.append(packet.pts)
+                pos.append(packet.pos if packet.pos is not None else -1)
+        start_time = video_stream.start_time
+        pt_diff = pts_difference_per_frame(video_stream.average_rate, video_stream.time_base)
+
+    order = np.argsort(pts, kind="stable")
+    np.savez(
+        path_to_index,
+        pts=np.array(pts, dtype=np.int64)[order],
+        pos=np.array(pos, dtype=np.int64)[order],
+        start_time=np.int64(start_time),
+        pt_diff=np.int64(pt_diff),
+    )
+
+
+@lru_cache(maxsize=1024)
+def _load_keyframe_index(path_to_index: str) -> dict:
+    with np.load(path_to_index) as index:
+        return {k: index[k] for k in index.files}
+
+
+def plan_decode(frame_lists: List[List[int]], max_gap: int = 0, decode_cost: Optional[Callable[[List[int]], int]] = None) -> List[tuple]:
+    """
+    Groups the frame requests of a video into spans decoded at once.
+
+    Requests are sorted by their first frame, and a request is merged into the
+    current span if it starts at most `max_gap` frames after the span ends, or if
+    decoding the span through it is estimated to cost no more frames than decoding
+    the span and the request separately (seeking would not skip any decoding then).
+
+    Args:
+        frame_lists (list): the frame numbers of each request.
+        max_gap (int): maximum number of frames between merged requests.
+        decode_cost (callable): estimated number of frames decoded to read a list of
+            frames (see PyAVVideoReader.decode_cost), if known.
+    Returns:
+        (list): for each span, the sorted unique frames to decode and the indices of
+            the requests it serves.
+    """
+    order = sorted(range(len(frame_lists)), key=lambda i: min(frame_lists[i]))
+    spans = []
+    for i in order:
+        start, end = min(frame_lists[i]), max(frame_lists[i])
+        if len(spans) > 0:
+            span_start, span_end = spans[-1][0], spans[-1][1]
+            merge = start - span_end <= max_gap
+            if not merge and decode_cost is not None:
+                merged_cost = decode_cost([span_start, max(span_end, end)])
+                merge = merged_cost <= decode_cost([span_start, span_end]) + decode_cost(frame_lists[i])
+            if merge:
+                spans[-1][1] = max(span_end, end)
+                spans[-1][2].append(i)
+                continue
+        spans.append([start, end, [i]])
+
+    return [
+        (sorted(set(int(f) for r in requests for f in frame_lists[r])), requests)
+        for _, _, requests in spans
+    ]
+
+
+def _frame_to_bgr(frame: av.VideoFrame, height: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Scales a decoded frame to `height` (keeping the aspect ratio as imutils.resize)
+    and converts it to BGR with a single libswscale call, copying the result to `out`
+    if given.
+    """
+    width = int(frame.width * (height / float(frame.height)))
+    frame = frame.reformat(width=width, height=height, format="bgr24", interpolation="AREA")
+    plane = frame.planes[0]
+    # rows of the plane may be padded
+    img = np.frombuffer(plane, np.uint8).reshape(height, plane.line_size)[:, : width * 3].reshape(height, width, 3)
+    if out is None:
+        return img.copy()
+    out[...] = img
+    return out
+
+
 class PyAVVideoReader(object):
-    def __init__(self, path_to_video, include_audio=False, audio_buffer_frames=0, height=None):
+    def __init__(self, path_to_video, include_audio=False, audio_buffer_frames=0, height=None, max_open_containers=0, keyframe_index=None, stats=None, thread_type=None, thread_count=0, decode_resize=False):
+        """
+        Args:
+            max_open_containers (int): maximum number of video containers kept open by
+                each process. If 0, the video is opened and closed at every call.
+            keyframe_index (str): the keyframe index of the video written by
+                `build_keyframe_index`, if any. Reads then seek to the keyframe
+                preceding the requested frames.
+            stats (dict): if given, the number of requests, decoded frames and
+                returned frames are accumulated in it.
+            thread_type (str): threading of the video decoder ("SLICE", "FRAME" or
+                "AUTO"). If None, the FFmpeg default is used.
+            thread_count (int): number of threads of the video decoder. If 0, the
+                FFmpeg default is used.
+            decode_resize (bool): if True, frames are resized to `height` by libswscale
+                while converting them to BGR, rather than converted at full resolution
+                and resized with OpenCV.
+        """
         self.path_to_video = path_to_video
         self.include_audio = include_audio
         self.audio_buffer_frames = audio_buffer_frames
         self.height = height
-        
+        self.keyframe_index = _load_keyframe_index(str(keyframe_index)) if keyframe_index is not None else None
+        self.stats = stats
+        self.thread_type = thread_type
+        self.thread_count = thread_count
+        self.decode_resize = decode_resize
+        self.max_open_containers = max_open_containers
+
+    @property
+    def container_cache(self) -> Optional["LRUHandleCache"]:
+        return _PYAV_CONTAINER_CACHE if self.max_open_containers > 0 else None
+
+    def _container_key(self):
+        return (self.path_to_video, self.thread_type, self.thread_count)
+
+    @contextmanager
+    def _get_container(self) -> Iterator[av.container.InputContainer]:
+        if self.max_open_containers <= 0:
+            with _open_container(self._container_key()) as container:
+                yield container
+        else:
+            # cached containers stay open after use. Reading always starts with a seek,
+            # which also flushes the decoder, so no state leaks between calls
+            container = _PYAV_CONTAINER_CACHE.get(self._container_key(), max_size=self.max_open_containers)
+            try:
+                yield container
+            except Exception:
+                # the demuxer may be left in an inconsistent state, reopen on next use
+                _PYAV_CONTAINER_CACHE.discard(self._container_key())
+                raise
+
     def __getitem__(self, frame_list):
+        return self.get(frame_list)
+
+    def get(self, frame_list, out=None):
+        """
+        Reads the frames of `frame_list` as BGR arrays (None for missing frames).
+
+        Args:
+            out (ndarray): if given, a `num frames` x `height` x `width` x 3 uint8
+                array the frames are written to. The returned frames are then views
+                of it, so that the same buffer can be reused across calls.
+        """
         if isinstance(frame_list, (int, float)):
             frame_list = [int(frame_list)]
         elif not isinstance(frame_list,(list,tuple)):
@@ -224,18 +408,243 @@ class PyAVVideoReader(object):
         else:
             frame_list = list(frame_list)
         
-        with av.open(self.path_to_video) as input_video:
-            frames = _get_frames(frame_list, input_video, include_audio=self.include_audio, audio_buffer_frames=self.audio_buffer_frames)
+        keyframe_pts = self.keyframe_index["pts"] if self.keyframe_index is not None else None
+        if self.stats is not None:
+            self.stats["requests"] = self.stats.get("requests", 0) + 1
+        with self._get_container() as input_video:
+            frames = _get_frames(frame_list, input_video, include_audio=self.include_audio, audio_buffer_frames=self.audio_buffer_frames, keyframe_pts=keyframe_pts, stats=self.stats)
             frames = list(frames)
+        if self.height is not None and self.decode_resize:
+            # scaling and conversion in a single pass, same output size as imutils.resize
+            frames = [
+                _frame_to_bgr(f, self.height, out[i] if out is not None else None) if f is not None else None
+                for i, f in enumerate(frames)
+            ]
+            return frames
+
         frames = [f.to_ndarray(format="bgr24") if f is not None else None for f in frames]
         if self.height is not None:
             frames = [imutils.resize(f, height=self.height) if f is not None else None for f in frames]
+        if out is not None:
+            for i, f in enumerate(frames):
+                if f is not None:
+                    out[i] = f
+                    frames[i] = out[i]
         return frames
 
+    def iter_frames(self) -> Iterator[tuple]:
+        """
+        Decodes the whole video once, yielding (frame number, frame) pairs in order.
+        Frames are converted and resized as by `get`.
+        """
+        with self._get_container() as input_video:
+            video_stream = input_video.streams.video[0]
+            video_start = video_stream.start_time or 0
+            video_pt_diff = pts_difference_per_frame(video_stream.average_rate, video_stream.time_base)
+            # cached containers may have been left anywhere in the video
+            input_video.seek(video_start, stream=video_stream)
+            for frame in input_video.decode(video=0):
+                if self.stats is not None:
+                    self.stats["frames_decoded"] = self.stats.get("frames_decoded", 0) + 1
+                    self.stats["frames_returned"] = self.stats.get("frames_returned", 0) + 1
+                frame_number = int(round((frame.pts - video_start) / video_pt_diff))
+                if self.height is not None and self.decode_resize:
+                    yield frame_number, _frame_to_bgr(frame, self.height)
+                else:
+                    img = frame.to_ndarray(format="bgr24")
+                    if self.height is not None:
+                        img = imutils.resize(img, height=self.height)
+                    yield frame_number, img
+
+    def get_batch(self, frame_lists, max_gap=0) -> List[List[Optional[np.ndarray]]]:
+        """
+        Reads several frame lists of the video, decoding overlapping or nearby ones
+        together (see `plan_decode`). Frames shared by several lists are decoded once.
+
+        Returns:
+            (list): the frames of each list, as returned by `__getitem__`.
+        """
+        frame_lists = [[int(f) for f in frames] for frames in frame_lists]
+        decode_cost = self.decode_cost if self.keyframe_index is not None else None
+
+        out = [None] * len(frame_lists)
+        for frames, requests in plan_decode(frame_lists, max_gap, decode_cost):
+            decoded = dict(zip(frames, self[frames]))
+            for r in requests:
+                out[r] = [decoded[f] for f in frame_lists[r]]
+        return out
+
+    def decode_cost(self, frame_list) -> int:
+        """
+        Estimated number of frames decoded to read `frame_list`, from the keyframe
+        preceding the first frame to the last one. Requires the keyframe index.
+        """
+        index = self.keyframe_index
+        first = frame_index_to_pts(min(frame_list), int(index["start_time"]), int(index["pt_diff"]))
+        keyframe = _preceding_keyframe_pts(index["pts"], first)
+        return (max(frame_list) - min(frame_list)) + max(first - keyframe, 0) // int(index["pt_diff"]) + 1
+
+    def close(self) -> None:
+        """Closes all the video containers cached by the current process"""
+        if self.max_open_containers > 0:
+            _PYAV_CONTAINER_CACHE.close()
+
+
+class LRUHandleCache(object):
+    """
+    Per-process LRU cache of open handles (LMDB environments, video containers, ...).
+
+    At most `max_size` handles are kept open; the least recently used one is closed
+    when the limit is exceeded. The limit can also be given by each `get` call, so
+    that users of a shared cache (e.g. readers configured with different numbers of
+    open handles) each apply their own. The cache is fork-safe: handles are never
+    shared across processes, so when it is accessed from a process other than the
+    one that filled it (e.g. a DataLoader worker forked after the dataset was built)
+    the inherited handles are dropped and reopened on demand.
+
+    Handles are identified by `key_fn(key)`, `key` itself by default, while
+    `open_fn` receives the full key (e.g. the path and the options to open it with).
+    """
+
+    def __init__(self, open_fn, close_fn=None, max_size=16, key_fn=None):
+        self._open_fn = open_fn
+        self._close_fn = close_fn
+        self._key_fn = key_fn if key_fn is not None else (lambda key: key)
+        self.max_size = max_size
+        self._reset()
+
+    def _reset(self):
+        self._handles = OrderedDict()
+        self._pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, max_size=None):
+        """
+        Returns the handle of `key`, opening it if needed. At most `max_size` handles
+        (the one of the cache if None) are then kept open.
+        """
+        handle = self.peek(key)
+        if handle is not None:
+            self.hits += 1
+            self._handles.move_to_end(self._key_fn(key))
+        else:
+            self.misses += 1
+            handle = self._open_fn(key)
+            self._handles[self._key_fn(key)] = handle
+
+        # the handle just returned is the most recently used, hence never closed
+        max_size = self.max_size if max_size is None else max_size
+        while len(self._handles) > max(max_size, 1):
+            _, evicted = self._handles.popitem(last=False)
+            if self._close_fn is not None:
+                self._close_fn(evicted)
+        return handle
+
+    def peek(self, key):
+        """Returns the handle of `key` if it is open, None otherwise"""
+        if self._pid != os.getpid():
+            # do not close handles opened by the parent process, just forget them
+            self._reset()
+        return self._handles.get(self._key_fn(key))
+
+    def discard(self, key):
+        """Closes and forgets the handle of `key`, if any"""
+        if self._pid != os.getpid():
+            self._reset()
+        handle = self._handles.pop(self._key_fn(key), None)
+        if handle is not None and self._close_fn is not None:
+            self._close_fn(handle)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def close(self):
+        if self._pid == os.getpid() and self._close_fn is not None:
+            for handle in self._handles.values():
+                self._close_fn(handle)
+        self._reset()
+
+    def __len__(self):
+        return len(self._handles)
+
+    def __getstate__(self):
+        # open handles cannot be pickled (e.g. when workers are spawned)
+        state = self.__dict__.copy()
+        state["_handles"] = OrderedDict()
+        return state
+
+
+def _open_lmdb(key) -> lmdb.Environment:
+    path, map_size, readonly, lock = key
+    return lmdb.open(path, map_size=map_size, readonly=readonly, lock=lock)
+
+
+# LMDB does not allow opening the same environment twice in a process, hence all the
+# Ego4DHLMDB instances of a process (e.g. train and val datasets) share the same cache,
+# where environments are identified by their path only
+_LMDB_ENV_CACHE = LRUHandleCache(_open_lmdb, lambda env: env.close(), max_size=0, key_fn=lambda key: key[0])
+
+def _open_container(key) -> av.container.InputContainer:
+    path, thread_type, thread_count = key
+    container = av.open(path)
+    # decoder threading must be set before the first frame is decoded
+    video_stream = container.streams.video[0]
+    if thread_type:
+        video_stream.thread_type = thread_type
+    if thread_count > 0:
+        video_stream.thread_count = thread_count
+    return container
+
+
+# Video containers opened by PyAVVideoReader, shared by all the readers of a process
+_PYAV_CONTAINER_CACHE = LRUHandleCache(_open_container, lambda container: container.close(), max_size=0)
+
+
+def _open_decord_reader(key) -> VideoReader:
+    path, height, width, num_threads = key
+    return VideoReader(path, height=height, width=width, num_threads=num_threads)
+
+
+# decord readers are released when garbage collected
+_DECORD_READER_CACHE = LRUHandleCache(_open_decord_reader, max_size=0)
+
+# Videos opened by the pytorchvideo backend
+_ENCODED_VIDEO_CACHE = LRUHandleCache(
+    partial(EncodedVideo.from_path, decode_audio=False), lambda video: video.close(), max_size=0
+)
+
+
+def handle_cache_stats():
+    """Returns the (hits, misses) of the handle caches used by this process"""
+    caches = {
+        "lmdb envs": _LMDB_ENV_CACHE,
+        "pyav containers": _PYAV_CONTAINER_CACHE,
+        "decord readers": _DECORD_READER_CACHE,
+        "pytorchvideo videos": _ENCODED_VIDEO_CACHE,
+    }
+    return {name: (c.hits, c.misses) for name, c in caches.items() if c.hits + c.misses > 0}
 
 
 class Ego4DHLMDB():
-    def __init__(self, path_to_root: Path, readonly=False, lock=False, frame_template="{video_id:s}_{frame_number:010d}", map_size=1099511627776) -> None:
+    # imread flags to let libjpeg downscale the frames by the given factor during decoding
+    REDUCED_DECODE_FLAGS = {
+        1: cv2.IMREAD_COLOR,
+        2: cv2.IMREAD_REDUCED_COLOR_2,
+        4: cv2.IMREAD_REDUCED_COLOR_4,
+        8: cv2.IMREAD_REDUCED_COLOR_8,
+    }
+
+    def __init__(self, path_to_root: Path, readonly=False, lock=False, frame_template="{video_id:s}_{frame_number:010d}", map_size=1099511627776, max_open_envs=0, decode_threads=0) -> None:
+        """
+        Args:
+            max_open_envs (int): maximum number of LMDB environments kept open by each
+                process. If 0, an environment is opened and closed at every call,
+                unless another instance keeps it open.
+            decode_threads (int): number of threads used to decode the frames read by
+                `get_batch` in parallel. If 0, frames are decoded serially.
+        """
         self.environments = {}
         self.path_to_root = path_to_root
         if isinstance(self.path_to_root, str):
@@ -245,9 +654,48 @@ class Ego4DHLMDB():
         self.lock = lock
         self.map_size = map_size
         self.frame_template = frame_template
+        self.max_open_envs = max_open_envs
+        self.decode_threads = decode_threads
+        self._decode_pool = None
+        self._decode_pool_pid = None
+
+    def _get_decode_pool(self) -> Optional[ThreadPoolExecutor]:
+        if self.decode_threads <= 0:
+            return None
+        # threads do not survive fork, so every process creates its own pool
+        if self._decode_pool is None or self._decode_pool_pid != os.getpid():
+            self._decode_pool = ThreadPoolExecutor(max_workers=self.decode_threads)
+            self._decode_pool_pid = os.getpid()
+        return self._decode_pool
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_decode_pool"] = None
+        return state
+
+    @property
+    def env_cache(self) -> Optional[LRUHandleCache]:
+        return _LMDB_ENV_CACHE if self.max_open_envs > 0 else None
+
+    def _env_key(self, parent: str):
+        return (str(self.path_to_root / parent), self.map_size, self.readonly, self.lock)
+
+    @contextmanager
+    def _get_parent(self, parent: str) -> Iterator[lmdb.Environment]:
+        if self.max_open_envs > 0:
+            # cached environments stay open after use
+            yield _LMDB_ENV_CACHE.get(self._env_key(parent), max_size=self.max_open_envs)
+        elif _LMDB_ENV_CACHE.peek(self._env_key(parent)) is not None:
+            # the environment cannot be opened again while another instance keeps it open
+            yield _LMDB_ENV_CACHE.peek(self._env_key(parent))
+        else:
+            with _open_lmdb(self._env_key(parent)) as env:
+                yield env
 
-    def _get_parent(self, parent: str) -> lmdb.Environment:
-        return lmdb.open(str(self.path_to_root / parent), map_size=self.map_size, readonly=self.readonly, lock=self.lock)
+    def close(self) -> None:
+        """Closes all the LMDB environments cached by the current process"""
+        if self.max_open_envs > 0:
+            _LMDB_ENV_CACHE.close()
 
     def put_batch(self, video_id: str, frames: List[int], data: List[np.ndarray]) -> None:
         with self._get_parent(video_id) as env:
@@ -262,27 +710,97 @@ class Ego4DHLMDB():
                 with env.begin(write=True) as txn:
                     txn.put(self.frame_template.format(video_id=video_id,frame_number=frame).encode(), cv2.imencode('.jpg', data)[1])
 
-    def get(self, video_id: str, frame: int) -> np.ndarray:
+    @staticmethod
+    def _decode(data, flags=cv2.IMREAD_COLOR) -> Optional[np.ndarray]:
+        """Decodes a JPEG directly from the buffer returned by LMDB, without copying it"""
+        if data is None:
+            return None
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+
+    def get(self, video_id: str, frame: int, reduce=1) -> np.ndarray:
         with self._get_parent(video_id) as env:
-            with env.begin(write=False) as txn:
+            # buffers are only valid within the transaction, so decode them here
+            with env.begin(write=False, buffers=True) as txn:
                 data = txn.get(self.frame_template.format(video_id=video_id,frame_number=frame).encode())
+                return self._decode(data, self.REDUCED_DECODE_FLAGS[reduce])
 
-                file_bytes = np.asarray(
-                    bytearray(io.BytesIO(data).read()), dtype=np.uint8
-                )
-                return cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-    
-    def get_batch(self, video_id: str, frames: List[int]) -> List[np.ndarray]:
-        out = []
+    def get_batch(self, video_id: str, frames: List[int], stack=False, out=None, reduce=1) -> Union[List[np.ndarray], np.ndarray]:
+        """
+        Reads and decodes a list of frames of a video.
+
+        Args:
+            video_id (str): the id of the video.
+            frames (list): frame numbers to read.
+            stack (bool): if True, decode the frames into a single `T x H x W x 3`
+                uint8 array instead of a list of arrays.
+            out (ndarray): optional preallocated `T x H x W x 3` uint8 array to decode
+                the frames into. Implies `stack=True`.
+            reduce (int): downscaling factor (1, 2, 4 or 8) applied by the JPEG decoder
+                through its scaled IDCT. Each side of the frames is divided by `reduce`,
+                rounding up.
+        Returns:
+            the list of decoded frames (with None for the frames which could not be
+            read) or, when stacking, the array of decoded frames (None if any frame
+            could not be read).
+        """
+        with self._get_parent(video_id) as env:
+            with env.begin(buffers=True) as txn:
+                buffers = [
+                    txn.get(self.frame_template.format(video_id=video_id,frame_number=frame).encode())
+                    for frame in frames
+                ]
+                return self._decode_buffers(buffers, stack=stack, out=out, reduce=reduce)
+
+    def get_encoded_batch(self, video_id: str, frames: List[int]) -> List[Optional[bytes]]:
+        """Reads a list of frames of a video without decoding them"""
         with self._get_parent(video_id) as env:
             with env.begin() as txn:
-                for frame in frames:
-                    data = txn.get(self.frame_template.format(video_id=video_id,frame_number=frame).encode())
-                    file_bytes = np.asarray(
-                        bytearray(io.BytesIO(data).read()), dtype=np.uint8
-                    )
-                    out.append(cv2.imdecode(file_bytes, cv2.IMREAD_COLOR))
-            return out
+                return [
+                    txn.get(self.frame_template.format(video_id=video_id,frame_number=frame).encode())
+                    for frame in frames
+                ]
+
+    def _decode_buffers(self, buffers, stack=False, out=None, reduce=1) -> Union[List[np.ndarray], np.ndarray]:
+        """
+        Decodes a list of JPEG buffers (None for missing frames). Buffers returned by
+        LMDB are only valid within their transaction. See `get_batch`.
+        """
+        stack = stack or out is not None
+        decode = partial(self._decode, flags=self.REDUCED_DECODE_FLAGS[reduce])
+        # cv2.imdecode releases the GIL, hence frames can be decoded in parallel
+        pool = self._get_decode_pool()
+
+        if not stack:
+            if pool is None:
+                return [decode(data) for data in buffers]
+            return list(pool.map(decode, buffers))
+
+        if any(data is None for data in buffers):
+            return None
+
+        imgs = out
+        indices = list(range(len(buffers)))
+        if imgs is None:
+            # the first frame determines the size of the clip
+            img = decode(buffers[0])
+            if img is None:
+                return None
+            imgs = np.empty((len(buffers),) + img.shape, dtype=np.uint8)
+            imgs[0] = img
+            indices = indices[1:]
+
+        def decode_into(i):
+            img = decode(buffers[i])
+            if img is None or img.shape != imgs.shape[1:]:
+                return False
+            imgs[i] = img
+            return True
+
+        if pool is None:
+            decoded = [decode_into(i) for i in indices]
+        else:
+            decoded = list(pool.map(decode_into, indices))
+        return imgs if all(decoded) else None
 
     def get_existing_keys(self):
         keys = []
@@ -292,6 +810,260 @@ class Ego4DHLMDB():
                     keys += list(txn.cursor().iternext(values=False))
         return keys
 
+
+class Ego4DClipLMDB(Ego4DHLMDB):
+    """
+    Stores the whole context window of each annotation as a single LMDB record, keyed
+    by the last frame of the window, so that a sample is fetched with a single lookup.
+    A record is made of a header of little endian uint32 values (number of frames `n`,
+    the `n` frame numbers and `n + 1` offsets relative to the end of the header)
+    followed by the concatenated JPEG frames.
+    """
+
+    @staticmethod
+    def pack_clip(frames: List[int], data: List[Union[np.ndarray, bytes]]) -> bytes:
+        """Packs a list of frames (decoded images or JPEG buffers) into a record"""
+        jpegs = [
+            cv2.imencode('.jpg', d)[1].tobytes() if isinstance(d, np.ndarray) else bytes(d)
+            for d in data
+        ]
+        offsets = np.cumsum([0] + [len(j) for j in jpegs])
+        header = np.concatenate([[len(jpegs)], frames, offsets]).astype('<u4')
+        return header.tobytes() + b''.join(jpegs)
+
+    @staticmethod
+    def unpack_clip(record, frames: List[int]) -> List[Optional[memoryview]]:
+        """Returns the JPEG buffers of the requested frames (None if not in the record)"""
+        record = memoryview(record)
+        n = int(np.frombuffer(record, dtype='<u4', count=1)[0])
+        header = np.frombuffer(record, dtype='<u4', count=2 * n + 2)
+        clip_frames, offsets = header[1:n + 1], header[n + 1:] + 4 * (2 * n + 2)
+        positions = {int(f): i for i, f in enumerate(clip_frames)}
+        buffers = []
+        for frame in frames:
+            i = positions.get(int(frame))
+            buffers.append(record[offsets[i]:offsets[i + 1]] if i is not None else None)
+        return buffers
+
+    def put_clip(self, video_id: str, frames: List[int], data: List[Union[np.ndarray, bytes]]) -> None:
+        with self._get_parent(video_id) as env:
+            with env.begin(write=True) as txn:
+                txn.put(self.frame_template.format(video_id=video_id,frame_number=frames[-1]).encode(), self.pack_clip(frames, data))
+
+    def get_batch(self, video_id: str, frames: List[int], stack=False, out=None, reduce=1) -> Union[List[np.ndarray], np.ndarray]:
+        """
+        Reads and decodes a list of frames from the record of the context window ending
+        at the last of them. See `Ego4DHLMDB.get_batch`.
+        """
+        with self._get_parent(video_id) as env:
+            with env.begin(buffers=True) as txn:
+                record = txn.get(self.frame_template.format(video_id=video_id,frame_number=frames[-1]).encode())
+                if record is not None:
+                    buffers = self.unpack_clip(record, frames)
+                else:
+                    buffers = [None] * len(frames)
+                return self._decode_buffers(buffers, stack=stack, out=out, reduce=reduce)
+
+class Ego4DFrameMemmap(object):
+    """
+    Decoded context windows stored in a single memory-mapped uint8 file. The index maps
+    the key of each window (video id and last frame, formatted with `frame_template`)
+    to its offset in the file, its first frame number and its `T x H x W x 3` shape.
+    """
+    DATA_FILE = "frames.u8"
+    INDEX_FILE = "index.json"
+
+    def __init__(self, path_to_root: Path, frame_template="{video_id:s}_{frame_number:010d}") -> None:
+        self.path_to_root = Path(path_to_root)
+        self.frame_template = frame_template
+        with open(self.path_to_root / self.INDEX_FILE) as f:
+            self.index = json.load(f)
+        self._data = None
+
+    @property
+    def data(self) -> np.ndarray:
+        # opened lazily, so that each data loading process maps the file on its own
+        if self._data is None:
+            self._data = np.memmap(self.path_to_root / self.DATA_FILE, dtype=np.uint8, mode="r")
+        return self._data
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    def get_batch(self, video_id: str, frames: List[int]) -> Optional[np.ndarray]:
+        """
+        Returns the requested frames of the context window ending at the last of them as
+        a read-only `T x H x W x 3` uint8 array (None if the window is not stored). When
+        frames are evenly spaced, the array is a view on the memory-mapped file.
+        """
+        entry = self.index.get(self.frame_template.format(video_id=video_id, frame_number=int(frames[-1])))
+        if entry is None:
+            return None
+        offset, first_frame, t, h, w = entry
+        clip = self.data[offset:offset + t * h * w * 3].reshape(t, h, w, 3)
+        positions = np.asarray(frames, dtype=int) - first_frame
+        if positions.min() < 0 or positions.max() >= t:
+            return None
+
+        step = positions[1] - positions[0] if len(positions) > 1 else 1
+        if step > 0 and (np.diff(positions) == step).all():
+            return clip[positions[0]:positions[-1] + 1:step]
+        return clip[positions]
+
+
+class STASampleCache(object):
+    """
+    On-disk cache of the spatially transformed frames (as a `T x H x W x 3` uint8 array)
+    and boxes of deterministically preprocessed examples. Entries are stored in a
+    sub-directory named after the hash of the options they depend on, so that changing
+    any of them does not return stale samples.
+    """
+
+    def __init__(self, path_to_root: Path, config: dict) -> None:
+        digest = hashlib.md5(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+        self.path = Path(path_to_root) / digest
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / "config.json", "w") as f:
+            json.dump(config, f, sort_keys=True, indent=2)
+
+    def _file(self, uid: str) -> Path:
+        return self.path / "{}.npz".format(uid)
+
+    def __contains__(self, uid: str) -> bool:
+        return self._file(uid).exists()
+
+    def get(self, uid: str):
+        """Returns the cached frames and boxes of an example, or None if not cached"""
+        try:
+            with np.load(self._file(uid)) as data:
+                return data["imgs"], data["boxes"]
+        except (OSError, ValueError, KeyError):
+            # missing or partially written entry
+            return None
+
+    def put(self, uid: str, imgs: np.ndarray, boxes: np.ndarray) -> None:
+        # write to a temporary file first, so that concurrent readers never see partial entries
+        tmp = self.path / "{}.{}.tmp.npz".format(uid, os.getpid())
+        np.savez(tmp, imgs=imgs, boxes=boxes)
+        os.replace(tmp, self._file(uid))
+
+
+class STAVideoBatchSampler(torch.utils.data.Sampler):
+    """
+    Yields batches of dataset indices grouped by video: examples are sorted by video
+    and frame number, so that most batches contain nearby clips of the same video
+    which are decoded together. When shuffling, the order of the videos and of the
+    batches depends on the epoch, set by ShortTermAnticipationTask at the start of
+    each training epoch. With distributed training, batches are split among the
+    processes as done by DistributedSampler.
+    """
+
+    def __init__(self, video_ids, frame_numbers, batch_size, shuffle=False, drop_last=False, seed=0):
+        self.video_ids = video_ids
+        self.frame_numbers = frame_numbers
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            self.num_replicas = torch.distributed.get_world_size()
+            self.rank = torch.distributed.get_rank()
+        else:
+            self.num_replicas, self.rank = 1, 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _batches(self):
+        videos = sorted(set(self.video_ids))
+        if self.shuffle:
+            rng = np.random.RandomState(self.seed + self.epoch)
+            videos = [videos[i] for i in rng.permutation(len(videos))]
+        video_order = {v: i for i, v in enumerate(videos)}
+        indices = sorted(range(len(self.video_ids)), key=lambda i: (video_order[self.video_ids[i]], self.frame_numbers[i]))
+
+        batches = [indices[i : i + self.batch_size] for i in range(0, len(indices), self.batch_size)]
+        if self.drop_last and len(batches) > 0 and len(batches[-1]) < self.batch_size:
+            batches = batches[:-1]
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+
+        # pad to a multiple of the number of processes, as DistributedSampler
+        if len(batches) % self.num_replicas != 0:
+            padding = self.num_replicas - len(batches) % self.num_replicas
+            batches += batches[:padding]
+        return batches[self.rank :: self.num_replicas]
+
+    def __iter__(self):
+        return iter(self._batches())
+
+    def __len__(self):
+        num_batches = len(self.video_ids) // self.batch_size
+        if not self.drop_last and len(self.video_ids) % self.batch_size != 0:
+            num_batches += 1
+        return int(math.ceil(num_batches / self.num_replicas))
+
+
+class STAVideoBlockSampler(torch.utils.data.Sampler):
+    """
+    Yields dataset indices in blocks of `block_size` examples of the same video, sorted
+    by frame number, so that consecutive examples loaded by a worker share their video
+    (and LMDB environment, video container, ...). When shuffling, the order of the
+    blocks and the frame at which the examples of each video are split in blocks depend
+    on the epoch, set by ShortTermAnticipationTask at the start of each training epoch.
+    With distributed training, each process gets a contiguous part of the indices,
+    padded to the same length as done by DistributedSampler.
+    """
+
+    def __init__(self, video_ids, frame_numbers, block_size, shuffle=True, seed=0):
+        self.video_ids = video_ids
+        self.frame_numbers = frame_numbers
+        self.block_size = block_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            self.num_replicas = torch.distributed.get_world_size()
+            self.rank = torch.distributed.get_rank()
+        else:
+            self.num_replicas, self.rank = 1, 0
+        self.num_samples = int(math.ceil(len(self.video_ids) / self.num_replicas))
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _indices(self):
+        rng = np.random.RandomState(self.seed + self.epoch)
+        videos = defaultdict(list)
+        for i in sorted(range(len(self.video_ids)), key=lambda i: (self.video_ids[i], self.frame_numbers[i])):
+            videos[self.video_ids[i]].append(i)
+
+        blocks = []
+        for video_id in sorted(videos):
+            indices = videos[video_id]
+            # size of the first block of the video
+            offset = rng.randint(1, self.block_size + 1) if self.shuffle else self.block_size
+            blocks.append(indices[:offset])
+            blocks += [indices[i : i + self.block_size] for i in range(offset, len(indices), self.block_size)]
+        if self.shuffle:
+            blocks = [blocks[i] for i in rng.permutation(len(blocks))]
+        indices = [i for block in blocks for i in block]
+
+        # pad to a multiple of the number of processes, as DistributedSampler
+        total_size = self.num_samples * self.num_replicas
+        indices += indices[: total_size - len(indices)]
+        return indices[self.rank * self.num_samples : (self.rank + 1) * self.num_samples]
+
+    def __iter__(self):
+        return iter(self._indices())
+
+    def __len__(self):
+        return self.num_samples
+
+
 @DATASET_REGISTRY.register()
 class Ego4dShortTermAnticipation(torch.utils.data.Dataset):
     """
@@ -326,12 +1098,102 @@ class Ego4dShortTermAnticipation(torch.utils.data.Dataset):
             self._test_force_flip = cfg.EGO4D_STA.TEST_FORCE_FLIP
 
         if self.cfg.EGO4D_STA.VIDEO_LOAD_BACKEND == 'lmdb':
-            self._hlmdb = Ego4DHLMDB(self.cfg.EGO4D_STA.RGB_LMDB_DIR, readonly=True, lock=False)
+            self._hlmdb = Ego4DHLMDB(
+                self.cfg.EGO4D_STA.RGB_LMDB_DIR,
+                readonly=True,
+                lock=False,
+                max_open_envs=self.cfg.EGO4D_STA.LMDB_MAX_OPEN_ENVS,
+                decode_threads=self.cfg.EGO4D_STA.DECODE_THREADS,
+            )
+        elif self.cfg.EGO4D_STA.VIDEO_LOAD_BACKEND == 'npy_mmap':
+            self._frame_memmap = Ego4DFrameMemmap(self.cfg.EGO4D_STA.NPY_MMAP_DIR)
+        elif self.cfg.EGO4D_STA.VIDEO_LOAD_BACKEND == 'lmdb_clips':
+            self._hlmdb = Ego4DClipLMDB(
+                self.cfg.EGO4D_STA.CLIP_LMDB_DIR,
+                readonly=True,
+                lock=False,
+                max_open_envs=self.cfg.EGO4D_STA.LMDB_MAX_OPEN_ENVS,
+                decode_threads=self.cfg.EGO4D_STA.DECODE_THREADS,
+            )
 
-        self._obj_detections = json.load(open(cfg.EGO4D_STA.OBJ_DETECTIONS))
+        # return raw uint8 clips, to be augmented on the training device (see STADeviceTransform)
+        self._device_augmentation = self._split == "train" and cfg.EGO4D_STA.DEVICE_AUGMENTATION
+        if self._device_augmentation and cfg.EGO4D_STA.VIDEO_LOAD_BACKEND in ['pytorchvideo', 'decord']:
+            raise NotImplementedError("Device augmentation is not supported by the {} backend".format(cfg.EGO4D_STA.VIDEO_LOAD_BACKEND))
+
+        self._sample_cache = None
+        if cfg.EGO4D_STA.SAMPLE_CACHE_DIR and self._split != "train":
+            if cfg.EGO4D_STA.VIDEO_LOAD_BACKEND in ['pytorchvideo', 'decord']:
+                logger.warn("The sample cache is not supported by the {} backend".format(cfg.EGO4D_STA.VIDEO_LOAD_BACKEND))
+            else:
+                self._sample_cache = STASampleCache(cfg.EGO4D_STA.SAMPLE_CACHE_DIR, self._sample_cache_config())
+
+        # frames decoded vs returned by the pyav backend in this process
+        self._pyav_stats = {}
+        # examples loaded by this process, see _log_cache_stats
+        self._num_loaded = 0
+        # frames of the current batch decoded together, see _load_batch
+        self._prefetched_frames = {}
+
+        self._annotation_index = None
+        if cfg.EGO4D_STA.ANNOTATION_INDEX_DIR:
+            # memory-mapped annotations and detections, see build_sta_index.py
+            self._obj_detections = STADetectionIndex(cfg.EGO4D_STA.ANNOTATION_INDEX_DIR)
+        else:
+            self._obj_detections = json.load(open(cfg.EGO4D_STA.OBJ_DETECTIONS))
             
         self._load_data(cfg)
 
+        # lists of the indices of the val/test annotations sharing their video and frame
+        self._frame_groups = None
+        if cfg.EGO4D_STA.GROUP_BY_FRAME and self._split != "train":
+            self._frame_groups = self._group_by_frame()
+
+        # training examples shuffled in blocks of the same video
+        self._sampler = None
+        if cfg.EGO4D_STA.SAMPLER_BLOCK_SIZE > 0 and self._split == "train":
+            video_ids, frame_numbers = self._video_ids_and_frame_numbers()
+            self._sampler = STAVideoBlockSampler(video_ids, frame_numbers, cfg.EGO4D_STA.SAMPLER_BLOCK_SIZE, shuffle=True, seed=cfg.RNG_SEED)
+
+    @property
+    def sampler(self):
+        """The sampler of the examples used by construct_loader, or None"""
+        return self._sampler
+
+    def _group_by_frame(self):
+        """Groups the annotations by video and frame, in order of first appearance"""
+        groups = OrderedDict()
+        for idx in range(self._num_annotations()):
+            _, video_id, _, _, frame_number, _, _, _, _, _ = self._load_annotations(idx)
+            groups.setdefault((video_id, frame_number), []).append(idx)
+        logger.info("Grouped {} annotations in {} frames".format(self._num_annotations(), len(groups)))
+        return list(groups.values())
+
+    def _sample_cache_config(self):
+        """Returns the options determining the content of the sample cache"""
+        cfg = self.cfg
+        return {
+            "split": self._split,
+            "lists": {"val": cfg.EGO4D_STA.VAL_LISTS, "test": cfg.EGO4D_STA.TEST_LISTS}[self._split],
+            "annotation_dir": cfg.EGO4D_STA.ANNOTATION_DIR,
+            "obj_detections": cfg.EGO4D_STA.OBJ_DETECTIONS,
+            "detection_score_thresh": cfg.EGO4D_STA.DETECTION_SCORE_THRESH,
+            "backend": cfg.EGO4D_STA.VIDEO_LOAD_BACKEND,
+            "rgb_lmdb_dir": cfg.EGO4D_STA.RGB_LMDB_DIR,
+            "clip_lmdb_dir": cfg.EGO4D_STA.CLIP_LMDB_DIR,
+            "npy_mmap_dir": cfg.EGO4D_STA.NPY_MMAP_DIR,
+            "video_dir": cfg.EGO4D_STA.get("VIDEO_DIR"),
+            "pyav_decode_resize": cfg.EGO4D_STA.PYAV_DECODE_RESIZE,
+            "lmdb_reduced_decode": cfg.EGO4D_STA.LMDB_REDUCED_DECODE,
+            "lmdb_frame_height": cfg.EGO4D_STA.LMDB_FRAME_HEIGHT,
+            "num_frames": cfg.DATA.NUM_FRAMES,
+            "sampling_rate": cfg.DATA.SAMPLING_RATE,
+            "crop_size": self._crop_size,
+            "test_force_flip": self._test_force_flip,
+            # the clips of grouped annotations are cached along with the boxes of the group
+            "group_by_frame": cfg.EGO4D_STA.GROUP_BY_FRAME,
+        }
+
     def _load_lists(self, _list):
         def extend_dict(input_dict, output_dict):
             for k,v in input_dict.items():
@@ -358,15 +1220,38 @@ class Ego4dShortTermAnticipation(torch.utils.data.Dataset):
         """
 
         if self._split == "train":
-            self._annotations = self._load_lists(cfg.EGO4D_STA.TRAIN_LISTS)
+            lists = cfg.EGO4D_STA.TRAIN_LISTS
         elif self._split == "val":
-            self._annotations = self._load_lists(cfg.EGO4D_STA.VAL_LISTS)
+            lists = cfg.EGO4D_STA.VAL_LISTS
         else:
-            self._annotations = self._load_lists(cfg.EGO4D_STA.TEST_LISTS)
+            lists = cfg.EGO4D_STA.TEST_LISTS
 
-    def __len__(self):
+        if cfg.EGO4D_STA.ANNOTATION_INDEX_DIR:
+            self._annotation_index = STAAnnotationIndex(cfg.EGO4D_STA.ANNOTATION_INDEX_DIR, lists)
+        else:
+            self._annotations = self._load_lists(lists)
+
+    def _num_annotations(self):
+        if self._annotation_index is not None:
+            return len(self._annotation_index)
         return len(self._annotations['annotations'])
 
+    def __len__(self):
+        if self._frame_groups is not None:
+            return len(self._frame_groups)
+        return self._num_annotations()
+
+    def _item_annotations(self, idx):
+        """Returns the indices of the annotations of the idx-th item"""
+        if self._frame_groups is not None:
+            return self._frame_groups[idx]
+        return [idx]
+
+    def _video_metadata(self, video_id):
+        if self._annotation_index is not None:
+            return self._annotation_index.videos[video_id]
+        return self._annotations['videos'][video_id]
+
     def _images_and_boxes_preprocessing_cv2(self, imgs, boxes):
         """
         This function performs preprocessing for the input images and
@@ -380,6 +1265,23 @@ class Ego4dShortTermAnticipation(torch.utils.data.Dataset):
             imgs (tensor): list of preprocessed images.
             boxes (ndarray): preprocessed boxes.
         """
+        imgs, boxes = self._images_and_boxes_spatial_transform_cv2(imgs, boxes)
+        return self._images_and_boxes_normalization_cv2(imgs, boxes)
+
+    def _images_and_boxes_spatial_transform_cv2(self, imgs, boxes):
+        """
+        Scales, crops and flips the images and the corresponding boxes of one clip.
+
+        Args:
+            imgs (list): the images in HWC, BGR format.
+            boxes (ndarray): the boxes for the current clip, normalized to [0, 1].
+
+        Returns:
+            imgs (ndarray): the transformed clip, `num frames` x `height` x `width` x
+                `channel`. Its values are integers in [0, 255], as they only go
+                through resizing from uint8. It may be a view of the input frames.
+            boxes (list): list containing the transformed boxes.
+        """
 
         height, width, _ = imgs[0].shape
 
@@ -392,96 +1294,110 @@ class Ego4dShortTermAnticipation(torch.utils.data.Dataset):
         boxes = [boxes]
 
         # The image now is in HWC, BGR format.
+        # The clip-level transforms resize the frames into a single array and
+        # crop and flip it through views, without copying each frame.
         if self._split == "train":  # "train"
-            imgs, boxes = cv2_transform.random_short_side_scale_jitter_list(
-                imgs,
-                min_size=self._jitter_min_scale,
-                max_size=self._jitter_max_scale,
-                boxes=boxes,
-            )
-            imgs, boxes = cv2_transform.random_crop_list(
-                imgs, self._crop_size, order="HWC", boxes=boxes
-            )
+            if self.cfg.EGO4D_STA.FUSED_SCALE_CROP:
+                # only the pixels of the crop are interpolated
+                imgs, boxes = cv2_transform.random_short_side_scale_jitter_crop_clip(
+                    imgs,
+                    min_size=self._jitter_min_scale,
+                    max_size=self._jitter_max_scale,
+                    size=self._crop_size,
+                    boxes=boxes,
+                )
+            else:
+                imgs, boxes = cv2_transform.random_short_side_scale_jitter_clip(
+                    imgs,
+                    min_size=self._jitter_min_scale,
+                    max_size=self._jitter_max_scale,
+                    boxes=boxes,
+                )
+                imgs, boxes = cv2_transform.random_crop_clip(
+                    imgs, self._crop_size, boxes=boxes
+                )
 
             if self.random_horizontal_flip:
                 # random flip
-                imgs, boxes = cv2_transform.horizontal_flip_list(
-                    0.5, imgs, order="HWC", boxes=boxes
+                imgs, boxes = cv2_transform.horizontal_flip_clip(
+                    0.5, imgs, boxes=boxes
                 )
         elif self._split == "val":
             # Short side to test_scale. Non-local and STRG uses 256.
-            imgs = [cv2_transform.scale(self._crop_size, img) for img in imgs]
+            imgs = cv2_transform.scale_clip(self._crop_size, imgs)
             boxes = [
                 cv2_transform.scale_boxes(self._crop_size, boxes[0], height, width)
             ]
-            imgs, boxes = cv2_transform.spatial_shift_crop_list(
+            imgs, boxes = cv2_transform.spatial_shift_crop_clip(
                 self._crop_size, imgs, 1, boxes=boxes
             )
 
             if self._test_force_flip:
-                imgs, boxes = cv2_transform.horizontal_flip_list(
-                    1, imgs, order="HWC", boxes=boxes
+                imgs, boxes = cv2_transform.horizontal_flip_clip(
+                    1, imgs, boxes=boxes
                 )
         elif self._split == "test":
             # Short side to test_scale. Non-local and STRG uses 256.
-            imgs = [cv2_transform.scale(self._crop_size, img) for img in imgs]
+            imgs = cv2_transform.scale_clip(self._crop_size, imgs)
             boxes = [
                 cv2_transform.scale_boxes(self._crop_size, boxes[0], height, width)
             ]
 
             if self._test_force_flip:
-                imgs, boxes = cv2_transform.horizontal_flip_list(
-                    1, imgs, order="HWC", boxes=boxes
+                imgs, boxes = cv2_transform.horizontal_flip_clip(
+                    1, imgs, boxes=boxes
                 )
         else:
             raise NotImplementedError("Unsupported split mode {}".format(self._split))
 
-        # Convert image to CHW keeping BGR order.
-        imgs = [cv2_transform.HWC2CHW(img) for img in imgs]
+        return imgs, boxes
 
-        # Image [0, 255] -> [0, 1].
-        imgs = [img / 255.0 for img in imgs]
+    def _images_and_boxes_normalization_cv2(self, imgs, boxes):
+        """
+        Converts the spatially transformed images of one clip to a normalized tensor,
+        applying color augmentation during training.
 
-        imgs = [
-            np.ascontiguousarray(
-                # img.reshape((3, self._crop_size, self._crop_size))
-                img.reshape((3, imgs[0].shape[1], imgs[0].shape[2]))
-            ).astype(np.float32)
-            for img in imgs
-        ]
+        Args:
+            imgs (list or ndarray): the images in HWC, BGR format.
+            boxes (list): list containing the boxes for the current clip.
+
+        Returns:
+            imgs (tensor): preprocessed images.
+            boxes (ndarray): preprocessed boxes.
+        """
+        mean = np.array(self._data_mean, dtype=np.float32)
+        std = np.array(self._data_std, dtype=np.float32)
+        if not self._use_bgr:
+            # Mean and std are given in the order of the channels before the
+            # conversion from BGR to RGB.
+            mean, std = mean[::-1], std[::-1]
 
-        # Do color augmentation (after divided by 255.0).
         if self._split == "train" and self._use_color_augmentation:
+            # Color augmentation works in place on the BGR CTHW clip, after divided
+            # by 255.0.
+            imgs = cv2_transform.images_to_clip(imgs)
+
             if not self._pca_jitter_only:
-                imgs = cv2_transform.color_jitter_list(
+                imgs = cv2_transform.color_jitter_clip(
                     imgs, img_brightness=0.4, img_contrast=0.4, img_saturation=0.4
                 )
 
-            imgs = cv2_transform.lighting_list(
+            imgs = cv2_transform.lighting_clip(
                 imgs,
                 alphastd=0.1,
                 eigval=np.array(self._pca_eigval).astype(np.float32),
                 eigvec=np.array(self._pca_eigvec).astype(np.float32),
             )
 
-        # Normalize images by mean and std.
-        imgs = [
-            cv2_transform.color_normalization(
-                img,
-                np.array(self._data_mean, dtype=np.float32),
-                np.array(self._data_std, dtype=np.float32),
-            )
-            for img in imgs
-        ]
-
-        # Concat list of images to single ndarray.
-        imgs = np.concatenate([np.expand_dims(img, axis=1) for img in imgs], axis=1)
+            if not self._use_bgr:
+                imgs = np.ascontiguousarray(imgs[::-1])
+        else:
+            # Stack, convert to CTHW and RGB, and scale to [0, 1] in one pass.
+            imgs = cv2_transform.images_to_clip(imgs, bgr_to_rgb=not self._use_bgr)
 
-        if not self._use_bgr:
-            # Convert image format from BGR to RGB.
-            imgs = imgs[::-1, ...]
+        # Normalize images by mean and std, in place.
+        imgs = cv2_transform.color_normalization(imgs, mean, std)
 
-        imgs = np.ascontiguousarray(imgs)
         imgs = torch.from_numpy(imgs)
         boxes = cv2_transform.clip_boxes_to_image(
             boxes[0], imgs[0].shape[1], imgs[0].shape[2]
@@ -494,17 +1410,13 @@ class Ego4dShortTermAnticipation(torch.utils.data.Dataset):
         corresponding boxes for one clip.
 
         Args:
-            imgs (tensor): the images.
+            imgs (tensor): the images, uint8 or float in [0, 255].
             boxes (ndarray): the boxes for the current clip.
 
         Returns:
             imgs (tensor): list of preprocessed images.
             boxes (ndarray): preprocessed boxes.
         """
-        # Image [0, 255] -> [0, 1].
-        imgs = imgs.float()
-        imgs = imgs / 255.0
-
         height, width = imgs.shape[2], imgs.shape[3]
         # The format of boxes is [x1, y1, x2, y2]. The input boxes are in the
         # range of [0, 1].
@@ -512,28 +1424,31 @@ class Ego4dShortTermAnticipation(torch.utils.data.Dataset):
         boxes[:, [1, 3]] *= height
         boxes = transform.clip_boxes_to_image(boxes, height, width)
 
+        # The frames are scaled and cropped in one pass, and converted to float
+        # (still in [0, 255]) only there.
         if self._split == "train":
             # Train split
-            imgs, boxes = transform.random_short_side_scale_jitter(
+            imgs, boxes = transform.random_short_side_scale_jitter_crop(
                 imgs,
                 min_size=self._jitter_min_scale,
                 max_size=self._jitter_max_scale,
+                size=self._crop_size,
                 boxes=boxes,
             )
-            imgs, boxes = transform.random_crop(imgs, self._crop_size, boxes=boxes)
 
             # Random flip.
             imgs, boxes = transform.horizontal_flip(0.5, imgs, boxes=boxes)
         elif self._split == "val":
             # Val split
             # Resize short side to crop_size. Non-local and STRG uses 256.
-            imgs, boxes = transform.random_short_side_scale_jitter(
-                imgs, min_size=self._crop_size, max_size=self._crop_size, boxes=boxes
-            )
-
             # Apply center crop for val split
-            imgs, boxes = transform.uniform_crop(
-                imgs, size=self._crop_size, spatial_idx=1, boxes=boxes
+            imgs, boxes = transform.random_short_side_scale_jitter_crop(
+                imgs,
+                min_size=self._crop_size,
+                max_size=self._crop_size,
+                size=self._crop_size,
+                spatial_idx=1,
+                boxes=boxes,
             )
 
             if self._test_force_flip:
@@ -541,7 +1456,7 @@ class Ego4dShortTermAnticipation(torch.utils.data.Dataset):
         elif self._split == "test":
             # Test split
             # Resize short side to crop_size. Non-local and STRG uses 256.
-            imgs, boxes = transform.random_short_side_scale_jitter(
+            imgs, boxes = transform.random_short_side_scale_jitter_crop(
                 imgs, min_size=self._crop_size, max_size=self._crop_size, boxes=boxes
             )
 
@@ -550,31 +1465,36 @@ class Ego4dShortTermAnticipation(torch.utils.data.Dataset):
         else:
             raise NotImplementedError("{} split not supported yet!".format(self._split))
 
-        # Do color augmentation (after divided by 255.0).
+        # Color augmentation (of the images divided by 255.0) and normalization
+        # are applied together, as a single affine transform of the pixels.
+        weight, bias = np.eye(3), np.zeros((imgs.shape[0], 3))
         if self._split == "train" and self._use_color_augmentation:
-            if not self._pca_jitter_only:
-                imgs = transform.color_jitter(
-                    imgs, img_brightness=0.4, img_contrast=0.4, img_saturation=0.4
-                )
-
-            imgs = transform.lighting_jitter(
-                imgs,
+            jitter = 0 if self._pca_jitter_only else 0.4
+            weight, bias = transform.color_jitter_affine(
+                imgs.mean(dim=(2, 3)).double().numpy() / 255.0,
+                img_brightness=jitter,
+                img_contrast=jitter,
+                img_saturation=jitter,
                 alphastd=0.1,
                 eigval=np.array(self._pca_eigval).astype(np.float32),
                 eigvec=np.array(self._pca_eigvec).astype(np.float32),
             )
 
-        # Normalize images by mean and std.
-        imgs = transform.color_normalization(
-            imgs,
-            np.array(self._data_mean, dtype=np.float32),
-            np.array(self._data_std, dtype=np.float32),
-        )
-
+        mean = np.array(self._data_mean, dtype=np.float32)
+        std = np.array(self._data_std, dtype=np.float32)
+        channels = [0, 1, 2]
         if self._use_bgr:
             # Convert image format from RGB to BGR.
             # Note that Kinetics pre-training uses RGB!
-            imgs = imgs[:, [2, 1, 0], ...]
+            channels = [2, 1, 0]
+        imgs = transform.color_normalization_affine(
+            imgs,
+            mean[channels],
+            std[channels],
+            weight=weight[channels],
+            bias=bias[:, channels],
+            scale=1 / 255.0,
+        )
 
         boxes = transform.clip_boxes_to_image(boxes, self._crop_size, self._crop_size)
 
@@ -583,7 +1503,12 @@ class Ego4dShortTermAnticipation(torch.utils.data.Dataset):
     def _load_frames_decord(self, video_filename, frame_number, fps):
         assert frame_number > 0
 
-        vr = VideoReader(video_filename, height=320, width=568)
+        key = (video_filename, 320, 568, self.cfg.EGO4D_STA.VIDEO_DECODER_THREADS)
+        if self.cfg.EGO4D_STA.DECORD_MAX_OPEN_READERS > 0:
+            # readers seek at every get_batch, so they can be reused across calls
+            vr = _DECORD_READER_CACHE.get(key, max_size=self.cfg.EGO4D_STA.DECORD_MAX_OPEN_READERS)
+        else:
+            vr = _open_decord_reader(key)
 
         frames = frame_number - np.arange(
             self.cfg.DATA.NUM_FRAMES * self.cfg.DATA.SAMPLING_RATE,
@@ -596,11 +1521,25 @@ class Ego4dShortTermAnticipation(torch.utils.data.Dataset):
         video_data = vr.get_batch(frames).permute(3, 0, 1, 2)
         return video_data
     
-    def _load_frames_pyav(self, video_filename, frame_number, fps):
-        assert frame_number > 0
-
-        vr = PyAVVideoReader(video_filename, height=320)
+    def _pyav_reader(self, video_filename):
+        keyframe_index = None
+        if self.cfg.EGO4D_STA.PYAV_KEYFRAME_INDEX_DIR:
+            keyframe_index = join(self.cfg.EGO4D_STA.PYAV_KEYFRAME_INDEX_DIR, Path(video_filename).stem + '.npz')
+            if not os.path.exists(keyframe_index):
+                keyframe_index = None
+
+        return PyAVVideoReader(
+            video_filename,
+            height=320,
+            max_open_containers=self.cfg.EGO4D_STA.PYAV_MAX_OPEN_CONTAINERS,
+            keyframe_index=keyframe_index,
+            stats=self._pyav_stats,
+            thread_type=self.cfg.EGO4D_STA.VIDEO_DECODER_THREAD_TYPE or None,
+            thread_count=self.cfg.EGO4D_STA.VIDEO_DECODER_THREADS,
+            decode_resize=self.cfg.EGO4D_STA.PYAV_DECODE_RESIZE,
+        )
 
+    def _pyav_frames(self, frame_number):
         frames = (
                 frame_number
                 - np.arange(
@@ -610,29 +1549,78 @@ class Ego4dShortTermAnticipation(torch.utils.data.Dataset):
         )
         frames[frames < 1] = 1
 
-        frames = frames.astype(int)
+        return frames.astype(int)
+
+    def _load_frames_pyav(self, video_filename, frame_number, fps):
+        assert frame_number > 0
 
-        imgs = vr[frames]
+        video_id = Path(video_filename).stem
+        if (video_id, frame_number) in self._prefetched_frames:
+            return self._prefetched_frames.pop((video_id, frame_number))
+
+        vr = self._pyav_reader(video_filename)
+        imgs = vr[self._pyav_frames(frame_number)]
         
         return imgs
 
     def _load_frames_pytorch_video(self, video_filename, frame_number, fps):
-        clip_duration = (
-            self.cfg.DATA.NUM_FRAMES * self.cfg.DATA.SAMPLING_RATE - 1
-        ) / fps
-        clip_end_sec = frame_number / fps
-        clip_start_sec = clip_end_sec - clip_duration
-
-        # truncate if negative timestamp
-        clip_start_sec = np.min(clip_start_sec, 0)
-
-        video = EncodedVideo.from_path(video_filename, decode_audio=False)
-        video_data = video.get_clip(clip_start_sec, clip_end_sec)["video"]
-        video_data = uniform_temporal_subsample(video_data, self.cfg.DATA.NUM_FRAMES)
-        # video_data = short_side_scale(video_data, )
+        # decode only the window spanned by the sampled frames (the same frames as the
+        # lmdb backend), with half a frame of margin as frame i is displayed at i/fps
+        frames = self._sample_frames(frame_number)
+        clip_start_sec = max((frames[0] - 0.5) / fps, 0)
+        clip_end_sec = (frames[-1] + 0.5) / fps
+
+        max_open_containers = self.cfg.EGO4D_STA.PYAV_MAX_OPEN_CONTAINERS
+        if max_open_containers > 0:
+            video = _ENCODED_VIDEO_CACHE.get(video_filename, max_size=max_open_containers)
+        else:
+            video = EncodedVideo.from_path(video_filename, decode_audio=False)
+
+        try:
+            # get_clip seeks before decoding, so cached videos can be reused
+            video_data = video.get_clip(clip_start_sec, clip_end_sec)["video"]
+        except Exception:
+            if max_open_containers > 0:
+                _ENCODED_VIDEO_CACHE.discard(video_filename)
+            raise
+        finally:
+            if max_open_containers <= 0:
+                video.close()
+
+        if video_data is None:
+            raise Exception("Frames of video {} ending at {} could not be decoded".format(video_filename, frame_number))
+
+        # keep the sampled frames only (repeated when clamped at the start of the video)
+        idx = np.clip(frames - frames[0], 0, video_data.shape[1] - 1)
+        video_data = video_data[:, torch.from_numpy(idx)]
         return video_data
 
 
+    def _lmdb_reduce_factor(self, video_id):
+        """
+        Returns the largest factor the frames stored in the LMDBs can be downscaled by
+        while decoding, such that their short side is still not smaller than the
+        largest short side they are rescaled to during preprocessing.
+        """
+        if not self.cfg.EGO4D_STA.LMDB_REDUCED_DECODE:
+            return 1
+
+        # frames are stored with a fixed height, keeping the aspect ratio
+        video = self._video_metadata(video_id)
+        stored_height = self.cfg.EGO4D_STA.LMDB_FRAME_HEIGHT
+        stored_width = stored_height * video['frame_width'] / video['frame_height']
+        short_side = min(stored_height, stored_width)
+
+        if self._split == "train":
+            target_size = self._jitter_max_scale
+        else:
+            target_size = self._crop_size
+
+        for factor in [8, 4, 2]:
+            if np.ceil(short_side / factor) >= target_size:
+                return factor
+        return 1
+
     def _retry_load_images_lmdb(self, video_id, frames, retry=10, backend="pytorch"):
         """
         This function is to load images with support of retrying for failed load.
@@ -646,12 +1634,16 @@ class Ego4dShortTermAnticipation(torch.utils.data.Dataset):
             imgs (list): list of loaded images.
         """
         for i in range(retry):
-            imgs = []
-            imgs = self._hlmdb.get_batch(video_id, frames)
-            
-            if all(img is not None for img in imgs):
+            imgs = self._hlmdb.get_batch(
+                video_id,
+                frames,
+                stack=self.cfg.EGO4D_STA.LMDB_DECODE_TO_ARRAY,
+                reduce=self._lmdb_reduce_factor(video_id),
+            )
+
+            if imgs is not None and all(img is not None for img in imgs):
                 if backend == "pytorch":
-                    imgs = torch.as_tensor(np.stack(imgs))
+                    imgs = torch.as_tensor(imgs if isinstance(imgs, np.ndarray) else np.stack(imgs))
                 return imgs
             else:
                 logger.warn("Reading failed. Will retry.")
@@ -674,36 +1666,45 @@ class Ego4dShortTermAnticipation(torch.utils.data.Dataset):
         return frames
 
     def _load_annotations(self, idx):
-        # get the idx-th annotation
-        ann = self._annotations['annotations'][idx]
-        uid = ann['uid']
-
-        # get video_id, frame_number, gt_boxes, gt_noun_labels, gt_verb_labels and gt_ttc_targets
-        video_id = ann["video_uid"]
-        frame_number = ann['frame']
-
-        if 'objects' in ann:
-            gt_boxes = np.vstack([x['box'] for x in ann['objects']])
-            gt_noun_labels = np.array([x['noun_category_id'] for x in ann['objects']])
-            gt_verb_labels = np.array([x['verb_category_id'] for x in ann['objects']])
-            gt_ttc_targets = np.array([x['time_to_contact'] for x in ann['objects']])
+        if self._annotation_index is not None:
+            uid, video_id, frame_number, gt_boxes, gt_noun_labels, gt_verb_labels, gt_ttc_targets = self._annotation_index.get(idx)
         else:
-            gt_boxes = gt_noun_labels = gt_verb_labels = gt_ttc_targets = None
+            # get the idx-th annotation
+            ann = self._annotations['annotations'][idx]
+            uid = ann['uid']
+
+            # get video_id, frame_number, gt_boxes, gt_noun_labels, gt_verb_labels and gt_ttc_targets
+            video_id = ann["video_uid"]
+            frame_number = ann['frame']
+
+            if 'objects' in ann:
+                gt_boxes = np.vstack([x['box'] for x in ann['objects']])
+                gt_noun_labels = np.array([x['noun_category_id'] for x in ann['objects']])
+                gt_verb_labels = np.array([x['verb_category_id'] for x in ann['objects']])
+                gt_ttc_targets = np.array([x['time_to_contact'] for x in ann['objects']])
+            else:
+                gt_boxes = gt_noun_labels = gt_verb_labels = gt_ttc_targets = None
 
-        frame_width, frame_height = self._annotations['videos'][video_id]['frame_width'], self._annotations['videos'][video_id]['frame_height']
+        video = self._video_metadata(video_id)
+        frame_width, frame_height = video['frame_width'], video['frame_height']
 
-        fps = self._annotations['videos'][video_id]['fps']
+        fps = video['fps']
 
         return uid, video_id, frame_width, frame_height, frame_number, fps, gt_boxes, gt_noun_labels, gt_verb_labels, gt_ttc_targets
 
     def _load_detections(self, uid):
         # get the object detections for the current example
-        object_detections = self._obj_detections[uid]
+        if self._annotation_index is not None:
+            pred_boxes, pred_scores, pred_object_labels = self._obj_detections.get(uid)
+            object_detections = pred_boxes
+        else:
+            object_detections = self._obj_detections[uid]
 
         if len(object_detections)>0:
-            pred_boxes = np.vstack([x['box'] for x in object_detections])
-            pred_scores = np.array([x['score'] for x in object_detections])
-            pred_object_labels = np.array([x['noun_category_id'] for x in object_detections])
+            if self._annotation_index is None:
+                pred_boxes = np.vstack([x['box'] for x in object_detections])
+                pred_scores = np.array([x['score'] for x in object_detections])
+                pred_object_labels = np.array([x['noun_category_id'] for x in object_detections])
 
             # exclude detections below the theshold
             detected = (
@@ -727,7 +1728,7 @@ class Ego4dShortTermAnticipation(torch.utils.data.Dataset):
             frames = self._load_frames_decord(join(self.cfg.EGO4D_STA.VIDEO_DIR, video_id + '.mp4'), frame_number, fps)
         elif self.cfg.EGO4D_STA.VIDEO_LOAD_BACKEND == 'pyav':
             frames = self._load_frames_pyav(join(self.cfg.EGO4D_STA.VIDEO_DIR, video_id + '.mp4'), frame_number, fps)
-        elif self.cfg.EGO4D_STA.VIDEO_LOAD_BACKEND == 'lmdb':
+        elif self.cfg.EGO4D_STA.VIDEO_LOAD_BACKEND in ['lmdb', 'lmdb_clips']:
             # sample the list of frames in the clip
             #key_list = self._sample_frame_keys(video_id, frame_number)
             frames_list = self._sample_frames(frame_number)
@@ -735,6 +1736,11 @@ class Ego4dShortTermAnticipation(torch.utils.data.Dataset):
             frames = self._retry_load_images_lmdb(
                 video_id, frames_list, backend="cv2"
             )
+        elif self.cfg.EGO4D_STA.VIDEO_LOAD_BACKEND == 'npy_mmap':
+            frames_list = self._sample_frames(frame_number)
+            frames = self._frame_memmap.get_batch(video_id, frames_list)
+            if frames is None:
+                raise Exception("Frames of video {} ending at {} not found in {}".format(video_id, frame_number, self.cfg.EGO4D_STA.NPY_MMAP_DIR))
         return frames
     
     def _preprocess_frames_and_boxes(self, frames, boxes):
@@ -754,12 +1760,140 @@ class Ego4dShortTermAnticipation(torch.utils.data.Dataset):
                 )
         return video_tensor, boxes
 
+    def _raw_clip_and_boxes(self, frames, boxes):
+        """
+        Stacks the frames of an example into a `T x H x W x C` uint8 (BGR) tensor and
+        draws the parameters of its spatial transform, which are applied to the boxes
+        here and to the pixels by STADeviceTransform. Returns the clip along with the
+        parameters, and the transformed boxes.
+        """
+        clip = torch.from_numpy(np.array(frames, dtype=np.uint8))
+        height, width = clip.shape[1], clip.shape[2]
+
+        boxes[:, [0, 2]] *= width
+        boxes[:, [1, 3]] *= height
+        boxes = cv2_transform.clip_boxes_to_image(boxes, height, width)
+        boxes, spatial_params = sample_spatial_transform(
+            boxes,
+            height,
+            width,
+            self._crop_size,
+            self._jitter_min_scale,
+            self._jitter_max_scale,
+            self.random_horizontal_flip,
+        )
+        return (clip, spatial_params), boxes
+
+    def _pack_pathway_output(self, video_tensor):
+        if self._device_augmentation:
+            # pathways are built by STADeviceTransform
+            return [video_tensor]
+        return utils.pack_pathway_output(self.cfg, video_tensor)
+
+    def _load_and_preprocess_frames(self, uid, video_id, frame_number, fps, boxes):
+        """
+        Loads and preprocesses the frames of an example along with its boxes. When the
+        sample cache is enabled, the spatially transformed frames and boxes are read from
+        it, or computed and stored if missing.
+        """
+        if self._device_augmentation:
+            frames = self._load_frames(video_id, frame_number, fps)
+            return self._raw_clip_and_boxes(frames, boxes)
+
+        if self._sample_cache is None:
+            frames = self._load_frames(video_id, frame_number, fps)
+            return self._preprocess_frames_and_boxes(frames, boxes)
+
+        cached = self._sample_cache.get(uid)
+        if cached is not None:
+            imgs, boxes = cached
+        else:
+            frames = self._load_frames(video_id, frame_number, fps)
+            imgs, boxes = self._images_and_boxes_spatial_transform_cv2(frames, boxes)
+            imgs, boxes = np.stack(imgs).astype(np.uint8), boxes[0]
+            self._sample_cache.put(uid, imgs, boxes)
+        return self._images_and_boxes_normalization_cv2(list(imgs), [boxes])
+
+    def _video_ids_and_frame_numbers(self):
+        """Returns the video and frame number of each item"""
+        video_ids, frame_numbers = [], []
+        for idx in range(len(self)):
+            _, video_id, _, _, frame_number, _, _, _, _, _ = self._load_annotations(self._item_annotations(idx)[0])
+            video_ids.append(video_id)
+            frame_numbers.append(frame_number)
+        return video_ids, frame_numbers
+
+    def _log_cache_stats(self):
+        """Logs the hit rates of the caches of this process every EGO4D_STA.CACHE_STATS_PERIOD examples"""
+        period = self.cfg.EGO4D_STA.CACHE_STATS_PERIOD
+        if period <= 0:
+            return
+        self._num_loaded += 1
+        if self._num_loaded % period != 0:
+            return
+
+        stats = ["{} {:.2%}".format(name, hits / (hits + misses)) for name, (hits, misses) in handle_cache_stats().items()]
+        if self._pyav_stats.get("frames_returned", 0) > 0:
+            stats.append("{:.2f} pyav frames decoded per frame returned".format(self._pyav_stats["frames_decoded"] / self._pyav_stats["frames_returned"]))
+        logger.info("Process {}, {} examples loaded: {}".format(os.getpid(), self._num_loaded, ", ".join(stats) or "no cache in use"))
+
+    def build_batch_sampler(self, batch_size, shuffle, drop_last):
+        """
+        Returns the batch sampler grouping examples by video used when
+        EGO4D_STA.PYAV_BATCH_DECODE is enabled, or None.
+        """
+        if not (self.cfg.EGO4D_STA.VIDEO_LOAD_BACKEND == 'pyav' and self.cfg.EGO4D_STA.PYAV_BATCH_DECODE):
+            return None
+
+        video_ids, frame_numbers = self._video_ids_and_frame_numbers()
+        return STAVideoBatchSampler(video_ids, frame_numbers, batch_size, shuffle=shuffle, drop_last=drop_last, seed=self.cfg.RNG_SEED)
+
+    def _load_batch(self, indices):
+        """
+        Loads a batch of examples, decoding the clips of each video together with the
+        pyav backend (see PyAVVideoReader.get_batch).
+        """
+        requests = defaultdict(list)
+        if self.cfg.EGO4D_STA.VIDEO_LOAD_BACKEND == 'pyav':
+            for idx in indices:
+                uid, video_id, _, _, frame_number, _, _, _, _, _ = self._load_annotations(self._item_annotations(idx)[0])
+                if self._sample_cache is not None and uid in self._sample_cache:
+                    continue
+                requests[video_id].append(frame_number)
+
+        for video_id, frame_numbers in requests.items():
+            frame_numbers = sorted(set(frame_numbers))
+            vr = self._pyav_reader(join(self.cfg.EGO4D_STA.VIDEO_DIR, video_id + '.mp4'))
+            clips = vr.get_batch(
+                [self._pyav_frames(f) for f in frame_numbers],
+                max_gap=self.cfg.EGO4D_STA.PYAV_BATCH_DECODE_MAX_GAP,
+            )
+            for frame_number, clip in zip(frame_numbers, clips):
+                self._prefetched_frames[(video_id, frame_number)] = clip
+
+        try:
+            # with EGO4D_STA.GROUP_BY_FRAME, the items are groups flattened by sta_collate
+            return [self[idx] for idx in indices]
+        finally:
+            self._prefetched_frames.clear()
+
+    def _clip_key(self, video_id, frame_number):
+        """
+        Identifies the input clip of val/test examples, whose preprocessing is
+        deterministic, so that the model can extract the features of examples
+        sharing their frame once (see ShortTermAnticipationSlowFast.forward).
+        """
+        return "{}_{:07d}".format(video_id, frame_number)
+
     def __getitem__(self, idx):
         """
         Generate corresponding clips, boxes, labels and metadata for given idx.
 
         Args:
-            idx (int): the video index provided by the pytorch sampler.
+            idx (int): the video index provided by the pytorch sampler. If a list
+                of indices (see STAVideoBatchSampler), the list of their examples
+                is returned. With EGO4D_STA.GROUP_BY_FRAME, the index of a group of
+                annotations sharing their frame, whose list of examples is returned.
         Returns:
             uid: the unique id of the annotation
             imgs: the frames sampled from the video
@@ -771,24 +1905,60 @@ class Ego4dShortTermAnticipation(torch.utils.data.Dataset):
                 'pred_object_scores': associated prediction scores
                 'pred_object_labels': associated predicted object labels
                 'gt_detections': dictionary containing the ground truth predictions for the current frame
+                'clip_key': identifier of the input clip (val/test only)
+        """
+        if isinstance(idx, (list, tuple)):
+            return self._load_batch(idx)
+        self._log_cache_stats()
+        if self._frame_groups is not None:
+            return self._load_group(self._frame_groups[idx])
+        return self._load_example(idx)
+
+    def _example_boxes(self, idx):
+        """Returns the normalized boxes preprocessed along with the clip of an example"""
+        uid, _, frame_width, frame_height, _, _, gt_boxes, _, _, _ = self._load_annotations(idx)
+        pred_boxes, _, _ = self._load_detections(uid)
+        nn = np.array([frame_width, frame_height]*2).reshape(1,-1)
+        if gt_boxes is None:
+            return pred_boxes / nn
+        return np.vstack([gt_boxes, pred_boxes]) / nn
+
+    def _load_group(self, indices):
+        """
+        Loads the examples of annotations sharing their video and frame (see
+        EGO4D_STA.GROUP_BY_FRAME), loading and preprocessing their clip once along
+        with the boxes of all of them.
+        """
+        uid, video_id, _, _, frame_number, fps, _, _, _, _ = self._load_annotations(indices[0])
+        boxes = [self._example_boxes(idx) for idx in indices]
+        video_tensor, all_boxes = self._load_and_preprocess_frames(uid, video_id, frame_number, fps, np.concatenate(boxes))
+        all_boxes = np.split(all_boxes, np.cumsum([len(b) for b in boxes])[:-1])
+        return [self._load_example(idx, (video_tensor, b)) for idx, b in zip(indices, all_boxes)]
+
+    def _load_example(self, idx, preprocessed=None):
+        """
+        Loads the idx-th example. If given, `preprocessed` holds its preprocessed clip
+        and boxes (see _example_boxes), which are then not loaded.
         """
         uid, video_id, frame_width, frame_height, frame_number, fps, gt_boxes, gt_noun_labels, gt_verb_labels, gt_ttc_targets = self._load_annotations(idx)
         pred_boxes, pred_object_labels, pred_scores = self._load_detections(uid)
 
-        frames = self._load_frames(video_id, frame_number, fps)
-
         orig_pred_boxes = pred_boxes.copy()
         nn = np.array([frame_width, frame_height]*2).reshape(1,-1)
         pred_boxes/=nn
 
         if gt_boxes is None: # unlabeled example
-            video_tensor, pred_boxes =self._preprocess_frames_and_boxes(frames, pred_boxes)
-            imgs = utils.pack_pathway_output(self.cfg, video_tensor)
+            if preprocessed is None:
+                video_tensor, pred_boxes = self._load_and_preprocess_frames(uid, video_id, frame_number, fps, pred_boxes)
+            else:
+                video_tensor, pred_boxes = preprocessed
+            imgs = self._pack_pathway_output(video_tensor)
 
             extra_data = {
                 'orig_pred_boxes': orig_pred_boxes,
                 'pred_object_scores': pred_scores,
-                'pred_object_labels': pred_object_labels
+                'pred_object_labels': pred_object_labels,
+                'clip_key': self._clip_key(video_id, frame_number)
             }
             
             return uid, imgs, pred_boxes, np.array([]), np.array([]), extra_data
@@ -799,7 +1969,14 @@ class Ego4dShortTermAnticipation(torch.utils.data.Dataset):
             # put all boxes together
             all_boxes = np.vstack([gt_boxes, pred_boxes])
         
-            video_tensor, all_boxes =self._preprocess_frames_and_boxes(frames, all_boxes)
+            if preprocessed is None:
+                video_tensor, all_boxes = self._load_and_preprocess_frames(uid, video_id, frame_number, fps, all_boxes)
+            else:
+                video_tensor, all_boxes = preprocessed
+
+            if self._device_augmentation:
+                # raw clip, the boxes are already transformed
+                video_tensor, spatial_params = video_tensor
 
             # separate ground truth from predicted boxes after pre-processing
             gt_boxes = all_boxes[: len(gt_boxes)]
@@ -830,7 +2007,7 @@ class Ego4dShortTermAnticipation(torch.utils.data.Dataset):
                 "ttcs": gt_ttc_targets,
             }
 
-            imgs = utils.pack_pathway_output(self.cfg, video_tensor)
+            imgs = self._pack_pathway_output(video_tensor)
 
             # copy the verb labels of the matched boxes
             verb_labels = gt_verb_labels[matches]
@@ -851,6 +2028,13 @@ class Ego4dShortTermAnticipation(torch.utils.data.Dataset):
                 'gt_detections': gt_detections
             }
 
+            if self._device_augmentation:
+                # spatial transform of the clip, also used to undo its padding in sta_collate
+                extra_data['spatial_params'] = spatial_params
+
+            if self._split != 'train':
+                extra_data['clip_key'] = self._clip_key(video_id, frame_number)
+
             return (
                 uid,
                 imgs,
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+import math
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from ..utils import datasets_utils as utils
+from . import cv2_transform
+
+
+def sample_spatial_transform(boxes, height, width, crop_size, min_scale, max_scale, random_flip):
+    """
+    Draws the parameters of the short side scale jitter, random crop and horizontal
+    flip of a training clip, in the same order as random_short_side_scale_jitter_clip,
+    random_crop_clip and horizontal_flip_clip, and applies them to its boxes. It is
+    called by the data loader workers, so that boxes are matched to the ground truth
+    after the crop as in the CPU preprocessing, while the pixels are resampled by
+    STADeviceTransform.
+
+    Args:
+        boxes (ndarray): boxes in pixels of the clip, with dimension `num boxes` x 4.
+        height (int): height of the clip.
+        width (int): width of the clip.
+        crop_size (int): size of the crop.
+        min_scale (int): the minimal size to scale the short side of the clip.
+        max_scale (int): the maximal size to scale the short side of the clip.
+        random_flip (bool): whether to flip the clip with probability 0.5.
+    Returns:
+        boxes (ndarray): the transformed boxes, clipped to the crop.
+        params (tuple): (height, width, new height, new width, y offset, x offset,
+            flip), as expected by STADeviceTransform.
+    """
+    size = int(round(1.0 / np.random.uniform(1.0 / max_scale, 1.0 / min_scale)))
+    new_height, new_width = height, width
+    if not ((width <= height and width == size) or (height <= width and height == size)):
+        if width < height:
+            new_width, new_height = size, int(math.floor((float(height) / width) * size))
+            boxes = boxes * float(new_height) / height
+        else:
+            new_width, new_height = int(math.floor((float(width) / height) * size)), size
+            boxes = boxes * float(new_width) / width
+
+    y_offset, x_offset = 0, 0
+    if new_height != crop_size or new_width != crop_size:
+        if new_height > crop_size:
+            y_offset = int(np.random.randint(0, new_height - crop_size))
+        if new_width > crop_size:
+            x_offset = int(np.random.randint(0, new_width - crop_size))
+        boxes = cv2_transform.crop_boxes(boxes, x_offset, y_offset)
+
+    flip = bool(random_flip and np.random.uniform() < 0.5)
+    if flip:
+        boxes = cv2_transform.flip_boxes(boxes, crop_size)
+
+    boxes = cv2_transform.clip_boxes_to_image(boxes, crop_size, crop_size)
+    return boxes, (height, width, new_height, new_width, y_offset, x_offset, flip)
+
+
+class STADeviceTransform(object):
+    """
+    Batched counterpart of the training preprocessing of Ego4dShortTermAnticipation
+    (`_images_and_boxes_preprocessing_cv2`), meant to run on the device the batch has
+    been moved to. It takes the raw uint8 clips returned by the dataset when
+    `EGO4D_STA.DEVICE_AUGMENTATION` is enabled and applies short side scale jitter,
+    random crop, horizontal flip, color jitter, PCA lighting and mean/std
+    normalization. The parameters of the spatial transform are drawn by the dataset,
+    which also transforms the boxes (see sample_spatial_transform), while those of the
+    color augmentation are drawn per example with `np.random`, as done by the OpenCV
+    transforms.
+    """
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self._crop_size = cfg.DATA.TRAIN_CROP_SIZE
+        self._use_color_augmentation = cfg.EGO4D_STA.TRAIN_USE_COLOR_AUGMENTATION
+        self._pca_jitter_only = cfg.EGO4D_STA.TRAIN_PCA_JITTER_ONLY
+        self._pca_eigval = np.array(cfg.EGO4D_STA.TRAIN_PCA_EIGVAL).astype(np.float32)
+        self._pca_eigvec = np.array(cfg.EGO4D_STA.TRAIN_PCA_EIGVEC).astype(np.float32)
+        self._data_mean = cfg.DATA.MEAN
+        self._data_std = cfg.DATA.STD
+        self._use_bgr = cfg.EGO4D_STA.BGR
+
+    def __call__(self, inputs, spatial_params):
+        """
+        Args:
+            inputs (list): list containing the zero-padded uint8 clips, with dimension
+                `batch` x `num frames` x `height` x `width` x `channel` (BGR).
+            spatial_params (list): parameters of the spatial transform of each clip,
+                as returned by sample_spatial_transform.
+        Returns:
+            inputs (list): the preprocessed clips of each pathway, with dimension
+                `batch` x `channel` x `num frames` x `height` x `width`.
+        """
+        clips = inputs[0]
+        out_clips = []
+        for clip, params in zip(clips, spatial_params):
+            clip = self._spatial_transform(clip, *[int(p) for p in params])
+            if self._use_color_augmentation:
+                clip = self._color_augmentation(clip)
+            clip = self._normalize(clip)
+            # T C H W -> C T H W.
+            out_clips.append(clip.permute(1, 0, 2, 3))
+
+        return utils.pack_pathway_output(self.cfg, torch.stack(out_clips))
+
+    def _spatial_transform(self, clip, height, width, new_height, new_width, y_offset, x_offset, flip):
+        """
+        Scales, crops and flips a clip with a single bilinear resampling.
+
+        Args:
+            clip (tensor): the padded uint8 clip, `num frames` x `height` x `width` x `channel`.
+            height (int): height of the unpadded clip.
+            width (int): width of the unpadded clip.
+            new_height (int): height of the scaled clip.
+            new_width (int): width of the scaled clip.
+            y_offset (int): offset of the crop in the scaled clip on y.
+            x_offset (int): offset of the crop in the scaled clip on x.
+            flip (int): whether to flip the crop horizontally.
+        Returns:
+            clip (tensor): float clip in [0, 1], `num frames` x `channel` x `crop` x `crop`.
+        """
+        # Coordinates in the unpadded clip of the centers of the output pixels (as
+        # cv2.resize), clamped to replicate the border.
+        crop = self._crop_size
+        device = clip.device
+        xs = torch.arange(crop, device=device, dtype=torch.float32) + x_offset
+        ys = torch.arange(crop, device=device, dtype=torch.float32) + y_offset
+        if flip:
+            xs = xs.flip(0)
+        src_x = ((xs + 0.5) * (width / new_width) - 0.5).clamp(0, width - 1)
+        src_y = ((ys + 0.5) * (height / new_height) - 0.5).clamp(0, height - 1)
+
+        # Normalize with respect to the padded clip.
+        padded_height, padded_width = clip.shape[1], clip.shape[2]
+        grid_x = (2 * src_x + 1) / padded_width - 1
+        grid_y = (2 * src_y + 1) / padded_height - 1
+        grid = torch.stack(torch.broadcast_tensors(grid_x[None, :], grid_y[:, None]), dim=-1)
+
+        frames = clip.permute(0, 3, 1, 2).float()
+        frames = F.grid_sample(
+            frames,
+            grid.expand(frames.shape[0], crop, crop, 2),
+            mode="bilinear",
+            padding_mode="border",
+            align_corners=False,
+        )
+        return frames / 255.0
+
+    def _color_augmentation(self, frames):
+        """
+        Color jitter and PCA lighting of a BGR clip, as color_jitter_list and
+        lighting_list.
+
+        Args:
+            frames (tensor): `num frames` x `channel` x `height` x `width`.
+        """
+        if not self._pca_jitter_only:
+            jitter = ["brightness", "contrast", "saturation"]
+            for idx in np.random.permutation(np.arange(len(jitter))):
+                alpha = 1.0 + np.random.uniform(-0.4, 0.4)
+                if jitter[idx] == "brightness":
+                    frames = frames * alpha
+                    continue
+                gray = 0.299 * frames[:, 2] + 0.587 * frames[:, 1] + 0.114 * frames[:, 0]
+                gray = gray.unsqueeze(1)
+                if jitter[idx] == "contrast":
+                    # Mean of the gray image of each frame.
+                    gray = gray.mean(dim=(2, 3), keepdim=True)
+                frames = frames * alpha + gray * (1 - alpha)
+
+        alpha = np.random.normal(0, 0.1, size=(1, 3))
+        rgb = np.sum(
+            self._pca_eigvec * np.repeat(alpha, 3, axis=0) * np.repeat(self._pca_eigval.reshape(1, 3), 3, axis=0),
+            axis=1,
+        )
+        # The eigenvectors are RGB based, while the channels are BGR.
+        bgr = torch.tensor(rgb[::-1].copy(), dtype=frames.dtype, device=frames.device)
+        return frames + bgr.view(1, 3, 1, 1)
+
+    def _normalize(self, frames):
+        """
+        Mean/std normalization of a BGR clip and conversion to RGB, as
+        `_images_and_boxes_normalization_cv2`.
+
+        Args:
+            frames (tensor): `num frames` x `channel` x `height` x `width`.
+        """
+        mean = torch.tensor(self._data_mean, dtype=frames.dtype, device=frames.device)
+        std = torch.tensor(self._data_std, dtype=frames.dtype, device=frames.device)
+        frames = (frames - mean.view(1, 3, 1, 1)) / std.view(1, 3, 1, 1)
+        if not self._use_bgr:
+            # Convert image format from BGR to RGB.
+            frames = frames.flip(1)
+        return frames
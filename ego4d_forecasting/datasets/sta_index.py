@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+"""
+Columnar index of the STA annotations and object detections.
+
+Each annotation file (e.g. `fho_sta_train.json`) is converted to a directory of
+`.npy` arrays named after the file, and the object detections to a `detections`
+directory. Arrays are memory-mapped when read, so that the data loading processes
+share the same pages instead of each holding a copy of the parsed JSON files.
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+
+DETECTIONS_DIR = "detections"
+
+
+def _save_arrays(path, arrays):
+    path.mkdir(parents=True, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(path / "{}.npy".format(name), array)
+
+
+def _load_arrays(path):
+    return {p.stem: np.load(p, mmap_mode="r") for p in sorted(path.glob("*.npy"))}
+
+
+def _offsets(counts):
+    return np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+
+def build_annotation_index(path_to_annotations, path_to_index):
+    """
+    Converts an STA annotation file to a columnar index.
+    Args:
+        path_to_annotations (Path): the json annotation file.
+        path_to_index (Path): the root directory of the index. Arrays are stored in
+            a sub-directory named after the annotation file.
+    """
+    path_to_annotations = Path(path_to_annotations)
+    j = json.load(open(path_to_annotations))
+
+    video_uids = sorted(j["info"]["video_metadata"].keys())
+    video_idx = {v: i for i, v in enumerate(video_uids)}
+    videos = [j["info"]["video_metadata"][v] for v in video_uids]
+
+    annotations = j["annotations"]
+    objects = [ann.get("objects", []) for ann in annotations]
+
+    _save_arrays(
+        Path(path_to_index) / path_to_annotations.stem,
+        {
+            "uids": np.array([ann["uid"] for ann in annotations], dtype="S"),
+            "video_idx": np.array([video_idx[ann["video_uid"]] for ann in annotations], dtype=np.int32),
+            "frames": np.array([ann["frame"] for ann in annotations], dtype=np.int64),
+            "has_objects": np.array(["objects" in ann for ann in annotations], dtype=bool),
+            "object_offsets": _offsets([len(o) for o in objects]),
+            "object_boxes": np.array([x["box"] for o in objects for x in o], dtype=np.float64).reshape(-1, 4),
+            "object_nouns": np.array([x["noun_category_id"] for o in objects for x in o], dtype=np.int64),
+            "object_verbs": np.array([x["verb_category_id"] for o in objects for x in o], dtype=np.int64),
+            "object_ttcs": np.array([x["time_to_contact"] for o in objects for x in o], dtype=np.float64),
+            "video_uids": np.array(video_uids, dtype="S"),
+            "video_widths": np.array([v["frame_width"] for v in videos], dtype=np.int64),
+            "video_heights": np.array([v["frame_height"] for v in videos], dtype=np.int64),
+            "video_fps": np.array([v["fps"] for v in videos], dtype=np.float64),
+        },
+    )
+
+
+def build_detection_index(path_to_detections, path_to_index):
+    """
+    Converts the object detections json file to a columnar index sorted by uid.
+    Args:
+        path_to_detections (Path): the json file mapping uids to lists of detections.
+        path_to_index (Path): the root directory of the index.
+    """
+    detections = json.load(open(path_to_detections))
+    uids = sorted(detections.keys())
+    dets = [detections[uid] for uid in uids]
+
+    _save_arrays(
+        Path(path_to_index) / DETECTIONS_DIR,
+        {
+            "uids": np.array(uids, dtype="S"),
+            "offsets": _offsets([len(d) for d in dets]),
+            "boxes": np.array([x["box"] for d in dets for x in d], dtype=np.float64).reshape(-1, 4),
+            "scores": np.array([x["score"] for d in dets for x in d], dtype=np.float64),
+            "nouns": np.array([x["noun_category_id"] for d in dets for x in d], dtype=np.int64),
+        },
+    )
+
+
+class STAAnnotationIndex(object):
+    """
+    Annotations of a list of annotation files, read from their columnar index.
+    """
+
+    def __init__(self, path_to_index, lists):
+        self.parts = [_load_arrays(Path(path_to_index) / Path(l).stem) for l in lists]
+        self.offsets = _offsets([len(p["uids"]) for p in self.parts])
+
+        # video metadata is small, keep it in a dictionary
+        self.videos = {}
+        for p in self.parts:
+            for uid, width, height, fps in zip(p["video_uids"], p["video_widths"], p["video_heights"], p["video_fps"]):
+                self.videos[uid.decode()] = {
+                    "frame_width": int(width),
+                    "frame_height": int(height),
+                    "fps": float(fps),
+                }
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def get(self, idx):
+        """
+        Returns uid, video uid and frame number of the idx-th annotation, along with the
+        boxes, noun labels, verb labels and time to contact of its objects (None for
+        unlabeled annotations).
+        """
+        part = int(np.searchsorted(self.offsets, idx, side="right")) - 1
+        p, idx = self.parts[part], idx - self.offsets[part]
+
+        uid = p["uids"][idx].decode()
+        video_id = p["video_uids"][p["video_idx"][idx]].decode()
+        frame_number = int(p["frames"][idx])
+
+        if not p["has_objects"][idx]:
+            return uid, video_id, frame_number, None, None, None, None
+
+        start, end = p["object_offsets"][idx], p["object_offsets"][idx + 1]
+        # copies, as boxes are modified in place by the dataset
+        return (
+            uid,
+            video_id,
+            frame_number,
+            np.array(p["object_boxes"][start:end]),
+            np.array(p["object_nouns"][start:end]),
+            np.array(p["object_verbs"][start:end]),
+            np.array(p["object_ttcs"][start:end]),
+        )
+
+
+class STADetectionIndex(object):
+    """
+    Object detections read from their columnar index.
+    """
+
+    def __init__(self, path_to_index):
+        self.arrays = _load_arrays(Path(path_to_index) / DETECTIONS_DIR)
+
+    def get(self, uid):
+        """Returns boxes, scores and noun labels of the detections of an annotation"""
+        uids = self.arrays["uids"]
+        key = uid.encode()
+        i = int(np.searchsorted(uids, key))
+        if i == len(uids) or uids[i] != key:
+            raise KeyError(uid)
+
+        start, end = self.arrays["offsets"][i], self.arrays["offsets"][i + 1]
+        return (
+            np.array(self.arrays["boxes"][start:end]),
+            np.array(self.arrays["scores"][start:end]),
+            np.array(self.arrays["nouns"][start:end]),
+        )
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+"""
+Streaming inputs for dense short term anticipation inference over whole videos.
+
+Rather than decoding a context window per query frame as Ego4dShortTermAnticipation
+does, each video is decoded once and every frame is preprocessed once into a ring
+buffer holding the last `NUM_FRAMES * SAMPLING_RATE` frames, from which the inputs
+of the query frames are gathered.
+"""
+
+import numpy as np
+import torch
+
+from ..utils import datasets_utils as utils
+from ..utils import logging as logging
+from . import cv2_transform
+
+logger = logging.get_logger(__name__)
+
+
+class STAStreamingClips(object):
+    """
+    Builds the model inputs of the query frames of a video from its decoded frames,
+    with the preprocessing of the test split of Ego4dShortTermAnticipation (short side
+    scaling to TEST_CROP_SIZE, optional flip, mean/std normalization).
+    """
+
+    def __init__(self, cfg, stride=1):
+        """
+        Args:
+            cfg (CfgNode): configs.
+            stride (int): inputs are built for the frames whose number is a multiple
+                of `stride`.
+        """
+        self.cfg = cfg
+        self._sample_rate = cfg.DATA.SAMPLING_RATE
+        self._seq_len = cfg.DATA.NUM_FRAMES * self._sample_rate
+        self._crop_size = cfg.DATA.TEST_CROP_SIZE
+        self._test_force_flip = cfg.EGO4D_STA.TEST_FORCE_FLIP
+        self._use_bgr = cfg.EGO4D_STA.BGR
+        self._data_mean = np.array(cfg.DATA.MEAN, dtype=np.float32)
+        self._data_std = np.array(cfg.DATA.STD, dtype=np.float32)
+        if not self._use_bgr:
+            # mean and std are given in the order of the channels before the
+            # conversion from BGR to RGB
+            self._data_mean, self._data_std = self._data_mean[::-1], self._data_std[::-1]
+        self.stride = stride
+
+    def _reset(self):
+        # `channel` x `seq len` x `height` x `width`, slot i holds a frame f with f % seq len == i
+        self._buffer = None
+        self._buffer_frames = np.full(self._seq_len, -1, dtype=np.int64)
+        self._frame_size = None
+
+    def _push(self, frame_number, img):
+        """Preprocesses a decoded BGR frame and stores it in the ring buffer"""
+        if self._frame_size is None:
+            self._frame_size = img.shape[:2]
+        img = cv2_transform.scale(self._crop_size, img)
+        if self._test_force_flip:
+            img = img[:, ::-1]
+        if self._buffer is None:
+            self._buffer = np.empty((3, self._seq_len) + img.shape[:2], dtype=np.float32)
+
+        slot = frame_number % self._seq_len
+        out = self._buffer[:, slot : slot + 1]
+        cv2_transform.images_to_clip([img], bgr_to_rgb=not self._use_bgr, out=out)
+        cv2_transform.color_normalization(out, self._data_mean, self._data_std)
+        self._buffer_frames[slot] = frame_number
+
+    def _clip(self, frame_number):
+        """
+        Gathers the input clip ending at `frame_number` from the ring buffer, or
+        returns None if some of its frames have not been decoded.
+        """
+        frames = frame_number - np.arange(self._seq_len, step=self._sample_rate)[::-1]
+        # clamped to the first frame as in Ego4dShortTermAnticipation._pyav_frames
+        frames[frames < 1] = 1
+        slots = frames % self._seq_len
+        if not np.all(self._buffer_frames[slots] == frames):
+            return None
+        return torch.from_numpy(self._buffer[:, slots])
+
+    def _boxes(self, boxes):
+        """Converts boxes normalized to [0, 1] to the resolution of the inputs"""
+        height, width = self._frame_size
+        boxes = boxes * np.array([width, height] * 2)
+        boxes = cv2_transform.clip_boxes_to_image(boxes, height, width)
+        boxes = cv2_transform.scale_boxes(self._crop_size, boxes, height, width)
+        new_height, new_width = self._buffer.shape[2:]
+        if self._test_force_flip:
+            boxes = cv2_transform.flip_boxes(boxes, new_width)
+        return cv2_transform.clip_boxes_to_image(boxes, new_height, new_width)
+
+    def iter_clips(self, frames, detections):
+        """
+        Args:
+            frames (iterable): (frame number, frame) pairs in decoding order, with
+                the frames in HWC, BGR format (e.g. PyAVVideoReader.iter_frames).
+            detections (dict): boxes normalized to [0, 1] (`num boxes` x 4) of the
+                frames to run inference on. Only the frames whose number is a
+                multiple of the stride are queried.
+        Yields:
+            frame_number (int): the query frame, i.e. the last frame of the clip.
+            inputs (list): the clip of each pathway, `channel` x `num frames` x
+                `height` x `width`.
+            boxes (ndarray): the boxes in the resolution of the inputs.
+        """
+        self._reset()
+        for frame_number, img in frames:
+            self._push(frame_number, img)
+            if frame_number % self.stride == 0 and frame_number in detections:
+                clip = self._clip(frame_number)
+                if clip is None:
+                    logger.warning("Skipping frame {}: frames of its clip were not decoded".format(frame_number))
+                    continue
+                inputs = utils.pack_pathway_output(self.cfg, clip)
+                yield frame_number, inputs, self._boxes(detections[frame_number])
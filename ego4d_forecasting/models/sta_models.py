@@ -3,6 +3,8 @@
 
 """Video models."""
 
+from collections import OrderedDict
+
 import numpy as np
 import torch
 import torch.nn as nn
@@ -213,8 +215,18 @@ class ShortTermAnticipationSlowFast(SlowFast):
         self.head_name = "headsta"
         self.add_module(self.head_name, head)
 
+        # s5 features of the last evaluated clips, indexed by clip key
+        self.feature_cache_size = cfg.MODEL.STA_FEATURE_CACHE_SIZE
+        self._feature_cache = OrderedDict()
+
+    def train(self, mode=True):
+        # cached features are stale once the weights are updated
+        self._feature_cache.clear()
+        return super().train(mode)
+
     def extract_features(self, x):
         """Performs feature extraction"""
+        x = self.sample_slow_pathway(x)
         x = self.s1(x)
         x = self.s1_fuse(x)
         x = self.s2(x)
@@ -230,10 +242,46 @@ class ShortTermAnticipationSlowFast(SlowFast):
 
         return x
 
-    def pack_boxes(self, bboxes):
+    def extract_features_cached(self, x, clip_keys):
+        """
+        Performs feature extraction once per distinct clip key, reusing the features
+        of the clips evaluated in the previous batches when possible.
+
+        Args:
+            x (list): the input clips of each pathway.
+            clip_keys (list): a key for each clip of the batch. Clips with the same
+                key are assumed to be identical (e.g. the same video and frame).
+        Returns:
+            features (list): the features of the distinct clips, in order of first
+                appearance of their key.
+            clip_index (list): the index of the features of each clip of the batch.
+        """
+        unique_keys = list(OrderedDict.fromkeys(clip_keys))
+        clip_index = [unique_keys.index(k) for k in clip_keys]
+        first = [clip_keys.index(k) for k in unique_keys]
+
+        missing = [i for i, k in enumerate(unique_keys) if k not in self._feature_cache]
+        if len(missing) > 0:
+            features = self.extract_features([pathway[[first[i] for i in missing]] for pathway in x])
+            for j, i in enumerate(missing):
+                self._feature_cache[unique_keys[i]] = [f[j : j + 1] for f in features]
+
+        features = [self._feature_cache[k] for k in unique_keys]
+        features = [torch.cat(f, 0) for f in zip(*features)]
+
+        for k in unique_keys:
+            self._feature_cache.move_to_end(k)
+        while len(self._feature_cache) > self.feature_cache_size:
+            self._feature_cache.popitem(last=False)
+
+        return features, clip_index
+
+    def pack_boxes(self, bboxes, clip_index=None):
         """Packs images and boxes so that they can be processed in batch"""
         # compute indexes
-        idx = torch.from_numpy(np.concatenate([[i]*len(b) for i, b in enumerate(bboxes)]))
+        if clip_index is None:
+            clip_index = range(len(bboxes))
+        idx = torch.from_numpy(np.concatenate([[i]*len(b) for i, b in zip(clip_index, bboxes)]))
 
         # add indexes as first column of boxes
         bboxes = torch.cat(bboxes, 0)
@@ -285,12 +333,23 @@ class ShortTermAnticipationSlowFast(SlowFast):
 
         return detections, raw_predictions
 
-    def forward(self, videos, bboxes, orig_pred_boxes=None, pred_object_labels=None, pred_object_scores=None):
+    def forward(self, videos, bboxes, orig_pred_boxes=None, pred_object_labels=None, pred_object_scores=None, clip_keys=None, clip_index=None):
         """Expects videos to be a batch of input tensors and bboxes
-        to be a list associated bounding boxes"""
-        packed_bboxes = self.pack_boxes(bboxes)
-
-        features = self.extract_features(videos)
+        to be a list associated bounding boxes. If clip_index is given,
+        the i-th entry of bboxes refers to the clip_index[i]-th clip of
+        videos (see sta_collate). At inference, if clip_keys are given
+        (one per entry of bboxes), features are extracted once per
+        distinct key (see extract_features_cached)"""
+        if clip_index is None:
+            clip_index = list(range(len(bboxes)))
+        if clip_keys is not None and not self.training:
+            # key of each clip of videos
+            keys = dict(zip(clip_index, clip_keys))
+            features, feature_index = self.extract_features_cached(videos, [keys[i] for i in range(len(keys))])
+            clip_index = [feature_index[i] for i in clip_index]
+        else:
+            features = self.extract_features(videos)
+        packed_bboxes = self.pack_boxes(bboxes, clip_index)
 
         pred_verbs, pred_ttcs = self.headsta(features, packed_bboxes)
 
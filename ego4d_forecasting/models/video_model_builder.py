@@ -160,6 +160,7 @@ class SlowFast(nn.Module):
         self.norm_module = get_norm(cfg)
         self.enable_detection = is_detection_enabled(cfg)
         self.num_pathways = 2
+        self.alpha = cfg.SLOWFAST.ALPHA
         self._construct_network(cfg, with_head=with_head)
         init_helper.init_weights(
             self, cfg.MODEL.FC_INIT_STD, cfg.RESNET.ZERO_INIT_FINAL_BN
@@ -375,7 +376,22 @@ class SlowFast(nn.Module):
         self.head_name = "head"
         self.add_module(self.head_name, head)
 
+    def sample_slow_pathway(self, x):
+        """
+        Adds the Slow pathway to inputs made of the Fast pathway only (see
+        SLOWFAST.SAMPLE_SLOW_PATHWAY_IN_MODEL), selecting the same frames as
+        pack_pathway_output on the device of the inputs.
+        """
+        if len(x) == self.num_pathways:
+            return x
+        fast_pathway = x[0]
+        num_frames = fast_pathway.shape[-3]
+        index = torch.linspace(0, num_frames - 1, num_frames // self.alpha).long()
+        slow_pathway = torch.index_select(fast_pathway, -3, index.to(fast_pathway.device))
+        return [slow_pathway, fast_pathway]
+
     def forward(self, x, bboxes=None):
+        x = self.sample_slow_pathway(x)
         x = self.s1(x)
         x = self.s1_fuse(x)
         x = self.s2(x)
@@ -9,6 +9,8 @@ import ego4d_forecasting.utils.misc as misc
 import ego4d_forecasting.models.losses as losses
 from ego4d_forecasting.tasks.video_task import VideoTask
 from ego4d_forecasting.evaluation.sta_metrics import STAMeanAveragePrecision
+from ego4d_forecasting.datasets.sta_device_transform import STADeviceTransform
+from ego4d_forecasting.datasets.loader import unpack_sta_batch
 import itertools
 import json
 
@@ -27,9 +29,17 @@ class ShortTermAnticipationTask(VideoTask):
         self.verb_loss_fun = losses.get_loss_func(cfg.MODEL.VERB_LOSS_FUNC)(reduction="mean")
         self.ttc_loss_fun = losses.get_loss_func(cfg.MODEL.TTC_LOSS_FUNC)(reduction="mean")
         self.lossw = cfg.MODEL.STA_LOSS_WEIGHTS
+        self.device_transform = STADeviceTransform(cfg) if cfg.EGO4D_STA.DEVICE_AUGMENTATION else None
+        self.packed_batches = cfg.EGO4D_STA.PACKED_COLLATE
 
     def training_step(self, batch, batch_idx):
-        _, inputs, pred_boxes, verb_labels, ttc_targets, _ = batch
+        if self.packed_batches:
+            batch = unpack_sta_batch(batch)
+        _, inputs, pred_boxes, verb_labels, ttc_targets, extra_data = batch
+
+        if self.device_transform is not None:
+            # augment the raw uint8 clips on the training device
+            inputs = self.device_transform(inputs, extra_data["spatial_params"])
 
         # model forward pass
         pred_verb, pred_ttc = self.model.forward(inputs, pred_boxes)
@@ -84,6 +94,14 @@ class ShortTermAnticipationTask(VideoTask):
 
         return step_result
 
+    def on_train_epoch_start(self):
+        # the samplers of the training loader (STAVideoBatchSampler, STAVideoBlockSampler,
+        # DistributedSampler) shuffle according to their epoch, set here as they are not
+        # replaced by the trainer (replace_sampler_ddp=False)
+        sampler = self.train_loader.sampler
+        if hasattr(sampler, "set_epoch"):
+            sampler.set_epoch(self.current_epoch)
+
     def training_epoch_end(self, outputs):
         if self.cfg.BN.USE_PRECISE_STATS and len(get_bn_modules(self.model)) > 0:
             misc.calculate_and_update_precise_bn(
@@ -97,11 +115,14 @@ class ShortTermAnticipationTask(VideoTask):
             self.log(key, metric)
 
     def validation_step(self, batch, batch_idx):
+        if self.packed_batches:
+            batch = unpack_sta_batch(batch)
         uids, inputs, pred_boxes, verb_labels, ttc_targets, extra_data = batch
 
         # model forward pass
         detections, raw_predictions = self.model.forward(inputs, pred_boxes, extra_data['orig_pred_boxes'],
-                                                   extra_data['pred_object_labels'], extra_data['pred_object_scores'])
+                                                   extra_data['pred_object_labels'], extra_data['pred_object_scores'],
+                                                   clip_keys=extra_data.get('clip_key'), clip_index=extra_data.get('clip_index'))
 
         return {
             "uids": uids,
@@ -164,11 +185,14 @@ class ShortTermAnticipationTask(VideoTask):
 
 
     def test_step(self, batch, batch_idx):
+        if self.packed_batches:
+            batch = unpack_sta_batch(batch)
         uids, inputs, pred_boxes, _, _, extra_data = batch
 
         # model forward pass
         detections, _ = self.model.forward(inputs, pred_boxes, extra_data['orig_pred_boxes'],
-                                                         extra_data['pred_object_labels'], extra_data['pred_object_scores'])
+                                                         extra_data['pred_object_labels'], extra_data['pred_object_scores'],
+                                                         clip_keys=extra_data.get('clip_key'), clip_index=extra_data.get('clip_index'))
 
 
         return {
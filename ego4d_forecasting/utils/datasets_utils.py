@@ -84,6 +84,9 @@ def pack_pathway_output(cfg, frames):
         frames = frames[..., [2, 1, 0], :, :, :]
     if cfg.MODEL.ARCH in cfg.MODEL.SINGLE_PATHWAY_ARCH:
         frame_list = [frames]
+    elif cfg.MODEL.ARCH in cfg.MODEL.MULTI_PATHWAY_ARCH and cfg.SLOWFAST.SAMPLE_SLOW_PATHWAY_IN_MODEL:
+        # The Slow pathway is sampled by the model, see SlowFast.sample_slow_pathway.
+        frame_list = [frames]
     elif cfg.MODEL.ARCH in cfg.MODEL.MULTI_PATHWAY_ARCH:
         fast_pathway = frames
         # Perform temporal sampling from the fast pathway.
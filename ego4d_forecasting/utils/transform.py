@@ -180,6 +180,112 @@ def uniform_crop(images, size, spatial_idx, boxes=None):
     return cropped, cropped_boxes
 
 
+def random_short_side_scale_jitter_crop(
+    images, min_size, max_size, size=None, spatial_idx=None, boxes=None
+):
+    """
+    Perform a spatial short scale jittering followed by a crop on the given
+    images and corresponding boxes, interpolating only the pixels of the crop.
+    Random parameters are drawn as random_short_side_scale_jitter followed by
+    random_crop (or uniform_crop if spatial_idx is given), and the result is the
+    same up to floating point rounding. The images can be uint8, and are
+    converted to float only in the region the crop is interpolated from.
+    Args:
+        images (tensor): images to perform scale jitter and crop. Dimension is
+            `num frames` x `channel` x `height` x `width`.
+        min_size (int): the minimal size to scale the frames.
+        max_size (int): the maximal size to scale the frames.
+        size (int or None): the size of height and width to crop on the scaled
+            images. If None, the scaled images are not cropped.
+        spatial_idx (int or None): if given, 0, 1, or 2 for the left (top),
+            center, or right (bottom) crop of uniform_crop. If None, the crop
+            is random.
+        boxes (ndarray): optional. Corresponding boxes to images.
+            Dimension is `num boxes` x 4.
+    Returns:
+        (tensor): the float cropped images with dimension of
+            `num frames` x `channel` x `size` x `size`.
+        (ndarray or None): the scaled and cropped boxes with dimension of
+            `num boxes` x 4.
+    """
+    scale = int(round(np.random.uniform(min_size, max_size)))
+
+    height = images.shape[2]
+    width = images.shape[3]
+    scaled = not (
+        (width <= height and width == scale) or (height <= width and height == scale)
+    )
+    new_width, new_height = width, height
+    if scaled:
+        new_width = scale
+        new_height = scale
+        if width < height:
+            new_height = int(math.floor((float(height) / width) * scale))
+            if boxes is not None:
+                boxes = boxes * float(new_height) / height
+        else:
+            new_width = int(math.floor((float(width) / height) * scale))
+            if boxes is not None:
+                boxes = boxes * float(new_width) / width
+
+    crop_height, crop_width = new_height, new_width
+    y_offset, x_offset = 0, 0
+    if size is not None:
+        crop_height, crop_width = size, size
+        if spatial_idx is None:
+            if new_height > size:
+                y_offset = int(np.random.randint(0, new_height - size))
+            if new_width > size:
+                x_offset = int(np.random.randint(0, new_width - size))
+        else:
+            assert spatial_idx in [0, 1, 2]
+            y_offset = int(math.ceil((new_height - size) / 2))
+            x_offset = int(math.ceil((new_width - size) / 2))
+            if new_height > new_width:
+                if spatial_idx == 0:
+                    y_offset = 0
+                elif spatial_idx == 2:
+                    y_offset = new_height - size
+            else:
+                if spatial_idx == 0:
+                    x_offset = 0
+                elif spatial_idx == 2:
+                    x_offset = new_width - size
+
+    if boxes is not None and (x_offset != 0 or y_offset != 0):
+        boxes = crop_boxes(boxes, x_offset, y_offset)
+
+    if not scaled:
+        cropped = images[
+            :, :, y_offset : y_offset + crop_height, x_offset : x_offset + crop_width
+        ]
+        return cropped.float(), boxes
+
+    # Coordinates in the images of the centers of the cropped pixels, as
+    # interpolate with align_corners=False, clamped to replicate the border.
+    xs = torch.arange(x_offset, x_offset + crop_width, dtype=torch.float32)
+    ys = torch.arange(y_offset, y_offset + crop_height, dtype=torch.float32)
+    src_x = ((xs + 0.5) * (width / new_width) - 0.5).clamp(0, width - 1)
+    src_y = ((ys + 0.5) * (height / new_height) - 0.5).clamp(0, height - 1)
+
+    # Region of the images the crop is interpolated from.
+    x0, x1 = int(src_x[0]), min(int(src_x[-1]) + 2, width)
+    y0, y1 = int(src_y[0]), min(int(src_y[-1]) + 2, height)
+    region = images[:, :, y0:y1, x0:x1].float()
+
+    grid_x = (2 * (src_x - x0) + 1) / (x1 - x0) - 1
+    grid_y = (2 * (src_y - y0) + 1) / (y1 - y0) - 1
+    grid = torch.stack(torch.broadcast_tensors(grid_x[None, :], grid_y[:, None]), dim=-1)
+    cropped = torch.nn.functional.grid_sample(
+        region,
+        grid.expand(images.shape[0], crop_height, crop_width, 2),
+        mode="bilinear",
+        padding_mode="border",
+        align_corners=False,
+    )
+    return cropped, boxes
+
+
 def clip_boxes_to_image(boxes, height, width):
     """
     Clip an array of boxes to an image with the given height and width.
@@ -360,6 +466,78 @@ def lighting_jitter(images, alphastd, eigval, eigvec):
     return out_images
 
 
+def color_jitter_affine(
+    channel_means,
+    img_brightness=0,
+    img_contrast=0,
+    img_saturation=0,
+    alphastd=0,
+    eigval=None,
+    eigvec=None,
+):
+    """
+    Get the per-pixel affine transform performed by color_jitter followed by
+    lighting_jitter, drawing the same random numbers. As brightness,
+    contrast, saturation and lighting jittering are linear in the pixel
+    values, they amount to a single `channel` x `channel` matrix, and a bias
+    per frame (contrast blends each frame with its mean gray value). The
+    channels of images should be in order BGR.
+    Args:
+        channel_means (ndarray): the mean of each channel of each frame of
+            the images to jitter. Dimension is `num frames` x `channel`.
+        img_brightness (float): jitter ratio for brightness.
+        img_contrast (float): jitter ratio for contrast.
+        img_saturation (float): jitter ratio for saturation.
+        alphastd (float): jitter ratio for PCA jitter.
+        eigval (list): eigenvalues for PCA jitter.
+        eigvec (list[list]): eigenvectors for PCA jitter.
+    Returns:
+        weight (ndarray): the color transform, with dimension of
+            `channel` x `channel`.
+        bias (ndarray): the offsets of each frame, with dimension of
+            `num frames` x `channel`.
+    """
+    weight = np.eye(3)
+    bias = np.zeros((len(channel_means), 3))
+    # Grayscale of BGR images: R -> 0.299, G -> 0.587, B -> 0.114.
+    gray = np.array([0.114, 0.587, 0.299])
+
+    jitter = []
+    if img_brightness != 0:
+        jitter.append(("brightness", img_brightness))
+    if img_contrast != 0:
+        jitter.append(("contrast", img_contrast))
+    if img_saturation != 0:
+        jitter.append(("saturation", img_saturation))
+
+    if len(jitter) > 0:
+        order = np.random.permutation(np.arange(len(jitter)))
+        for idx in range(0, len(jitter)):
+            name, var = jitter[order[idx]]
+            alpha = 1.0 + np.random.uniform(-var, var)
+            if name == "brightness":
+                weight, bias = alpha * weight, alpha * bias
+            elif name == "contrast":
+                mean_gray = (channel_means @ weight.T + bias) @ gray
+                weight = alpha * weight
+                bias = alpha * bias + (1 - alpha) * mean_gray[:, None]
+            elif name == "saturation":
+                blend = alpha * np.eye(3) + (1 - alpha) * np.outer(np.ones(3), gray)
+                weight, bias = blend @ weight, bias @ blend.T
+
+    if alphastd != 0:
+        alpha = np.random.normal(0, alphastd, size=(1, 3))
+        eig_vec = np.array(eigvec)
+        eig_val = np.reshape(eigval, (1, 3))
+        rgb = np.sum(
+            eig_vec * np.repeat(alpha, 3, axis=0) * np.repeat(eig_val, 3, axis=0),
+            axis=1,
+        )
+        bias = bias + rgb[::-1]
+
+    return weight, bias
+
+
 def color_normalization(images, mean, stddev):
     """
     Perform color nomration on the given images.
@@ -381,3 +559,50 @@ def color_normalization(images, mean, stddev):
         out_images[:, idx] = (images[:, idx] - mean[idx]) / stddev[idx]
 
     return out_images
+
+
+def color_normalization_affine(images, mean, stddev, weight=None, bias=None, scale=1.0):
+    """
+    Perform an affine color transform (see color_jitter_affine) followed by
+    color normalization on the given images, in a single pass over the pixels.
+    Output channel `i` is
+    `(weight[i] @ (scale * pixel) + bias[frame, i] - mean[i]) / stddev[i]`, so
+    permuting the rows of weight, bias, mean and stddev permutes the output
+    channels.
+    Args:
+        images (tensor): images to perform color normalization. Dimension is
+            `num frames` x `channel` x `height` x `width`.
+        mean (list): mean values for normalization.
+        stddev (list): standard deviations for normalization.
+        weight (ndarray or None): the color transform, with dimension of
+            `channel` x `channel`. Identity if None.
+        bias (ndarray or None): the offsets of each frame, with dimension of
+            `num frames` x `channel`. Zero if None.
+        scale (float): factor the pixel values are multiplied by first.
+
+    Returns:
+        out_images (tensor): the noramlized images, the dimension is
+            `num frames` x `channel` x `height` x `width`.
+    """
+    assert len(mean) == images.shape[1], "channel mean not computed properly"
+    assert len(stddev) == images.shape[1], "channel stddev not computed properly"
+
+    mean = np.asarray(mean, dtype=np.float64)
+    stddev = np.asarray(stddev, dtype=np.float64)
+    num_frames, channels, height, width = images.shape
+    if weight is None:
+        weight = np.eye(channels)
+    if bias is None:
+        bias = np.zeros((num_frames, channels))
+
+    matrix = np.asarray(weight) * scale / stddev[:, None]
+    offset = (np.asarray(bias) - mean) / stddev
+    matrix = torch.from_numpy(matrix).to(images.dtype)
+    offset = torch.from_numpy(offset).to(images.dtype)
+
+    out_images = torch.baddbmm(
+        offset[:, :, None],
+        matrix.expand(num_frames, channels, channels),
+        images.reshape(num_frames, channels, height * width),
+    )
+    return out_images.view(num_frames, channels, height, width)
@@ -38,6 +38,8 @@ def random_scale_crop_flip(mode: str, cfg):
 
 
 def uniform_temporal_subsample_repeated(cfg):
+    # the Slow pathway may be sampled by the model instead
+    sample_slow_pathway = len(cfg.DATA.INPUT_CHANNEL_NUM) == 2 and not cfg.SLOWFAST.SAMPLE_SLOW_PATHWAY_IN_MODEL
     return UniformTemporalSubsampleRepeated(
-        ((cfg.SLOWFAST.ALPHA, 1) if len(cfg.DATA.INPUT_CHANNEL_NUM) == 2 else (1,))
+        ((cfg.SLOWFAST.ALPHA, 1) if sample_slow_pathway else (1,))
     )
@@ -0,0 +1,137 @@
+"""
+Dense short term anticipation inference over whole videos.
+
+Each video is decoded once (see STAStreamingClips) and the model is run on the
+frames having object detections, every EGO4D_STA.STREAMING_STRIDE frames. The
+detections are read from a json file mapping video uids to frame numbers to lists
+of detections, in the format of EGO4D_STA.OBJ_DETECTIONS. Results are written to
+RESULTS_JSON in the format of the test split, using "{video_uid}_{frame:07d}" uids.
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import av
+import numpy as np
+import torch
+
+import ego4d_forecasting.utils.logging as logging
+from ego4d_forecasting.datasets.sta_streaming import STAStreamingClips
+from ego4d_forecasting.datasets.short_term_anticipation import PyAVVideoReader
+from ego4d_forecasting.tasks.short_term_anticipation import ShortTermAnticipationTask
+from ego4d_forecasting.utils.parser import load_config
+
+logger = logging.get_logger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Dense STA inference over whole videos")
+    parser.add_argument("--cfg", dest="cfg_file", help="Path to the config file", type=str)
+    parser.add_argument("--videos", type=Path, nargs="+", required=True, help="mp4 videos, named after their uid")
+    parser.add_argument("--detections", type=Path, required=True, help="json file with the object detections of the frames")
+    parser.add_argument(
+        "opts",
+        help="See ego4d/config/defaults.py for all options",
+        default=None,
+        nargs=argparse.REMAINDER,
+    )
+    return parser.parse_args()
+
+
+def load_detections(cfg, detections, frame_width, frame_height):
+    """Filters the detections of a video by score and normalizes their boxes"""
+    boxes, labels, scores = {}, {}, {}
+    for frame, dets in detections.items():
+        dets = [d for d in dets if d["score"] >= cfg.EGO4D_STA.DETECTION_SCORE_THRESH]
+        if len(dets) == 0:
+            continue
+        frame = int(frame)
+        boxes[frame] = np.vstack([d["box"] for d in dets])
+        labels[frame] = np.array([d["noun_category_id"] for d in dets])
+        scores[frame] = np.array([d["score"] for d in dets])
+    normalized = {f: b / np.array([frame_width, frame_height] * 2) for f, b in boxes.items()}
+    return normalized, boxes, labels, scores
+
+
+def run_batch(model, batch, device):
+    """Runs the model on a list of (uid, inputs, boxes, orig boxes, labels, scores)"""
+    uids, inputs, boxes, orig_boxes, labels, scores = zip(*batch)
+    inputs = [torch.stack(pathway).to(device, non_blocking=True) for pathway in zip(*inputs)]
+    boxes = [torch.from_numpy(b.astype(np.float32)).to(device) for b in boxes]
+    with torch.no_grad():
+        detections, _ = model.forward(inputs, boxes, list(orig_boxes), list(labels), list(scores))
+    return dict(zip(uids, detections))
+
+
+def main(cfg, args):
+    logging.setup_logging(cfg.OUTPUT_DIR)
+
+    if len(cfg.CHECKPOINT_FILE_PATH) > 0:
+        task = ShortTermAnticipationTask.load_from_checkpoint(cfg.CHECKPOINT_FILE_PATH)
+    else:
+        task = ShortTermAnticipationTask(cfg)
+    device = torch.device("cuda" if cfg.NUM_GPUS > 0 and torch.cuda.is_available() else "cpu")
+    model = task.model.to(device).eval()
+
+    all_detections = json.load(open(args.detections))
+    streaming = STAStreamingClips(cfg, stride=cfg.EGO4D_STA.STREAMING_STRIDE)
+
+    results = {}
+    for path_to_video in args.videos:
+        video_uid = path_to_video.stem
+        with av.open(str(path_to_video)) as container:
+            frame_width = container.streams.video[0].width
+            frame_height = container.streams.video[0].height
+        normalized, boxes, labels, scores = load_detections(cfg, all_detections.get(video_uid, {}), frame_width, frame_height)
+
+        reader = PyAVVideoReader(
+            str(path_to_video),
+            # frames are resized as by Ego4dShortTermAnticipation._pyav_reader
+            height=320,
+            thread_type=cfg.EGO4D_STA.VIDEO_DECODER_THREAD_TYPE or None,
+            thread_count=cfg.EGO4D_STA.VIDEO_DECODER_THREADS,
+            decode_resize=cfg.EGO4D_STA.PYAV_DECODE_RESIZE,
+            stats={},
+        )
+
+        start = time.perf_counter()
+        batch, num_queries = [], 0
+        for frame, inputs, input_boxes in streaming.iter_clips(reader.iter_frames(), normalized):
+            uid = "{}_{:07d}".format(video_uid, frame)
+            batch.append((uid, inputs, input_boxes, boxes[frame], labels[frame], scores[frame]))
+            num_queries += 1
+            if len(batch) == cfg.TEST.BATCH_SIZE:
+                results.update(run_batch(model, batch, device))
+                batch = []
+        if len(batch) > 0:
+            results.update(run_batch(model, batch, device))
+
+        elapsed = time.perf_counter() - start
+        logger.info("{}: {} frames, {} queries in {:.1f}s ({:.1f} frames/s)".format(
+            video_uid, reader.stats.get("frames_decoded", 0), num_queries, elapsed, reader.stats.get("frames_decoded", 0) / elapsed))
+
+    res = {
+        'version': '1.0',
+        'challenge': 'ego4d_short_term_object_interaction_anticipation',
+        'results': {
+            uid: [
+                {
+                    'box': [float(h) for h in z[0]],
+                    'noun_category_id': int(z[1]),
+                    'verb_category_id': int(z[2]),
+                    'time_to_contact': float(z[3]),
+                    'score': float(z[4])
+                } for z in zip(x['boxes'], x['nouns'], x['verbs'], x['ttcs'], x['scores'])
+            ] for uid, x in results.items()
+        }
+    }
+    with open(cfg.RESULTS_JSON, 'w') as f:
+        json.dump(res, f)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    cfg = load_config(args)
+    main(cfg, args)
@@ -0,0 +1,204 @@
+import numpy as np
+import pytest
+
+from ego4d_forecasting.datasets import cv2_transform
+
+PCA_EIGVAL = np.array([0.225, 0.224, 0.229], dtype=np.float32)
+PCA_EIGVEC = np.array(
+    [
+        [-0.5675, 0.7192, 0.4009],
+        [-0.5808, -0.0045, -0.8140],
+        [-0.5836, -0.6948, 0.4203],
+    ],
+    dtype=np.float32,
+)
+MEAN = np.array([0.45, 0.4, 0.35], dtype=np.float32)
+STD = np.array([0.225, 0.25, 0.2], dtype=np.float32)
+
+SHAPES = [(60, 80), (80, 60), (64, 64)]
+
+
+def _frames(height, width, num_frames=4, seed=0):
+    """uint8 HWC BGR frames, as decoded"""
+    rng = np.random.RandomState(seed)
+    return [rng.randint(0, 256, (height, width, 3)).astype(np.uint8) for _ in range(num_frames)]
+
+
+def _boxes(height, width):
+    return [np.array([[2.0, 3.0, width - 10.0, height - 5.0], [0.0, 0.0, width - 1.0, height - 1.0]])]
+
+
+def _assert_boxes_equal(boxes, expected):
+    assert len(boxes) == len(expected)
+    for b, e in zip(boxes, expected):
+        np.testing.assert_array_equal(b, e)
+
+
+def _run(seed, transform, *args, **kwargs):
+    """Runs a transform from a given seed, with the next random draw"""
+    np.random.seed(seed)
+    outputs = transform(*args, **kwargs)
+    return outputs, np.random.rand()
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+@pytest.mark.parametrize("seed", range(4))
+def test_random_short_side_scale_jitter_clip(shape, seed):
+    frames = _frames(*shape, seed=seed)
+
+    (expected, expected_boxes), expected_state = _run(
+        seed, cv2_transform.random_short_side_scale_jitter_list, frames, 48, 72, boxes=_boxes(*shape)
+    )
+    (clip, boxes), state = _run(
+        seed, cv2_transform.random_short_side_scale_jitter_clip, frames, 48, 72, boxes=_boxes(*shape)
+    )
+
+    assert state == expected_state
+    # the clip keeps the uint8 dtype, with the values of the float32 frames
+    assert clip.dtype == np.uint8
+    assert np.array_equal(clip, np.stack(expected))
+    _assert_boxes_equal(boxes, expected_boxes)
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+@pytest.mark.parametrize("size", [48, 60])
+def test_random_short_side_scale_jitter_clip_out(shape, size):
+    frames = _frames(*shape)
+    # without jitter, the size of the output is known
+    (expected, _), _ = _run(0, cv2_transform.random_short_side_scale_jitter_list, frames, size, size)
+    out = np.empty((len(frames),) + expected[0].shape, dtype=np.uint8)
+
+    (clip, _), _ = _run(0, cv2_transform.random_short_side_scale_jitter_clip, frames, size, size, out=out)
+
+    assert clip is out
+    assert np.array_equal(clip, np.stack(expected))
+
+
+@pytest.mark.parametrize("shape", SHAPES + [(90, 120)])
+@pytest.mark.parametrize("scale", [(48, 72), (60, 60), (56, 56)])
+@pytest.mark.parametrize("seed", range(4))
+def test_random_short_side_scale_jitter_crop_clip(shape, scale, seed):
+    frames = _frames(*shape, seed=seed)
+
+    def scale_jitter_crop_list():
+        imgs, boxes = cv2_transform.random_short_side_scale_jitter_list(frames, *scale, boxes=_boxes(*shape))
+        return cv2_transform.random_crop_list(imgs, 56, order="HWC", boxes=boxes)
+
+    (expected, expected_boxes), expected_state = _run(seed, scale_jitter_crop_list)
+    out = np.empty((len(frames), 56, 56, 3), dtype=np.uint8)
+    (clip, boxes), state = _run(
+        seed, cv2_transform.random_short_side_scale_jitter_crop_clip, frames, *scale, 56, boxes=_boxes(*shape), out=out
+    )
+
+    # same scale and crop offsets drawn
+    assert state == expected_state
+    _assert_boxes_equal(boxes, expected_boxes)
+    assert clip is out
+    # the pixels are interpolated by cv2.warpAffine instead of cv2.resize
+    assert np.abs(clip.astype(np.float32) - np.stack(expected)).max() <= 1
+
+
+@pytest.mark.parametrize("shape", SHAPES + [(48, 90)])
+def test_scale_clip(shape):
+    frames = _frames(*shape)
+    expected = np.stack([cv2_transform.scale(48, frame) for frame in frames])
+
+    assert np.array_equal(cv2_transform.scale_clip(48, frames), expected)
+    assert np.array_equal(cv2_transform.scale_clip(48, np.stack(frames)), expected)
+
+    out = np.empty(expected.shape, dtype=np.uint8)
+    assert cv2_transform.scale_clip(48, frames, out=out) is out
+    assert np.array_equal(out, expected)
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+@pytest.mark.parametrize("seed", range(4))
+def test_random_crop_clip(shape, seed):
+    frames = _frames(*shape, seed=seed)
+
+    (expected, expected_boxes), expected_state = _run(
+        seed, cv2_transform.random_crop_list, frames, 56, order="HWC", boxes=_boxes(*shape)
+    )
+    (clip, boxes), state = _run(seed, cv2_transform.random_crop_clip, np.stack(frames), 56, boxes=_boxes(*shape))
+
+    assert state == expected_state
+    assert np.array_equal(clip, np.stack(expected))
+    _assert_boxes_equal(boxes, expected_boxes)
+
+
+@pytest.mark.parametrize("prob", [0.0, 0.5, 1.0])
+@pytest.mark.parametrize("seed", range(4))
+def test_horizontal_flip_clip(prob, seed):
+    frames = _frames(60, 80, seed=seed)
+
+    (expected, expected_boxes), expected_state = _run(
+        seed, cv2_transform.horizontal_flip_list, prob, frames, order="HWC", boxes=_boxes(60, 80)
+    )
+    (clip, boxes), state = _run(seed, cv2_transform.horizontal_flip_clip, prob, np.stack(frames), boxes=_boxes(60, 80))
+
+    assert state == expected_state
+    assert np.array_equal(clip, np.stack(expected))
+    _assert_boxes_equal(boxes, expected_boxes)
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+@pytest.mark.parametrize("spatial_shift_pos", [0, 1, 2])
+def test_spatial_shift_crop_clip(shape, spatial_shift_pos):
+    frames = _frames(*shape)
+
+    expected, expected_boxes = cv2_transform.spatial_shift_crop_list(
+        56, frames, spatial_shift_pos, boxes=_boxes(*shape)
+    )
+    clip, boxes = cv2_transform.spatial_shift_crop_clip(56, np.stack(frames), spatial_shift_pos, boxes=_boxes(*shape))
+
+    assert np.array_equal(clip, np.stack(expected))
+    _assert_boxes_equal(boxes, expected_boxes)
+
+
+def test_images_to_clip():
+    frames = _frames(60, 80)
+    expected = np.stack([cv2_transform.HWC2CHW(frame) / 255.0 for frame in frames], axis=1).astype(np.float32)
+
+    assert np.array_equal(cv2_transform.images_to_clip(frames), expected)
+    assert np.array_equal(cv2_transform.images_to_clip(np.stack(frames), bgr_to_rgb=True), expected[::-1])
+
+    out = np.empty(expected.shape, dtype=np.float32)
+    assert cv2_transform.images_to_clip(frames, out=out) is out
+    assert np.array_equal(out, expected)
+
+
+def _color_augmentation_list(frames, pca_jitter_only):
+    """Color augmentation on per-frame BGR CHW images, followed by the normalization"""
+    imgs = list(cv2_transform.images_to_clip(frames).transpose([1, 0, 2, 3]))
+    if not pca_jitter_only:
+        imgs = cv2_transform.color_jitter_list(imgs, img_brightness=0.4, img_contrast=0.4, img_saturation=0.4)
+    imgs = cv2_transform.lighting_list(imgs, alphastd=0.1, eigval=PCA_EIGVAL, eigvec=PCA_EIGVEC)
+    clip = np.stack(imgs, axis=1)
+    return (clip - MEAN[:, None, None, None]) / STD[:, None, None, None]
+
+
+def _color_augmentation_clip(frames, pca_jitter_only):
+    """Color augmentation in place on the BGR CTHW clip, followed by the normalization"""
+    out = np.empty((3, len(frames)) + frames[0].shape[:2], dtype=np.float32)
+    clip = cv2_transform.images_to_clip(frames, out=out)
+    if not pca_jitter_only:
+        clip = cv2_transform.color_jitter_clip(clip, img_brightness=0.4, img_contrast=0.4, img_saturation=0.4)
+        assert clip is out
+    clip = cv2_transform.lighting_clip(clip, alphastd=0.1, eigval=PCA_EIGVAL, eigvec=PCA_EIGVEC)
+    assert clip is out
+    clip = cv2_transform.color_normalization(clip, MEAN, STD)
+    assert clip is out
+    return clip
+
+
+@pytest.mark.parametrize("pca_jitter_only", [False, True])
+@pytest.mark.parametrize("seed", range(8))
+def test_color_augmentation_clip(pca_jitter_only, seed):
+    frames = _frames(60, 80, seed=seed)
+
+    expected, expected_state = _run(seed, _color_augmentation_list, frames, pca_jitter_only)
+    clip, state = _run(seed, _color_augmentation_clip, frames, pca_jitter_only)
+
+    assert state == expected_state
+    assert clip.dtype == expected.dtype == np.float32
+    assert np.array_equal(clip, expected)
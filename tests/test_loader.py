@@ -0,0 +1,137 @@
+import zlib
+
+import numpy as np
+import pytest
+import torch
+
+from ego4d_forecasting.datasets.loader import packed_sta_collate, sta_collate, unpack_sta_batch
+
+CLIP_SHAPE = (3, 8, 32, 32)
+
+
+def _example(uid, clip_key, num_boxes, split="val", seed=0, raw=False):
+    """
+    An example in the format of Ego4dShortTermAnticipation, whose clip depends on its key.
+    With raw=True, the clip is a uint8 `num frames` x `height` x `width` x `channel`
+    clip of a size depending on its key, as with EGO4D_STA.DEVICE_AUGMENTATION.
+    """
+    rng = np.random.RandomState(seed)
+    clip_seed = zlib.crc32(clip_key.encode())
+    generator = torch.Generator().manual_seed(clip_seed)
+    if raw:
+        shape = (CLIP_SHAPE[1], 24 + clip_seed % 3 * 4, 28 + clip_seed % 5 * 2, 3)
+        imgs = [torch.randint(0, 256, shape, dtype=torch.uint8, generator=generator)]
+    else:
+        fast = torch.randn(CLIP_SHAPE, generator=generator)
+        imgs = [fast[:, ::4].clone(), fast]
+    boxes = np.sort(rng.rand(num_boxes, 2, 2) * 32, axis=1).reshape(num_boxes, 4)[:, [0, 2, 1, 3]]
+    extra_data = {
+        "orig_pred_boxes": boxes * 4,
+        "pred_object_scores": rng.rand(num_boxes),
+        "pred_object_labels": rng.randint(0, 10, num_boxes),
+    }
+    if split == "test":
+        verb_labels, ttc_targets = np.array([]), np.array([])
+    else:
+        verb_labels, ttc_targets = rng.randint(-1, 5, num_boxes), rng.rand(num_boxes).astype(np.float32)
+        extra_data["gt_detections"] = {
+            "boxes": boxes[:1] * 4,
+            "nouns": rng.randint(0, 10, 1),
+            "verbs": rng.randint(0, 5, 1),
+            "ttcs": rng.rand(1),
+        }
+    extra_data["clip_key"] = clip_key
+    return uid, imgs, boxes, verb_labels, ttc_targets, extra_data
+
+
+def _groups(split="val", raw=False):
+    """Groups of examples sharing their clip, as returned with EGO4D_STA.GROUP_BY_FRAME"""
+    keys = [["v0_0000010", "v0_0000010", "v0_0000010"], ["v1_0000042"], ["v0_0000020", "v0_0000020"]]
+    return [
+        [
+            _example("uid_{}_{}".format(g, i), key, num_boxes=i + g % 2, split=split, seed=10 * g + i, raw=raw)
+            for i, key in enumerate(group)
+        ]
+        for g, group in enumerate(keys)
+    ]
+
+
+def test_sta_collate_groups():
+    groups = _groups()
+    examples = [example for group in groups for example in group]
+    eids, inputs, pred_boxes, verb_labels, ttc_targets, extra_data = sta_collate(groups)
+
+    # the clip of each group is stacked once
+    assert [x.shape[0] for x in inputs] == [len(groups)] * 2
+    assert extra_data["clip_index"] == [0, 0, 0, 1, 2, 2]
+    assert list(eids) == [e[0] for e in examples]
+    assert len(pred_boxes) == len(examples)
+    for example, index, boxes in zip(examples, extra_data["clip_index"], pred_boxes):
+        for pathway, clip in zip(inputs, example[1]):
+            assert torch.equal(pathway[index], clip)
+        assert torch.equal(boxes, torch.from_numpy(example[2]))
+
+
+def test_sta_collate_without_groups():
+    groups = _groups()
+    examples = [example for group in groups for example in group]
+    _, inputs, pred_boxes, _, _, extra_data = sta_collate(examples)
+
+    # one clip per example, as without EGO4D_STA.GROUP_BY_FRAME
+    assert [x.shape[0] for x in inputs] == [len(examples)] * 2
+    assert "clip_index" not in extra_data
+    assert extra_data["clip_key"] == [e[5]["clip_key"] for e in examples]
+    for i, example in enumerate(examples):
+        for pathway, clip in zip(inputs, example[1]):
+            assert torch.equal(pathway[i], clip)
+
+
+def _assert_same_values(value, expected):
+    if isinstance(expected, dict):
+        assert value.keys() == expected.keys()
+        for k in expected:
+            _assert_same_values(value[k], expected[k])
+    elif isinstance(expected, (list, tuple)):
+        assert len(value) == len(expected)
+        for v, e in zip(value, expected):
+            _assert_same_values(v, e)
+    elif isinstance(expected, torch.Tensor):
+        assert value.dtype == expected.dtype
+        assert torch.equal(value, expected)
+    elif isinstance(expected, np.ndarray):
+        assert value.dtype == expected.dtype
+        np.testing.assert_array_equal(value, expected)
+    else:
+        assert value == expected
+
+
+@pytest.mark.parametrize("split", ["val", "test"])
+@pytest.mark.parametrize("grouped", [False, True])
+@pytest.mark.parametrize("raw", [False, True])
+def test_packed_sta_collate_round_trip(split, grouped, raw):
+    batch = _groups(split, raw=raw)
+    if not grouped:
+        batch = [example for group in batch for example in group]
+    expected = sta_collate(batch)
+    packed = packed_sta_collate(batch)
+    eids, inputs, pred_boxes, verb_labels, ttc_targets, extra_data = unpack_sta_batch(packed)
+
+    assert list(eids) == list(expected[0])
+    # the first column of the packed boxes is the index of their clip
+    clip_index = expected[5]["clip_index"] if grouped else range(len(pred_boxes))
+    assert packed[2][:, 0].tolist() == [i for i, boxes in zip(clip_index, pred_boxes) for _ in boxes]
+    _assert_same_values(pred_boxes, expected[2])
+    _assert_same_values(verb_labels, expected[3])
+    _assert_same_values(ttc_targets, expected[4])
+    _assert_same_values(extra_data, dict(expected[5]))
+    assert ("clip_index" in extra_data) == grouped
+
+    assert len(inputs) == len(expected[1])
+    for x, e in zip(inputs, expected[1]):
+        assert x.dtype == e.dtype
+        if raw:
+            # padded uint8 clips are kept as they are
+            assert torch.equal(x, e)
+        else:
+            # float clips are sent as fp16
+            torch.testing.assert_close(x, e, rtol=2**-11, atol=2**-24)
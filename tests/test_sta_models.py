@@ -0,0 +1,212 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+
+from ego4d_forecasting.config.defaults import get_cfg
+from ego4d_forecasting.datasets.loader import sta_collate
+from ego4d_forecasting.models.build import build_model
+from ego4d_forecasting.utils.datasets_utils import pack_pathway_output
+
+CONFIG = Path(__file__).parents[1] / "configs" / "Ego4dShortTermAnticipation" / "SLOWFAST_32x1_8x4_R50.yaml"
+
+NUM_FRAMES = 8
+CROP_SIZE = 64
+
+
+def _cfg(*opts):
+    cfg = get_cfg()
+    cfg.merge_from_file(str(CONFIG))
+    # a narrow network on short clips, to run on the CPU
+    cfg.merge_from_list(["NUM_GPUS", 0, "RESNET.WIDTH_PER_GROUP", 8, "DATA.NUM_FRAMES", NUM_FRAMES] + list(opts))
+    return cfg
+
+
+def _model(*opts):
+    torch.manual_seed(0)
+    return build_model(_cfg(*opts)).eval()
+
+
+def _clips(num_clips, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    fast = torch.randn(num_clips, 3, NUM_FRAMES, CROP_SIZE, CROP_SIZE, generator=generator)
+    slow = fast[:, :, torch.linspace(0, NUM_FRAMES - 1, NUM_FRAMES // 4).long()]
+    return [slow, fast]
+
+
+def _select(clips, index):
+    return [pathway[index] for pathway in clips]
+
+
+def _assert_equal(features, expected):
+    assert len(features) == len(expected)
+    for f, e in zip(features, expected):
+        assert torch.equal(f, e)
+
+
+@pytest.mark.parametrize("num_frames", [NUM_FRAMES, 32])
+def test_sample_slow_pathway_matches_pack_pathway_output(num_frames):
+    model = _model("SLOWFAST.SAMPLE_SLOW_PATHWAY_IN_MODEL", True)
+    fast = torch.randn(2, 3, num_frames, 8, 8, generator=torch.Generator().manual_seed(0))
+
+    # the dataset packs the pathways of each clip, the model those of the batch
+    assert len(pack_pathway_output(_cfg("SLOWFAST.SAMPLE_SLOW_PATHWAY_IN_MODEL", True), fast[0])) == 1
+    expected = [pack_pathway_output(_cfg(), clip) for clip in fast]
+    slow, fast_pathway = model.sample_slow_pathway([fast])
+    assert torch.equal(slow, torch.stack([pathways[0] for pathways in expected]))
+    assert fast_pathway is fast
+
+    # inputs that already contain both pathways are passed through
+    inputs = [torch.stack([pathways[i] for pathways in expected]) for i in range(2)]
+    assert model.sample_slow_pathway(inputs) is inputs
+
+
+@torch.no_grad()
+def test_features_with_slow_pathway_sampled_in_model():
+    model = _model("SLOWFAST.SAMPLE_SLOW_PATHWAY_IN_MODEL", True)
+    fast = _clips(2)[1]
+
+    expected = model.extract_features(pack_pathway_output(_cfg(), fast))
+    _assert_equal(model.extract_features([fast]), expected)
+
+
+@torch.no_grad()
+def test_feature_cache_matches_fresh_pass():
+    model = _model("MODEL.STA_FEATURE_CACHE_SIZE", 4)
+    clips = _clips(3)
+
+    # clips 0 and 2 share their key, the backbone runs on the distinct ones
+    features, clip_index = model.extract_features_cached(_select(clips, [0, 1, 0]), ["a", "b", "a"])
+    assert clip_index == [0, 1, 0]
+    _assert_equal(features, model.extract_features(_select(clips, [0, 1])))
+    assert list(model._feature_cache) == ["a", "b"]
+
+    # "b" is served from the cache whatever the input clip, "c" is extracted
+    expected_b = [f[1:2] for f in features]
+    features, clip_index = model.extract_features_cached(_select(clips, [2, 2]), ["b", "c"])
+    assert clip_index == [0, 1]
+    _assert_equal([f[:1] for f in features], expected_b)
+    _assert_equal([f[1:] for f in features], model.extract_features(_select(clips, [2])))
+    assert list(model._feature_cache) == ["a", "b", "c"]
+
+
+@torch.no_grad()
+def test_feature_cache_lru_eviction():
+    model = _model("MODEL.STA_FEATURE_CACHE_SIZE", 2)
+    clips = _clips(4)
+
+    for i, key in [(0, "a"), (1, "b"), (0, "a"), (2, "c")]:
+        model.extract_features_cached(_select(clips, [i]), [key])
+    # "b" is the least recently used
+    assert list(model._feature_cache) == ["a", "c"]
+
+    # evicted keys are extracted again from the given clip
+    features, _ = model.extract_features_cached(_select(clips, [3]), ["b"])
+    _assert_equal(features, model.extract_features(_select(clips, [3])))
+    assert list(model._feature_cache) == ["c", "b"]
+
+
+@torch.no_grad()
+def test_feature_cache_disabled():
+    model = _model("MODEL.STA_FEATURE_CACHE_SIZE", 0)
+    clips = _clips(2)
+
+    # clips sharing their key in a batch are still extracted once
+    features, clip_index = model.extract_features_cached(_select(clips, [0, 1, 1]), ["a", "b", "b"])
+    assert clip_index == [0, 1, 1]
+    _assert_equal(features, model.extract_features(_select(clips, [0, 1])))
+    assert len(model._feature_cache) == 0
+
+
+@torch.no_grad()
+def test_feature_cache_reset_by_train():
+    model = _model("MODEL.STA_FEATURE_CACHE_SIZE", 4)
+    clips = _clips(2)
+
+    model.extract_features_cached(_select(clips, [0]), ["a"])
+    model.train()
+    assert len(model._feature_cache) == 0
+
+    model.eval()
+    model.extract_features_cached(_select(clips, [0]), ["a"])
+    model.eval()
+    assert len(model._feature_cache) == 0
+
+    # at training time, forward does not use the cache
+    model.train()
+    boxes = [torch.tensor([[4.0, 4.0, 40.0, 40.0]])]
+    model.forward(_select(clips, [1]), boxes, clip_keys=["b"])
+    assert len(model._feature_cache) == 0
+
+
+@torch.no_grad()
+def test_forward_with_clip_keys():
+    model = _model("MODEL.STA_FEATURE_CACHE_SIZE", 4)
+    clips = _clips(2)
+    boxes = [torch.tensor([[4.0, 4.0, 40.0, 40.0]]), torch.tensor([[0.0, 8.0, 30.0, 60.0], [10.0, 10.0, 20.0, 20.0]])]
+    args = ([b.numpy() for b in boxes], [[0], [1, 2]], [[0.9], [0.8, 0.7]])
+
+    _, expected = model.forward(_select(clips, [0, 1]), boxes, *args)
+    for _ in range(2):
+        # second pass served from the cache
+        _, predictions = model.forward(_select(clips, [0, 1]), boxes, *args, clip_keys=["a", "b"])
+        for p, e in zip(predictions, expected):
+            assert (p["verb_scores"] == e["verb_scores"]).all()
+            assert (p["ttcs"] == e["ttcs"]).all()
+
+
+def _grouped_examples():
+    """Test examples grouped by clip, as returned with EGO4D_STA.GROUP_BY_FRAME"""
+    clips = _clips(3, seed=1)
+    rng = np.random.RandomState(0)
+    groups = []
+    for g, num_examples in enumerate([3, 1, 2]):
+        group = []
+        for i in range(num_examples):
+            num_boxes = rng.randint(1, 4)
+            boxes = np.sort(rng.rand(num_boxes, 2, 2) * CROP_SIZE, axis=1).reshape(num_boxes, 4)[:, [0, 2, 1, 3]]
+            extra_data = {
+                "orig_pred_boxes": boxes * 4,
+                "pred_object_scores": rng.rand(num_boxes),
+                "pred_object_labels": rng.randint(0, 10, num_boxes),
+                "clip_key": "video_{:07d}".format(g),
+            }
+            imgs = [pathway[g] for pathway in clips]
+            group.append(("uid_{}_{}".format(g, i), imgs, boxes, np.array([]), np.array([]), extra_data))
+        groups.append(group)
+    return groups
+
+
+@pytest.mark.parametrize("use_clip_keys", [False, True])
+@torch.no_grad()
+def test_forward_with_grouped_clips(use_clip_keys):
+    model = _model()
+    groups = _grouped_examples()
+
+    detections = {}
+    for batch in [[example for group in groups for example in group], groups]:
+        uids, inputs, pred_boxes, _, _, extra_data = sta_collate(batch)
+        dets, predictions = model.forward(
+            inputs,
+            pred_boxes,
+            extra_data["orig_pred_boxes"],
+            extra_data["pred_object_labels"],
+            extra_data["pred_object_scores"],
+            clip_keys=extra_data["clip_key"] if use_clip_keys else None,
+            clip_index=extra_data.get("clip_index"),
+        )
+        detections[len(inputs[0])] = dict(zip(uids, zip(dets, predictions)))
+
+    # the backbone runs on 6 clips without grouping, 3 with it
+    assert set(detections) == {6, 3}
+    ungrouped, grouped = detections[6], detections[3]
+    assert ungrouped.keys() == grouped.keys()
+    for uid in ungrouped:
+        (det, prediction), (expected_det, expected_prediction) = grouped[uid], ungrouped[uid]
+        np.testing.assert_array_equal(det["boxes"], expected_det["boxes"])
+        np.testing.assert_array_equal(det["nouns"], expected_det["nouns"])
+        np.testing.assert_array_equal(det["verbs"], expected_det["verbs"])
+        # the backbone runs on batches of different sizes
+        np.testing.assert_allclose(prediction["verb_scores"], expected_prediction["verb_scores"], rtol=0, atol=1e-5)
+        np.testing.assert_allclose(det["ttcs"], expected_det["ttcs"], rtol=0, atol=1e-5)
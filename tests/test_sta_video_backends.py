@@ -0,0 +1,143 @@
+import json
+from pathlib import Path
+
+import av
+import numpy as np
+import pytest
+import torch
+
+from ego4d_forecasting.config.defaults import get_cfg
+from ego4d_forecasting.datasets.short_term_anticipation import (
+    Ego4DHLMDB,
+    Ego4dShortTermAnticipation,
+    PyAVVideoReader,
+    build_keyframe_index,
+    plan_decode,
+)
+
+CONFIG = Path(__file__).parents[1] / "configs" / "Ego4dShortTermAnticipation" / "SLOWFAST_32x1_8x4_R50.yaml"
+
+VIDEO_ID = "video"
+NUM_FRAMES = 64
+HEIGHT, WIDTH = 96, 128
+FPS = 30
+
+# the first two clips are clamped at the start of the video
+FRAME_NUMBERS = [0, 5, 31, 40, NUM_FRAMES - 1]
+
+
+def _write_video(path, gop_size=None):
+    """Writes a video whose frames differ by their brightness, so that shifted frames are detected"""
+    gradient = np.tile(np.linspace(0, 40, WIDTH, dtype=np.float32), (HEIGHT, 1))
+    with av.open(str(path), mode="w") as container:
+        stream = container.add_stream("libx264", rate=FPS)
+        stream.width, stream.height = WIDTH, HEIGHT
+        stream.pix_fmt = "yuv420p"
+        if gop_size is not None:
+            # fixed keyframe interval
+            stream.codec_context.gop_size = gop_size
+            stream.options = {"keyint_min": str(gop_size), "sc_threshold": "0"}
+        for i in range(NUM_FRAMES):
+            img = np.repeat((gradient + 20 + (i * 7) % 180)[..., None], 3, axis=2).astype(np.uint8)
+            img[..., 0] //= 2
+            frame = av.VideoFrame.from_ndarray(img, format="rgb24")
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+
+
+@pytest.fixture(scope="module")
+def sta_data(tmp_path_factory):
+    root = tmp_path_factory.mktemp("sta")
+    video_dir = root / "videos"
+    video_dir.mkdir()
+    _write_video(video_dir / (VIDEO_ID + ".mp4"))
+
+    # the frames of the video, stored in the LMDBs as by dump_frames_to_lmdb_files.py
+    frames = PyAVVideoReader(str(video_dir / (VIDEO_ID + ".mp4")))[list(range(NUM_FRAMES))]
+    Ego4DHLMDB(root / "lmdb", map_size=2**28).put_batch(VIDEO_ID, list(range(NUM_FRAMES)), frames)
+
+    annotations = [
+        {
+            "uid": "uid_{}".format(i),
+            "video_uid": VIDEO_ID,
+            "frame": frame_number,
+            "objects": [{"box": [10.0, 10.0, 60.0, 50.0], "noun_category_id": 0, "verb_category_id": 0, "time_to_contact": 0.5}],
+        }
+        for i, frame_number in enumerate(FRAME_NUMBERS)
+    ]
+    metadata = {VIDEO_ID: {"frame_width": WIDTH, "frame_height": HEIGHT, "fps": FPS}}
+    with open(root / "fho_sta_val.json", "w") as f:
+        json.dump({"info": {"video_metadata": metadata}, "annotations": annotations}, f)
+    with open(root / "object_detections.json", "w") as f:
+        json.dump({a["uid"]: [{"box": [20.0, 20.0, 70.0, 60.0], "score": 0.9, "noun_category_id": 0}] for a in annotations}, f)
+    return root
+
+
+def _dataset(root, backend):
+    cfg = get_cfg()
+    cfg.merge_from_file(str(CONFIG))
+    cfg.EGO4D_STA.ANNOTATION_DIR = str(root)
+    cfg.EGO4D_STA.OBJ_DETECTIONS = str(root / "object_detections.json")
+    cfg.EGO4D_STA.RGB_LMDB_DIR = str(root / "lmdb")
+    cfg.EGO4D_STA.VIDEO_DIR = str(root / "videos")
+    cfg.EGO4D_STA.VIDEO_LOAD_BACKEND = backend
+    return Ego4dShortTermAnticipation(cfg, "val")
+
+
+@pytest.mark.parametrize("max_open_containers", [0, 4])
+def test_pytorchvideo_frames_match_lmdb_frames(sta_data, max_open_containers):
+    lmdb_dataset = _dataset(sta_data, "lmdb")
+    video_dataset = _dataset(sta_data, "pytorchvideo")
+    video_dataset.cfg.EGO4D_STA.PYAV_MAX_OPEN_CONTAINERS = max_open_containers
+    reader = PyAVVideoReader(str(sta_data / "videos" / (VIDEO_ID + ".mp4")))
+
+    for frame_number in FRAME_NUMBERS:
+        indices = lmdb_dataset._sample_frames(frame_number)
+        assert len(indices) == lmdb_dataset.cfg.DATA.NUM_FRAMES
+        assert indices[-1] == frame_number
+        if frame_number < len(indices):
+            assert np.all(indices[: len(indices) - frame_number] == 0)
+
+        # C T H W, RGB
+        clip = video_dataset._load_frames(VIDEO_ID, frame_number, FPS)
+        assert clip.shape == (3, len(indices), HEIGHT, WIDTH)
+
+        # same pixels as the decoded frames stored in the LMDBs
+        decoded = reader[sorted(set(indices.tolist()))]
+        decoded = dict(zip(sorted(set(indices.tolist())), decoded))
+        expected = np.stack([decoded[i][..., ::-1] for i in indices])
+        assert torch.equal(clip.permute(1, 2, 3, 0), torch.from_numpy(expected.copy()).float())
+
+        # and close to the frames read from the LMDBs, up to their JPEG compression
+        # (consecutive frames differ by 7 levels)
+        lmdb_frames = np.stack(lmdb_dataset._load_frames(VIDEO_ID, frame_number, FPS))[..., ::-1]
+        error = np.abs(clip.permute(1, 2, 3, 0).numpy() - lmdb_frames).mean(axis=(1, 2, 3))
+        assert error.max() < 2.0
+
+
+def test_keyframe_index_decode_plan(tmp_path):
+    path = tmp_path / "video.mp4"
+    _write_video(path, gop_size=16)
+    build_keyframe_index(path, tmp_path / "video.npz")
+    reader = PyAVVideoReader(str(path), keyframe_index=tmp_path / "video.npz")
+    assert len(reader.keyframe_index["pts"]) == NUM_FRAMES // 16
+
+    # frames are decoded from the preceding keyframe
+    assert reader.decode_cost([16, 20]) == 5
+    assert reader.decode_cost([20, 24]) == 9
+    assert reader.decode_cost([5]) == 6
+
+    # requests in the same group of pictures are decoded together, others after a seek
+    frame_lists = [[2, 3], [40, 41], [10, 12], [49]]
+    assert plan_decode(frame_lists, decode_cost=reader.decode_cost) == [
+        ([2, 3, 10, 12], [0, 2]),
+        ([40, 41], [1]),
+        ([49], [3]),
+    ]
+    assert plan_decode(frame_lists) == [([2, 3], [0]), ([10, 12], [2]), ([40, 41], [1]), ([49], [3])]
+
+    batch = reader.get_batch(frame_lists)
+    for frames, imgs in zip(frame_lists, batch):
+        assert all(np.array_equal(a, b) for a, b in zip(imgs, PyAVVideoReader(str(path))[frames]))
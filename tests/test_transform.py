@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+import torch
+
+from ego4d_forecasting.utils import transform
+
+# The fused transforms interpolate and combine the color transforms in a different
+# order than the reference ones, which changes the floating point rounding only:
+# tolerances of the pixel values in [0, 255] after scaling and cropping, and of the
+# normalized pixel values after color jittering.
+SPATIAL_ATOL = 1e-2
+COLOR_ATOL = 1e-5
+
+PCA_EIGVAL = [0.225, 0.224, 0.229]
+PCA_EIGVEC = [
+    [-0.5675, 0.7192, 0.4009],
+    [-0.5808, -0.0045, -0.8140],
+    [-0.5836, -0.6948, 0.4203],
+]
+MEAN = [0.45, 0.45, 0.45]
+STD = [0.225, 0.225, 0.225]
+
+
+def _images(height, width, num_frames=4, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    return torch.randint(0, 256, (num_frames, 3, height, width), dtype=torch.uint8, generator=generator)
+
+
+def _boxes():
+    return np.array([[10.0, 20.0, 150.0, 120.0], [0.0, 0.0, 199.0, 99.0]])
+
+
+@pytest.mark.parametrize("shape", [(100, 200), (200, 100), (128, 128)])
+@pytest.mark.parametrize("seed", range(4))
+def test_random_short_side_scale_jitter_crop(shape, seed):
+    images = _images(*shape, seed=seed)
+
+    np.random.seed(seed)
+    expected, expected_boxes = transform.random_short_side_scale_jitter(images.float(), 112, 160, boxes=_boxes())
+    expected, expected_boxes = transform.random_crop(expected, 112, boxes=expected_boxes)
+    expected_state = np.random.rand()
+
+    np.random.seed(seed)
+    images, boxes = transform.random_short_side_scale_jitter_crop(images, 112, 160, size=112, boxes=_boxes())
+
+    assert np.random.rand() == expected_state
+    assert images.shape == expected.shape
+    torch.testing.assert_close(images, expected, rtol=0, atol=SPATIAL_ATOL)
+    np.testing.assert_allclose(boxes, expected_boxes)
+
+
+@pytest.mark.parametrize("spatial_idx", [0, 1, 2])
+def test_random_short_side_scale_jitter_uniform_crop(spatial_idx):
+    images = _images(120, 180)
+
+    np.random.seed(0)
+    expected, expected_boxes = transform.random_short_side_scale_jitter(images.float(), 128, 128, boxes=_boxes())
+    expected, expected_boxes = transform.uniform_crop(expected, 128, spatial_idx, boxes=expected_boxes)
+
+    np.random.seed(0)
+    images, boxes = transform.random_short_side_scale_jitter_crop(
+        images, 128, 128, size=128, spatial_idx=spatial_idx, boxes=_boxes()
+    )
+
+    torch.testing.assert_close(images, expected, rtol=0, atol=SPATIAL_ATOL)
+    np.testing.assert_allclose(boxes, expected_boxes)
+
+
+def test_random_short_side_scale_jitter_without_crop():
+    images = _images(120, 180)
+
+    np.random.seed(0)
+    expected, expected_boxes = transform.random_short_side_scale_jitter(images.float(), 128, 128, boxes=_boxes())
+
+    np.random.seed(0)
+    images, boxes = transform.random_short_side_scale_jitter_crop(images, 128, 128, boxes=_boxes())
+
+    torch.testing.assert_close(images, expected, rtol=0, atol=SPATIAL_ATOL)
+    np.testing.assert_allclose(boxes, expected_boxes)
+
+
+@pytest.mark.parametrize("jitter", [0.4, 0.0])
+@pytest.mark.parametrize("seed", range(4))
+def test_color_jitter_normalization_affine(jitter, seed):
+    images = _images(32, 48, seed=seed).float()
+
+    np.random.seed(seed)
+    expected = transform.color_jitter(images / 255.0, img_brightness=jitter, img_contrast=jitter, img_saturation=jitter)
+    expected = transform.lighting_jitter(expected, 0.1, PCA_EIGVAL, PCA_EIGVEC)
+    expected = transform.color_normalization(expected, MEAN, STD)
+    expected_state = np.random.rand()
+
+    np.random.seed(seed)
+    channel_means = images.mean(dim=(2, 3)).double().numpy() / 255.0
+    weight, bias = transform.color_jitter_affine(
+        channel_means,
+        img_brightness=jitter,
+        img_contrast=jitter,
+        img_saturation=jitter,
+        alphastd=0.1,
+        eigval=PCA_EIGVAL,
+        eigvec=PCA_EIGVEC,
+    )
+    images = transform.color_normalization_affine(images, MEAN, STD, weight=weight, bias=bias, scale=1.0 / 255.0)
+
+    assert np.random.rand() == expected_state
+    torch.testing.assert_close(images, expected, rtol=0, atol=COLOR_ATOL)
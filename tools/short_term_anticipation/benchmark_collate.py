@@ -0,0 +1,100 @@
+from argparse import ArgumentParser
+import pickle
+import time
+import numpy as np
+import torch
+import torch.multiprocessing  # registers the reductions of tensors to shared memory
+from multiprocessing.reduction import ForkingPickler
+from torch.utils.data import Dataset, DataLoader
+from ego4d_forecasting.datasets.loader import sta_collate, packed_sta_collate, unpack_sta_batch
+
+parser = ArgumentParser(description="Measures the size of the STA batches sent by the data loader workers to the main process, and the time to unpickle them, with sta_collate and packed_sta_collate")
+
+parser.add_argument('--num_batches', type=int, default=20)
+parser.add_argument('--batch_size', type=int, default=8)
+parser.add_argument('--num_frames', type=int, default=32)
+parser.add_argument('--alpha', type=int, default=4, help="frame rate ratio of the Fast and Slow pathways")
+parser.add_argument('--crop_size', type=int, default=224)
+parser.add_argument('--max_boxes', type=int, default=20, help="maximum number of detections per example")
+parser.add_argument('--split', type=str, default='val', choices=['train', 'val', 'test'])
+parser.add_argument('--raw_clips', action='store_true', help="uint8 clips, as with EGO4D_STA.DEVICE_AUGMENTATION")
+parser.add_argument('--workers', type=int, default=1)
+parser.add_argument('--seed', type=int, default=0)
+
+args = parser.parse_args()
+
+class SyntheticSTADataset(Dataset):
+    """Random examples in the format of Ego4dShortTermAnticipation"""
+    def __len__(self):
+        return args.num_batches * args.batch_size
+
+    def __getitem__(self, index):
+        rng = np.random.RandomState(args.seed + index)
+        n = rng.randint(1, args.max_boxes + 1)
+        size = args.crop_size
+        if args.raw_clips:
+            imgs = [torch.from_numpy(rng.randint(0, 256, (args.num_frames, 320, 568, 3), dtype=np.uint8))]
+        else:
+            fast = torch.from_numpy(rng.randn(3, args.num_frames, size, size).astype(np.float32))
+            imgs = [fast[:, ::args.alpha].clone(), fast]
+        boxes = np.sort(rng.rand(n, 2, 2) * size, axis=1).reshape(n, 4)[:, [0, 2, 1, 3]]
+        extra_data = {
+            'orig_pred_boxes': boxes * 5,
+            'pred_object_scores': rng.rand(n),
+            'pred_object_labels': rng.randint(0, 87, n),
+        }
+        if args.split == 'test':
+            verb_labels, ttc_targets = np.array([]), np.array([])
+        else:
+            m = rng.randint(1, 4)
+            verb_labels, ttc_targets = rng.randint(-1, 74, n), rng.rand(n).astype(np.float32)
+            extra_data['gt_detections'] = {
+                "boxes": boxes[:m] * 5,
+                "nouns": rng.randint(0, 87, m),
+                "verbs": rng.randint(0, 74, m),
+                "ttcs": rng.rand(m),
+            }
+        if args.raw_clips:
+            extra_data['spatial_params'] = (320, 568, 256, 454, 16, 100, False)
+        if args.split != 'train':
+            # two examples per frame
+            extra_data['clip_key'] = "video_{:07d}".format(index // 2)
+        return "uid_{}".format(index), imgs, boxes, verb_labels, ttc_targets, extra_data
+
+def pickled(collate_fn):
+    """Collates in the worker and returns the batch as pickled for the main process"""
+    def collate(batch):
+        return bytes(ForkingPickler.dumps(collate_fn(batch)))
+    return collate
+
+def benchmark(collate_fn, unpack=None):
+    loader = DataLoader(SyntheticSTADataset(), batch_size=args.batch_size, num_workers=args.workers, collate_fn=pickled(collate_fn))
+    num_bytes, clip_bytes, unpickle_time, unpack_time = 0, 0, 0.0, 0.0
+    for data in loader:
+        num_bytes += len(data)
+        start = time.perf_counter()
+        batch = pickle.loads(data)
+        unpickle_time += time.perf_counter() - start
+        # shared memory holding the clips, also copied to the training device
+        clip_bytes += sum(x.numel() * x.element_size() for x in batch[1])
+        if unpack is not None:
+            start = time.perf_counter()
+            batch = unpack(batch)
+            unpack_time += time.perf_counter() - start
+    n = args.num_batches
+    return num_bytes / n, clip_bytes / n / 2**20, unpickle_time / n, unpack_time / n
+
+## check that unpacked batches are the same as the ones of sta_collate
+examples = [SyntheticSTADataset()[i] for i in range(args.batch_size)]
+reference, unpacked = sta_collate(examples), unpack_sta_batch(packed_sta_collate(examples))
+same_boxes = all(torch.equal(a, b) for a, b in zip(reference[2], unpacked[2]))
+max_error = max((a.float() - b).abs().max().item() for a, b in zip(reference[1], unpacked[1]))
+print("Boxes are identical: {}, maximum error of the clips: {:.4f}".format(same_boxes, max_error))
+
+print("{} batches of {} {} examples, {} workers".format(args.num_batches, args.batch_size, args.split, args.workers))
+# unpack_sta_batch converts the fp16 clips to float32, on the training device when
+# called by ShortTermAnticipationTask but on the CPU here
+print("{:20s} {:>12s} {:>10s} {:>12s} {:>16s}".format("collate", "bytes/batch", "clips MB", "unpickle ms", "unpack (CPU) ms"))
+for name, collate_fn, unpack in [("sta_collate", sta_collate, None), ("packed_sta_collate", packed_sta_collate, unpack_sta_batch)]:
+    num_bytes, clip_mb, unpickle_time, unpack_time = benchmark(collate_fn, unpack)
+    print("{:20s} {:12.0f} {:10.1f} {:12.2f} {:16.2f}".format(name, num_bytes, clip_mb, unpickle_time * 1000, unpack_time * 1000))
@@ -0,0 +1,100 @@
+from argparse import ArgumentParser
+from pathlib import Path
+import itertools
+import tempfile
+import time
+import av
+import numpy as np
+from torch.utils.data import Dataset, DataLoader
+from ego4d_forecasting.datasets.short_term_anticipation import PyAVVideoReader, _DECORD_READER_CACHE
+
+parser = ArgumentParser(description="Measures the throughput of the pyav and decord STA backends for combinations of decoder threads and data loading workers")
+
+parser.add_argument('--path_to_videos', type=Path, default=None, help="directory of mp4 videos. If not given, synthetic videos are generated")
+parser.add_argument('--backends', type=str, nargs='+', default=['pyav', 'decord'], choices=['pyav', 'decord'])
+parser.add_argument('--thread_types', type=str, nargs='+', default=['SLICE', 'FRAME'], help="decoder threading of the pyav backend (EGO4D_STA.VIDEO_DECODER_THREAD_TYPE)")
+parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4], help="decoder threads (EGO4D_STA.VIDEO_DECODER_THREADS)")
+parser.add_argument('--workers', type=int, nargs='+', default=[0, 2, 4], help="data loading workers (DATA_LOADER.NUM_WORKERS)")
+parser.add_argument('--num_samples', type=int, default=64)
+parser.add_argument('--num_videos', type=int, default=4)
+parser.add_argument('--num_frames', type=int, default=32)
+parser.add_argument('--max_open_containers', type=int, default=8)
+parser.add_argument('--synthetic_length', type=int, default=600, help="number of frames of the synthetic videos")
+parser.add_argument('--seed', type=int, default=0)
+
+args = parser.parse_args()
+
+rng = np.random.RandomState(args.seed)
+
+def make_video(path, num_frames, height=320, width=568, fps=30):
+    with av.open(str(path), mode="w") as container:
+        stream = container.add_stream("libx264", rate=fps)
+        stream.height = height
+        stream.width = width
+        stream.pix_fmt = "yuv420p"
+        x = np.arange(width)[None, :]
+        y = np.arange(height)[:, None]
+        for i in range(num_frames):
+            img = np.stack([(x + 2 * i) % 256 + 0 * y, (y + i) % 256 + 0 * x, (x + y + 3 * i) % 256], axis=-1).astype(np.uint8)
+            for packet in stream.encode(av.VideoFrame.from_ndarray(img, format="rgb24")):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+
+tmp_dir = None
+if args.path_to_videos is not None:
+    videos = sorted(args.path_to_videos.glob("*.mp4"))
+    videos = [videos[i] for i in rng.permutation(len(videos))[:args.num_videos]]
+else:
+    tmp_dir = tempfile.TemporaryDirectory()
+    videos = [Path(tmp_dir.name) / "video_{}.mp4".format(i) for i in range(args.num_videos)]
+    for v in videos:
+        make_video(v, args.synthetic_length)
+
+lengths = {}
+for v in videos:
+    with av.open(str(v)) as container:
+        lengths[v] = container.streams.video[0].frames
+
+samples = []
+for _ in range(args.num_samples):
+    v = videos[rng.randint(len(videos))]
+    frame_number = rng.randint(args.num_frames, lengths[v])
+    samples.append((str(v), np.arange(frame_number - args.num_frames + 1, frame_number + 1)))
+
+class DecodingDataset(Dataset):
+    """Reads the samples as _load_frames_pyav and _load_frames_decord, reusing readers"""
+    def __init__(self, backend, thread_type, threads):
+        self.backend = backend
+        self.thread_type = thread_type
+        self.threads = threads
+
+    def __len__(self):
+        return len(samples)
+
+    def __getitem__(self, index):
+        video, frames = samples[index]
+        if self.backend == 'pyav':
+            vr = PyAVVideoReader(video, height=320, max_open_containers=args.max_open_containers, thread_type=self.thread_type, thread_count=self.threads)
+            return len(vr[frames])
+        else:
+            vr = _DECORD_READER_CACHE.get((video, 320, 568, self.threads), max_size=args.max_open_containers)
+            return len(vr.get_batch(frames))
+
+configurations = []
+for backend in args.backends:
+    thread_types = args.thread_types if backend == 'pyav' else [None]
+    configurations += [(backend,) + c for c in itertools.product(thread_types, args.threads, args.workers)]
+
+print("Reading {} clips of {} frames from {} videos".format(args.num_samples, args.num_frames, len(videos)))
+print("{:8s} {:12s} {:>8s} {:>8s} {:>12s}".format("backend", "thread type", "threads", "workers", "samples/sec"))
+for backend, thread_type, threads, workers in configurations:
+    loader = DataLoader(DecodingDataset(backend, thread_type, threads), batch_size=None, num_workers=workers)
+    start = time.perf_counter()
+    for _ in loader:
+        pass
+    elapsed = time.perf_counter() - start
+    print("{:8s} {:12s} {:8d} {:8d} {:12.2f}".format(backend, thread_type or "-", threads, workers, args.num_samples / elapsed))
+
+if tmp_dir is not None:
+    tmp_dir.cleanup()
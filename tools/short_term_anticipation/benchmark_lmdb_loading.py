@@ -0,0 +1,64 @@
+from argparse import ArgumentParser
+from pathlib import Path
+import time
+import numpy as np
+from tqdm import tqdm
+from ego4d_forecasting.datasets.short_term_anticipation import Ego4DHLMDB
+
+parser = ArgumentParser(description="Measures the throughput of STA context window reads from the per-video LMDBs")
+
+parser.add_argument('path_to_lmdbs', type=Path)
+parser.add_argument('--num_samples', type=int, default=500)
+parser.add_argument('--num_videos', type=int, default=32, help="number of videos samples are drawn from")
+parser.add_argument('--context_frames', type=int, default=32)
+parser.add_argument('--max_open_envs', type=int, default=16)
+parser.add_argument('--decode_threads', type=int, default=4)
+parser.add_argument('--reduce', type=int, default=2, choices=[2, 4, 8], help="downscaling factor of the reduced resolution decoding")
+parser.add_argument('--seed', type=int, default=0)
+
+args = parser.parse_args()
+
+rng = np.random.RandomState(args.seed)
+
+## Sample the context windows to read
+parents = sorted([p.name for p in args.path_to_lmdbs.iterdir() if p.is_dir()])
+parents = [parents[i] for i in rng.permutation(len(parents))[:args.num_videos]]
+
+l = Ego4DHLMDB(args.path_to_lmdbs, readonly=True, lock=False, max_open_envs=len(parents))
+frames_per_video = {}
+for parent in parents:
+    with l._get_parent(parent) as env:
+        with env.begin() as txn:
+            frames_per_video[parent] = np.array(sorted(int(k.decode().split('_')[-1]) for k in txn.cursor().iternext(values=False)))
+l.close()
+
+samples = []
+for _ in range(args.num_samples):
+    video_id = parents[rng.randint(len(parents))]
+    frames = frames_per_video[video_id]
+    last = rng.randint(min(args.context_frames, len(frames)) - 1, len(frames))
+    samples.append((video_id, frames[max(0, last - args.context_frames + 1):last + 1]))
+
+print("Reading {} context windows of {} frames from {} videos".format(args.num_samples, args.context_frames, len(parents)))
+
+def benchmark(max_open_envs, stack=False, decode_threads=0, reduce=1):
+    l = Ego4DHLMDB(args.path_to_lmdbs, readonly=True, lock=False, max_open_envs=max_open_envs, decode_threads=decode_threads)
+    start = time.perf_counter()
+    for video_id, frames in tqdm(samples, leave=False):
+        l.get_batch(video_id, frames, stack=stack, reduce=reduce)
+    elapsed = time.perf_counter() - start
+    hit_rate = l.env_cache.hit_rate() if l.env_cache is not None else 0.0
+    l.close()
+    return args.num_samples / elapsed, hit_rate
+
+configurations = [
+    ("open per call", dict(max_open_envs=0)),
+    ("env cache (max_open_envs={})".format(args.max_open_envs), dict(max_open_envs=args.max_open_envs)),
+    ("env cache + decode to array", dict(max_open_envs=args.max_open_envs, stack=True)),
+    ("env cache + {} decode threads".format(args.decode_threads), dict(max_open_envs=args.max_open_envs, stack=True, decode_threads=args.decode_threads)),
+    ("env cache + decode to array at 1/{}".format(args.reduce), dict(max_open_envs=args.max_open_envs, stack=True, reduce=args.reduce)),
+]
+
+for name, kwargs in configurations:
+    samples_per_sec, hit_rate = benchmark(**kwargs)
+    print("{:40s} {:8.2f} samples/sec (env cache hit rate {:.2%})".format(name, samples_per_sec, hit_rate))
@@ -0,0 +1,117 @@
+from argparse import ArgumentParser
+from types import SimpleNamespace
+import multiprocessing
+import resource
+import time
+import tracemalloc
+import numpy as np
+from ego4d_forecasting.datasets import cv2_transform
+from ego4d_forecasting.datasets.short_term_anticipation import Ego4dShortTermAnticipation
+
+parser = ArgumentParser(description="Measures time and peak memory of the conversion of STA clips to normalized tensors (OpenCV preprocessing)")
+
+parser.add_argument('--num_samples', type=int, default=50)
+parser.add_argument('--num_frames', type=int, default=32)
+parser.add_argument('--height', type=int, default=256)
+parser.add_argument('--width', type=int, default=454)
+parser.add_argument('--split', type=str, default='val', choices=['train', 'val'])
+parser.add_argument('--color_augmentation', action='store_true')
+parser.add_argument('--bgr', action='store_true')
+
+args = parser.parse_args()
+
+# the attributes read by Ego4dShortTermAnticipation._images_and_boxes_normalization_cv2
+dataset = SimpleNamespace(
+    _split=args.split,
+    _use_color_augmentation=args.color_augmentation,
+    _pca_jitter_only=False,
+    _pca_eigval=[0.225, 0.224, 0.229],
+    _pca_eigvec=[[-0.5675, 0.7192, 0.4009], [-0.5808, -0.0045, -0.8140], [-0.5836, -0.6948, 0.4203]],
+    _data_mean=[0.45, 0.45, 0.45],
+    _data_std=[0.225, 0.225, 0.225],
+    _use_bgr=args.bgr,
+)
+
+def before(imgs, boxes):
+    """The per-frame implementation replaced by cv2_transform.images_to_clip"""
+    imgs = [cv2_transform.HWC2CHW(img) for img in imgs]
+    imgs = [img / 255.0 for img in imgs]
+    imgs = [
+        np.ascontiguousarray(
+            img.reshape((3, imgs[0].shape[1], imgs[0].shape[2]))
+        ).astype(np.float32)
+        for img in imgs
+    ]
+    if dataset._split == "train" and dataset._use_color_augmentation:
+        if not dataset._pca_jitter_only:
+            imgs = cv2_transform.color_jitter_list(
+                imgs, img_brightness=0.4, img_contrast=0.4, img_saturation=0.4
+            )
+        imgs = cv2_transform.lighting_list(
+            imgs,
+            alphastd=0.1,
+            eigval=np.array(dataset._pca_eigval).astype(np.float32),
+            eigvec=np.array(dataset._pca_eigvec).astype(np.float32),
+        )
+    imgs = [
+        cv2_transform.color_normalization(
+            img,
+            np.array(dataset._data_mean, dtype=np.float32),
+            np.array(dataset._data_std, dtype=np.float32),
+        )
+        for img in imgs
+    ]
+    imgs = np.concatenate([np.expand_dims(img, axis=1) for img in imgs], axis=1)
+    if not dataset._use_bgr:
+        imgs = imgs[::-1, ...]
+    imgs = np.ascontiguousarray(imgs)
+    boxes = cv2_transform.clip_boxes_to_image(boxes[0], imgs[0].shape[1], imgs[0].shape[2])
+    return imgs, boxes
+
+def after(imgs, boxes):
+    imgs, boxes = Ego4dShortTermAnticipation._images_and_boxes_normalization_cv2(dataset, imgs, boxes)
+    return imgs.numpy(), boxes
+
+def make_sample(rng):
+    # spatially transformed frames are float32 with integer values
+    imgs = [rng.randint(0, 256, (args.height, args.width, 3)).astype(np.float32) for _ in range(args.num_frames)]
+    boxes = [rng.uniform(0, min(args.height, args.width), (5, 4))]
+    return imgs, boxes
+
+def run(fn, queue):
+    rng = np.random.RandomState(0)
+    samples = [make_sample(rng) for _ in range(2)]
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    tracemalloc.start()
+    elapsed = 0
+    for i in range(args.num_samples):
+        imgs, boxes = samples[i % len(samples)]
+        start = time.perf_counter()
+        fn(list(imgs), [boxes[0].copy()])
+        elapsed += time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((elapsed / args.num_samples, peak, (rss_peak - rss_start) * 1024))
+
+## check that both implementations return the same output
+rng = np.random.RandomState(0)
+imgs, boxes = make_sample(rng)
+np.random.seed(0)
+out_before, boxes_before = before(list(imgs), [boxes[0].copy()])
+np.random.seed(0)
+out_after, boxes_after = after(list(imgs), [boxes[0].copy()])
+print("Outputs are identical: {}".format(np.array_equal(out_before, out_after) and np.array_equal(boxes_before, boxes_after)))
+
+print("Clips of {} frames of {}x{} ({} split, color augmentation {})".format(args.num_frames, args.height, args.width, args.split, args.color_augmentation))
+for name, fn in [("before", before), ("after", after)]:
+    # run each implementation in a new process, so that peak RSS values are not shared
+    queue = multiprocessing.Queue()
+    p = multiprocessing.Process(target=run, args=(fn, queue))
+    p.start()
+    seconds, traced_peak, rss_increase = queue.get()
+    p.join()
+    print("{:8s} {:8.2f} ms/sample, peak traced memory {:8.1f} MB, peak RSS increase {:8.1f} MB".format(
+        name, seconds * 1000, traced_peak / 1024 / 1024, rss_increase / 1024 / 1024))
@@ -0,0 +1,125 @@
+from argparse import ArgumentParser
+from pathlib import Path
+import tempfile
+import time
+import av
+import numpy as np
+from tqdm import tqdm
+from ego4d_forecasting.datasets.short_term_anticipation import PyAVVideoReader, build_keyframe_index
+
+parser = ArgumentParser(description="Measures the throughput of STA context window reads from mp4 videos with PyAVVideoReader")
+
+parser.add_argument('--path_to_videos', type=Path, default=None, help="directory of mp4 videos. If not given, synthetic videos are generated")
+parser.add_argument('--num_samples', type=int, default=200)
+parser.add_argument('--num_videos', type=int, default=4, help="number of videos samples are drawn from")
+parser.add_argument('--num_frames', type=int, default=32)
+parser.add_argument('--sampling_rate', type=int, default=1)
+parser.add_argument('--max_open_containers', type=int, default=8)
+parser.add_argument('--batch_size', type=int, default=8, help="number of samples grouped by video and decoded together by the batched configuration")
+parser.add_argument('--max_gap', type=int, default=32, help="maximum number of frames between clips decoded together")
+parser.add_argument('--path_to_keyframe_index', type=Path, default=None, help="directory of the keyframe indexes. If not given, they are built in a temporary directory")
+parser.add_argument('--synthetic_length', type=int, default=600, help="number of frames of the synthetic videos")
+parser.add_argument('--synthetic_size', type=int, nargs=2, default=[320, 568], help="height and width of the synthetic videos")
+parser.add_argument('--seed', type=int, default=0)
+
+args = parser.parse_args()
+
+rng = np.random.RandomState(args.seed)
+
+def make_video(path, num_frames, height, width, fps=30):
+    with av.open(str(path), mode="w") as container:
+        stream = container.add_stream("libx264", rate=fps)
+        stream.height = height
+        stream.width = width
+        stream.pix_fmt = "yuv420p"
+        # moving gradient, so that frames are not trivially compressed
+        x = np.arange(width)[None, :]
+        y = np.arange(height)[:, None]
+        for i in range(num_frames):
+            img = np.stack([(x + 2 * i) % 256 + 0 * y, (y + i) % 256 + 0 * x, (x + y + 3 * i) % 256], axis=-1).astype(np.uint8)
+            for packet in stream.encode(av.VideoFrame.from_ndarray(img, format="rgb24")):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+
+## Collect or generate the videos
+tmp_dir = tempfile.TemporaryDirectory()
+if args.path_to_videos is not None:
+    videos = sorted(args.path_to_videos.glob("*.mp4"))
+    videos = [videos[i] for i in rng.permutation(len(videos))[:args.num_videos]]
+else:
+    videos = [Path(tmp_dir.name) / "video_{}.mp4".format(i) for i in range(args.num_videos)]
+    for v in tqdm(videos, desc="Generating synthetic videos"):
+        make_video(v, args.synthetic_length, *args.synthetic_size)
+
+keyframe_indexes = {}
+for v in tqdm(videos, desc="Indexing keyframes"):
+    if args.path_to_keyframe_index is not None:
+        keyframe_indexes[v] = args.path_to_keyframe_index / (v.stem + '.npz')
+    else:
+        keyframe_indexes[v] = Path(tmp_dir.name) / (v.stem + '.npz')
+        build_keyframe_index(v, keyframe_indexes[v])
+
+lengths = {}
+for v in videos:
+    with av.open(str(v)) as container:
+        lengths[v] = container.streams.video[0].frames
+
+## Sample the context windows to read, as Ego4dShortTermAnticipation._load_frames_pyav
+span = args.num_frames * args.sampling_rate
+samples = []
+for _ in range(args.num_samples):
+    v = videos[rng.randint(len(videos))]
+    # full windows, as PyAVVideoReader does not support repeated frames
+    frame_number = rng.randint(span, lengths[v])
+    frames = frame_number - np.arange(span, step=args.sampling_rate)[::-1]
+    samples.append((v, frames))
+
+print("Reading {} context windows of {} frames from {} videos".format(args.num_samples, args.num_frames, len(videos)))
+
+## Batches of samples grouped by video, as STAVideoBatchSampler
+order = sorted(range(len(samples)), key=lambda i: (str(samples[i][0]), samples[i][1][-1]))
+batches = [order[i:i + args.batch_size] for i in range(0, len(order), args.batch_size)]
+
+def benchmark(max_open_containers, keyframe_index=False, batch_decode=False, decode_resize=False):
+    stats = {}
+    start = time.perf_counter()
+    if batch_decode:
+        for batch in tqdm(batches, leave=False):
+            for v in sorted(set(samples[i][0] for i in batch)):
+                vr = PyAVVideoReader(str(v), height=320, max_open_containers=max_open_containers, keyframe_index=keyframe_indexes[v] if keyframe_index else None, stats=stats, decode_resize=decode_resize)
+                vr.get_batch([samples[i][1] for i in batch if samples[i][0] == v], max_gap=args.max_gap)
+    else:
+        for v, frames in tqdm(samples, leave=False):
+            vr = PyAVVideoReader(str(v), height=320, max_open_containers=max_open_containers, keyframe_index=keyframe_indexes[v] if keyframe_index else None, stats=stats, decode_resize=decode_resize)
+            vr[frames]
+    elapsed = time.perf_counter() - start
+    hit_rate = vr.container_cache.hit_rate() if vr.container_cache is not None else 0.0
+    vr.close()
+    return args.num_samples / elapsed, hit_rate, stats
+
+## check that pooled containers return the same frames, seeking back and forth
+v, frames = samples[0]
+reference = PyAVVideoReader(str(v))[frames]
+vr = PyAVVideoReader(str(v), max_open_containers=1)
+vr[frames + span if frames[-1] + span < lengths[v] else frames[:1]]
+pooled = vr[frames]
+vr.close()
+indexed = PyAVVideoReader(str(v), keyframe_index=keyframe_indexes[v])[frames]
+batched = PyAVVideoReader(str(v)).get_batch([frames + span // 2, frames], max_gap=args.max_gap)[1]
+print("Outputs are identical: {}".format(all(np.array_equal(a, b) and np.array_equal(a, c) and np.array_equal(a, d) for a, b, c, d in zip(reference, pooled, indexed, batched))))
+
+configurations = [
+    ("open per call", dict(max_open_containers=0)),
+    ("container pool (max_open_containers={})".format(args.max_open_containers), dict(max_open_containers=args.max_open_containers)),
+    ("container pool + keyframe index", dict(max_open_containers=args.max_open_containers, keyframe_index=True)),
+    ("container pool + decode-time resize", dict(max_open_containers=args.max_open_containers, decode_resize=True)),
+    ("batched decode (batch_size={})".format(args.batch_size), dict(max_open_containers=args.max_open_containers, keyframe_index=True, batch_decode=True)),
+]
+
+for name, kwargs in configurations:
+    samples_per_sec, hit_rate, stats = benchmark(**kwargs)
+    print("{:45s} {:8.2f} samples/sec (container cache hit rate {:.2%}, {:.1f} frames decoded / {:.1f} returned per sample)".format(
+        name, samples_per_sec, hit_rate, stats["frames_decoded"] / args.num_samples, stats["frames_returned"] / args.num_samples))
+
+tmp_dir.cleanup()
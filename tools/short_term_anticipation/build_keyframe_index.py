@@ -0,0 +1,33 @@
+from argparse import ArgumentParser
+from pathlib import Path
+import numpy as np
+from tqdm import tqdm
+from ego4d_forecasting.datasets.short_term_anticipation import build_keyframe_index
+
+parser = ArgumentParser(description="Writes the keyframe index of the videos read with EGO4D_STA.PYAV_KEYFRAME_INDEX_DIR")
+
+parser.add_argument('path_to_videos', type=Path)
+parser.add_argument('path_to_output', type=Path)
+parser.add_argument('--video_uids', type=str, nargs='+', default=None, help="videos to index. If not given, all the mp4 videos are indexed")
+parser.add_argument('--overwrite', action='store_true')
+
+args = parser.parse_args()
+
+args.path_to_output.mkdir(parents=True, exist_ok=True)
+
+if args.video_uids is not None:
+    videos = [args.path_to_videos / (v + '.mp4') for v in args.video_uids]
+else:
+    videos = sorted(args.path_to_videos.glob('*.mp4'))
+
+gop_sizes = []
+for video in tqdm(videos):
+    path_to_index = args.path_to_output / (video.stem + '.npz')
+    if not path_to_index.exists() or args.overwrite:
+        build_keyframe_index(video, path_to_index)
+    with np.load(path_to_index) as index:
+        if len(index['pts']) > 1:
+            gop_sizes.append(np.diff(index['pts']).mean() / index['pt_diff'])
+
+if len(gop_sizes) > 0:
+    print("Indexed {} videos, average distance between keyframes: {:0.1f} frames".format(len(videos), np.mean(gop_sizes)))
@@ -0,0 +1,36 @@
+from argparse import ArgumentParser
+from pathlib import Path
+import json
+import resource
+import time
+from ego4d_forecasting.datasets.sta_index import build_annotation_index, build_detection_index, STAAnnotationIndex, STADetectionIndex
+
+parser = ArgumentParser(description="Converts the STA annotations and object detections to the columnar index read with EGO4D_STA.ANNOTATION_INDEX_DIR")
+
+parser.add_argument('path_to_annotations', type=Path)
+parser.add_argument('path_to_object_detections', type=Path)
+parser.add_argument('path_to_output', type=Path)
+parser.add_argument('--lists', type=str, nargs='+', default=['fho_sta_train.json', 'fho_sta_val.json', 'fho_sta_test_unannotated.json'])
+
+args = parser.parse_args()
+
+for l in args.lists:
+    print("Converting {}".format(l))
+    build_annotation_index(args.path_to_annotations / l, args.path_to_output)
+
+print("Converting {}".format(args.path_to_object_detections.name))
+build_detection_index(args.path_to_object_detections, args.path_to_output)
+
+## compare the time and memory needed to load the json files and the index
+def max_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+rss = max_rss()
+start = time.perf_counter()
+index = STAAnnotationIndex(args.path_to_output, args.lists), STADetectionIndex(args.path_to_output)
+print("Index: loaded in {:0.2f}s, peak RSS increase {:0.1f} MB".format(time.perf_counter() - start, max_rss() - rss))
+
+rss = max_rss()
+start = time.perf_counter()
+data = [json.load(open(args.path_to_annotations / l)) for l in args.lists], json.load(open(args.path_to_object_detections))
+print("Json: loaded in {:0.2f}s, peak RSS increase {:0.1f} MB".format(time.perf_counter() - start, max_rss() - rss))
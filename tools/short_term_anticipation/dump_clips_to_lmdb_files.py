@@ -0,0 +1,93 @@
+from argparse import ArgumentParser
+from pathlib import Path
+import numpy as np
+from tqdm import tqdm
+from torch.utils.data import Dataset, DataLoader
+import json
+import cv2
+from ego4d_forecasting.datasets.short_term_anticipation import PyAVVideoReader, Ego4DHLMDB, Ego4DClipLMDB
+
+parser = ArgumentParser(description="Packs the context window of each STA annotation into a single LMDB record (lmdb_clips backend)")
+
+parser.add_argument('path_to_annotations', type=Path)
+parser.add_argument('path_to_output_lmdbs', type=Path)
+parser.add_argument('--path_to_videos', type=Path, default=None, help="read the frames from the videos")
+parser.add_argument('--path_to_frame_lmdbs', type=Path, default=None, help="repack the frames of the LMDBs created by dump_frames_to_lmdb_files.py (no re-encoding)")
+parser.add_argument('--context_frames', type=int, default=32, help="should be at least NUM_FRAMES x SAMPLING_RATE")
+parser.add_argument('--frame_height', type=int, default=320)
+parser.add_argument('--video_uid', type=str, default=None)
+parser.add_argument('--num_workers', type=int, default=8)
+parser.add_argument('--retry', type=int, default=10)
+
+args = parser.parse_args()
+
+if (args.path_to_videos is None) == (args.path_to_frame_lmdbs is None):
+    parser.error("exactly one of --path_to_videos and --path_to_frame_lmdbs should be given")
+
+class ClipDataset(Dataset):
+    def __init__(self, annotations, clip_template, existing_keys):
+        existing_keys = set(k.decode() for k in existing_keys)
+
+        if args.video_uid is not None:
+            annotations = [a for a in annotations if a["video_uid"] in args.video_uid]
+
+        ## one clip per (video, last frame), skipping the ones already stored
+        self.clips = sorted(set(
+            (ann["video_uid"], ann["frame"]) for ann in annotations
+            if clip_template.format(video_id=ann["video_uid"], frame_number=ann["frame"]) not in existing_keys
+        ))
+
+        self.frame_lmdb = None
+        if args.path_to_frame_lmdbs is not None:
+            self.frame_lmdb = Ego4DHLMDB(args.path_to_frame_lmdbs, readonly=True, lock=False, max_open_envs=16)
+
+        print("Sampled {} clips of {} frames".format(len(self.clips), args.context_frames))
+        print("Skipping {} existing clips".format(len(existing_keys)))
+
+    def __len__(self):
+        return len(self.clips)
+
+    def __getitem__(self, index):
+        video_id, last_frame = self.clips[index]
+        frame_numbers = np.arange(max(0, last_frame - args.context_frames + 1), last_frame + 1)
+
+        for i in range(args.retry):
+            if self.frame_lmdb is not None:
+                data = self.frame_lmdb.get_encoded_batch(video_id, frame_numbers)
+            else:
+                vr = PyAVVideoReader(str(args.path_to_videos / (video_id + '.mp4')), height=args.frame_height)
+                data = vr[frame_numbers]
+            if all(d is not None for d in data):
+                break
+
+        missing = [f for f, d in zip(frame_numbers, data) if d is None]
+        if len(missing) > 0:
+            print(f"WARNING: could not read the following frames from {video_id}:", ", ".join([str(x) for x in missing]))
+            frame_numbers = [f for f, d in zip(frame_numbers, data) if d is not None]
+            data = [d for d in data if d is not None]
+
+        ## encode in the workers
+        data = [bytes(d) if not isinstance(d, np.ndarray) else cv2.imencode('.jpg', d)[1].tobytes() for d in data]
+        return video_id, [int(f) for f in frame_numbers], data
+
+train = json.load(open(args.path_to_annotations / 'fho_sta_train.json'))
+val = json.load(open(args.path_to_annotations / 'fho_sta_val.json'))
+test = json.load(open(args.path_to_annotations / 'fho_sta_test_unannotated.json'))
+
+## Merge all annotations
+annotations = []
+for j in [train, val, test]:
+    annotations += j['annotations']
+
+l = Ego4DClipLMDB(args.path_to_output_lmdbs)
+
+dset = ClipDataset(annotations, l.frame_template, existing_keys=l.get_existing_keys())
+dloader = DataLoader(dset, batch_size=None, num_workers=args.num_workers)
+
+total_bytes = 0
+for video_id, frame_numbers, data in tqdm(dloader):
+    if len(frame_numbers) > 0:
+        l.put_clip(video_id, frame_numbers, data)
+        total_bytes += sum(len(d) for d in data)
+
+print("Written {:0.2f} GB".format(total_bytes/1024/1024/1024))
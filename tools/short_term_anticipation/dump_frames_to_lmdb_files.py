@@ -20,6 +20,9 @@ parser.add_argument('--context_frames', type=int, default=32)
 parser.add_argument('--fname_format', type=str, default="{video_id:s}_{frame_number:07d}")
 parser.add_argument('--frame_height', type=int, default=320)
 parser.add_argument('--video_uid', type=str, default=None)
+parser.add_argument('--decode_resize', action='store_true', help="resize the frames with libswscale while converting them to BGR")
+parser.add_argument('--chunks_per_item', type=int, default=8, help="number of chunks of a video decoded together (see PyAVVideoReader.get_batch)")
+parser.add_argument('--max_gap', type=int, default=32, help="maximum number of frames between chunks decoded together")
 
 args = parser.parse_args()
 
@@ -73,22 +76,39 @@ class PyAVSTADataset(Dataset):
         total_bytes = total_frames*avg_bytes
         total_gigabytes = total_bytes/1024/1024/1024
 
+        ## group the chunks of each video, so that nearby chunks are decoded together
+        self.items = []
+        for k, chunks in itertools.groupby(self.chunks, key=lambda x: x[0]):
+            chunks = [c for _, c in chunks]
+            for i in range(0, len(chunks), args.chunks_per_item):
+                self.items.append((k, chunks[i:i+args.chunks_per_item]))
+
         print("Sampled {} chunks / {} frames in total".format(len(self.chunks), total_frames))
         print("Skipping {} existing keys".format(len(existing_keys)))
         print("Estimated total size: {:0.2f} GB".format(total_gigabytes))
 
     def __len__(self):
-        return(len(self.chunks))
+        return(len(self.items))
 
     def __getitem__(self, index):
-        video_id, frame_numbers = self.chunks[index]
+        video_id, chunks = self.items[index]
 
         frames = {}
 
+        vr = PyAVVideoReader(str(self.path_to_videos / (video_id + '.mp4')), height=args.frame_height, decode_resize=args.decode_resize)
+        for chunk, imgs in zip(chunks, vr.get_batch(chunks, max_gap=args.max_gap)):
+            for f, img in zip(chunk, imgs):
+                if img is not None:
+                    frames[f] = img
+
+        frame_numbers = np.concatenate(chunks)
+
         for i in range(self.retry):
             frame_numbers = np.setdiff1d(frame_numbers, list(frames.keys()))
-            vr = PyAVVideoReader(str(self.path_to_videos / (video_id + '.mp4')), height=args.frame_height)
-            imgs = vr[frame_numbers]
+            if len(frame_numbers)>0:
+                imgs = vr[frame_numbers]
+            else:
+                imgs = []
 
             added=0
             for f, img in zip(frame_numbers, imgs):
@@ -0,0 +1,109 @@
+from argparse import ArgumentParser
+from pathlib import Path
+import numpy as np
+from tqdm import tqdm
+from torch.utils.data import Dataset, DataLoader
+import json
+import time
+from ego4d_forecasting.datasets import cv2_transform
+from ego4d_forecasting.datasets.short_term_anticipation import PyAVVideoReader, Ego4DHLMDB, Ego4DFrameMemmap
+
+parser = ArgumentParser(description="Decodes the context window of each STA annotation into a single memory-mapped uint8 file (npy_mmap backend)")
+
+parser.add_argument('path_to_annotations', type=Path)
+parser.add_argument('path_to_output', type=Path)
+parser.add_argument('--path_to_videos', type=Path, default=None, help="read the frames from the videos")
+parser.add_argument('--path_to_frame_lmdbs', type=Path, default=None, help="read the frames from the LMDBs created by dump_frames_to_lmdb_files.py")
+parser.add_argument('--context_frames', type=int, default=32, help="should be at least NUM_FRAMES x SAMPLING_RATE")
+parser.add_argument('--short_side', type=int, default=320, help="short side the frames are rescaled to")
+parser.add_argument('--splits', type=str, nargs='+', default=['fho_sta_train.json'])
+parser.add_argument('--num_workers', type=int, default=8)
+parser.add_argument('--retry', type=int, default=10)
+
+args = parser.parse_args()
+
+if (args.path_to_videos is None) == (args.path_to_frame_lmdbs is None):
+    parser.error("exactly one of --path_to_videos and --path_to_frame_lmdbs should be given")
+
+class ClipDataset(Dataset):
+    def __init__(self, annotations):
+        ## one clip per (video, last frame)
+        self.clips = sorted(set((ann["video_uid"], ann["frame"]) for ann in annotations))
+
+        self.frame_lmdb = None
+        if args.path_to_frame_lmdbs is not None:
+            self.frame_lmdb = Ego4DHLMDB(args.path_to_frame_lmdbs, readonly=True, lock=False, max_open_envs=16)
+
+        print("Sampled {} clips of {} frames".format(len(self.clips), args.context_frames))
+
+    def __len__(self):
+        return len(self.clips)
+
+    def __getitem__(self, index):
+        video_id, last_frame = self.clips[index]
+        frame_numbers = np.arange(max(0, last_frame - args.context_frames + 1), last_frame + 1)
+
+        for i in range(args.retry):
+            if self.frame_lmdb is not None:
+                imgs = self.frame_lmdb.get_batch(video_id, frame_numbers)
+            else:
+                vr = PyAVVideoReader(str(args.path_to_videos / (video_id + '.mp4')))
+                imgs = vr[frame_numbers]
+            if all(img is not None for img in imgs):
+                break
+        else:
+            print(f"WARNING: could not read the frames of {video_id} ending at {last_frame}, skipping")
+            return video_id, last_frame, int(frame_numbers[0]), None
+
+        imgs = np.stack([cv2_transform.scale(args.short_side, img).astype(np.uint8) for img in imgs])
+        return video_id, last_frame, int(frame_numbers[0]), imgs
+
+annotations = []
+for split in args.splits:
+    annotations += json.load(open(args.path_to_annotations / split))['annotations']
+
+args.path_to_output.mkdir(parents=True, exist_ok=True)
+frame_template = "{video_id:s}_{frame_number:010d}"
+
+dset = ClipDataset(annotations)
+dloader = DataLoader(dset, batch_size=None, num_workers=args.num_workers)
+
+## append the clips to the data file and keep track of where they start
+index = {}
+offset = 0
+with open(args.path_to_output / Ego4DFrameMemmap.DATA_FILE, 'wb') as f:
+    for video_id, last_frame, first_frame, imgs in tqdm(dloader):
+        if imgs is None:
+            continue
+        imgs = np.ascontiguousarray(imgs)
+        f.write(imgs.tobytes())
+        index[frame_template.format(video_id=video_id, frame_number=last_frame)] = [offset, first_frame] + list(imgs.shape[:3])
+        offset += imgs.nbytes
+
+with open(args.path_to_output / Ego4DFrameMemmap.INDEX_FILE, 'w') as f:
+    json.dump(index, f)
+
+## report disk usage and read throughput
+print("Written {} clips, {:0.2f} GB".format(len(index), offset/1024/1024/1024))
+if args.path_to_frame_lmdbs is not None:
+    lmdb_bytes = sum(p.stat().st_size for p in args.path_to_frame_lmdbs.glob('*/*.mdb'))
+    print("Source LMDBs: {:0.2f} GB".format(lmdb_bytes/1024/1024/1024))
+
+mm = Ego4DFrameMemmap(args.path_to_output, frame_template=frame_template)
+windows = []
+for key, (_, first_frame, _, _, _) in mm.index.items():
+    video_id, last_frame = key.rsplit('_', 1)
+    windows.append((video_id, np.arange(first_frame, int(last_frame) + 1)))
+
+start = time.perf_counter()
+for video_id, frames in tqdm(windows, leave=False):
+    # touch the pages, as the dataset would while preprocessing
+    mm.get_batch(video_id, frames).sum()
+print("npy_mmap read throughput: {:0.2f} clips/sec".format(len(windows) / (time.perf_counter() - start)))
+
+if args.path_to_frame_lmdbs is not None:
+    l = Ego4DHLMDB(args.path_to_frame_lmdbs, readonly=True, lock=False, max_open_envs=16)
+    start = time.perf_counter()
+    for video_id, frames in tqdm(windows, leave=False):
+        l.get_batch(video_id, frames, stack=True)
+    print("lmdb read throughput: {:0.2f} clips/sec".format(len(windows) / (time.perf_counter() - start)))